@@ -0,0 +1,273 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Trace the memory allocated by commands.
+
+When L{CommandController.trace_allocations} is C{True}, which the
+C{commandant} entry point sets when the C{COMMANDANT_TRACE_ALLOCATIONS}
+environment variable is set, each command's C{run} method is traced with
+an L{AllocationTracer}.  A report of the memory the command used is
+written to C{stderr} when it finishes.  Commands run by batch and daemon
+builtins, like C{queue} and C{schedule}, are traced in their child
+processes, so each one reports the heap growth it left behind.
+
+C{tracemalloc} is used when it's available, to report the peak traced
+memory and the files and lines that allocated the memory the command
+left behind.  Otherwise, the peak resident set size is taken from
+C{resource.getrusage} and object counts from C{gc} are reported by type.
+"""
+
+import gc
+import os
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from twisted.internet.defer import Deferred
+
+
+TOP_SITES = 10
+
+# The ID of the process tracing a command, used to avoid tracing commands
+# nested in another separately.
+_tracing_pid = None
+
+
+def trace_run(run, name, stream=None):
+    """Wrap a command's C{run} method to trace its allocations.
+
+    If C{run} returns a C{Deferred}, as a L{TwistedCommand}'s may, tracing
+    continues until it fires.  Commands run while another command in the
+    same process is being traced are included in its report.
+
+    @param run: The command's C{run} method.
+    @param name: The name of the command.
+    @param stream: Optionally, the stream to write the report to.
+        Defaults to C{sys.stderr}.
+    @return: A function to use in place of C{run}.
+    """
+
+    def traced_run(*args, **kwargs):
+        if _tracing_pid == os.getpid():
+            return run(*args, **kwargs)
+        tracer = AllocationTracer(name)
+        tracer.start()
+        try:
+            result = run(*args, **kwargs)
+        except:
+            _stop_tracer(None, tracer, stream)
+            raise
+        if isinstance(result, Deferred):
+            result.addBoth(_stop_tracer, tracer, stream)
+        else:
+            _stop_tracer(None, tracer, stream)
+        return result
+
+    return traced_run
+
+
+def _stop_tracer(result, tracer, stream):
+    """Stop C{tracer} and write its report to C{stream}."""
+    tracer.stop()
+    if stream is None:
+        stream = sys.stderr
+    tracer.report(stream)
+    return result
+
+
+def format_size(size, signed=False):
+    """Format a number of bytes for people to read.
+
+    @param size: The number of bytes.
+    @param signed: Set to C{True} to prefix positive sizes with C{+}.
+    """
+    sign = ""
+    if size < 0:
+        sign = "-"
+    elif signed:
+        sign = "+"
+    size = abs(size)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = "GiB"
+    if unit == "B":
+        return "%s%d B" % (sign, size)
+    return "%s%.1f %s" % (sign, size, unit)
+
+
+def get_max_rss():
+    """Get the peak resident set size of this process in bytes.
+
+    @return: The size, or C{None} if it's not available on this platform.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, Mac OS X reports bytes.
+    if sys.platform != "darwin":
+        max_rss *= 1024
+    return max_rss
+
+
+def get_source_path(path):
+    """
+    Get the path of the C{.py} file for a module loaded from C{path}, which
+    may be a compiled C{.pyc} or C{.pyo} file.
+    """
+    return os.path.splitext(path)[0] + ".py"
+
+
+def count_objects():
+    """Count the objects tracked by C{gc}, by type name."""
+    counts = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+class AllocationTracer(object):
+    """Trace the memory allocated between L{start} and L{stop}.
+
+    @ivar name: The name of the command being traced.
+    @ivar peak: The peak memory used while tracing, in bytes, or C{None} if
+        it isn't known.  With C{tracemalloc} this is the peak traced memory
+        allocated since L{start}, and otherwise the peak resident set size
+        of the process.  It isn't known if something else was already
+        tracing with a C{tracemalloc} that can't reset its peak.
+    @ivar growth: The memory left allocated by the traced code, in bytes
+        with C{tracemalloc} and in objects otherwise.
+    @ivar sites: The top allocation sites, as C{(site, size, count)}
+        tuples, largest first.  With C{tracemalloc} a site is a
+        C{filename:lineno} string, and otherwise it's a type name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.peak = None
+        self.growth = None
+        self.sites = []
+        self._stop_tracing = False
+        self._peak_known = True
+        self._start_memory = None
+        self._start_snapshot = None
+        self._start_counts = None
+
+    def start(self):
+        """Start tracing allocations."""
+        global _tracing_pid
+        gc.collect()
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._stop_tracing = True
+            elif _tracing_pid is not None:
+                # This is a child forked while its parent was tracing a
+                # command, so the inherited traces belong to the parent.
+                tracemalloc.clear_traces()
+                self._stop_tracing = True
+            elif hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:
+                # Tracing was started by someone else, and its peak may
+                # have been reached before the command started.
+                self._peak_known = False
+            self._start_snapshot = tracemalloc.take_snapshot()
+            self._start_memory = tracemalloc.get_traced_memory()[0]
+        else:
+            self._start_counts = count_objects()
+        _tracing_pid = os.getpid()
+
+    def stop(self, limit=TOP_SITES):
+        """Stop tracing allocations and record the results.
+
+        @param limit: The number of allocation sites to record.
+        """
+        global _tracing_pid
+        _tracing_pid = None
+        if tracemalloc is not None:
+            if self._peak_known:
+                self.peak = (tracemalloc.get_traced_memory()[1] -
+                             self._start_memory)
+            gc.collect()
+            snapshot = tracemalloc.take_snapshot()
+            self.growth = (tracemalloc.get_traced_memory()[0] -
+                           self._start_memory)
+            if self._stop_tracing:
+                tracemalloc.stop()
+            filters = [tracemalloc.Filter(False, get_source_path(path))
+                       for path in (tracemalloc.__file__, __file__)]
+            statistics = snapshot.filter_traces(filters).compare_to(
+                self._start_snapshot.filter_traces(filters), "lineno")
+            for statistic in statistics:
+                if statistic.size_diff <= 0:
+                    continue
+                frame = statistic.traceback[0]
+                self.sites.append(("%s:%d" % (frame.filename, frame.lineno),
+                                   statistic.size_diff,
+                                   statistic.count_diff))
+        else:
+            self.peak = get_max_rss()
+            gc.collect()
+            counts = count_objects()
+            self.growth = (sum(counts.itervalues()) -
+                           sum(self._start_counts.itervalues()))
+            for name, count in counts.iteritems():
+                count -= self._start_counts.get(name, 0)
+                if count > 0:
+                    self.sites.append((name, None, count))
+        self.sites.sort(key=lambda site: (site[1], site[2]), reverse=True)
+        del self.sites[limit:]
+        self._start_snapshot = None
+        self._start_counts = None
+
+    def report(self, stream):
+        """Write a report of the recorded results to C{stream}."""
+        stream.write("commandant: allocations for %s:\n" % (self.name,))
+        if tracemalloc is not None:
+            if self.peak is None:
+                stream.write("  peak traced memory: unknown, tracing was "
+                             "already running\n")
+            else:
+                stream.write("  peak traced memory: %s\n"
+                             % (format_size(self.peak),))
+            stream.write("  heap growth: %s\n"
+                         % (format_size(self.growth, signed=True),))
+            stream.write("  top allocation sites:\n")
+            for site, size, count in self.sites:
+                stream.write("    %10s %8d blocks  %s\n"
+                             % (format_size(size, signed=True), count, site))
+        else:
+            if self.peak is not None:
+                stream.write("  peak resident set size: %s\n"
+                             % (format_size(self.peak),))
+            stream.write("  heap growth: %+d objects\n" % (self.growth,))
+            stream.write("  top allocation sites by type "
+                         "(tracemalloc isn't available):\n")
+            for site, size, count in self.sites:
+                stream.write("    %+10d objects  %s\n" % (count, site))
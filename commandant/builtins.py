@@ -15,18 +15,28 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-"""Builtin commands."""
+"""Builtin commands.
 
-from cStringIO import StringIO
+The builtins are loaded by the entry point on every run, so modules that
+are only needed by one command, like those for the job queue, the
+scheduler and distributed workers, are imported when that command runs.
+"""
+
+import errno
 import os
 from platform import platform
+import shlex
 
 import bzrlib
 from bzrlib.commands import Command
+from bzrlib.errors import BzrCommandError
 from bzrlib.option import Option
 
 import commandant
-from commandant.help_topics import HelpTopic, CommandHelpTopic
+from commandant.commands import TwistedCommand
+from commandant.completion import CompletionIndex, save_completion_index
+from commandant.help_topics import (
+    HelpTopic, CommandHelpTopic, ListingHelpTopic, LISTING_FORMATS)
 from commandant.formatting import print_columns
 
 
@@ -52,35 +62,558 @@ class cmd_version(Command):
 
 
 class cmd_help(Command):
-    """Show help about a command or topic."""
+    """Show help about a command or topic.
+
+    Listings, such as the commands and topics topics, can be filtered to
+    names starting with a prefix and paged with an offset and limit.  They
+    can also be written as JSON Lines or tab-separated records with each
+    entry's name, summary, kind, hidden flag and path.
+    """
 
     aliases = ["?", "--help", "-?", "-h"]
     takes_args = ["topic?"]
+    takes_options = [
+        Option("prefix", type=unicode,
+               help="Only list names starting with this prefix."),
+        Option("offset", type=int,
+               help="Number of listed names to skip."),
+        Option("limit", type=int,
+               help="Maximum number of names to list."),
+        Option("format", type=str,
+               help="Write listings as records, in %s format." % (
+                   " or ".join(LISTING_FORMATS),))]
     _see_also = ["topics"]
 
-    def run(self, topic=None):
+    def run(self, topic=None, prefix=None, offset=None, limit=None,
+            format=None):
         """
         Show help for the C{bzrlib.commands.Command} or L{HelpTopic} matching
         C{name}.
 
         @param topic: Optionally, the name of the topic to show.  Default is
-            C{basic}.
+            C{basic}, or C{commands} if a listing option is used.
+        @param prefix: Optionally, a prefix that listed names must start
+            with.
+        @param offset: Optionally, the number of listed names to skip.
+        @param limit: Optionally, the maximum number of names to list.
+        @param format: Optionally, one of L{LISTING_FORMATS}.
         """
+        listing = not (prefix is None and offset is None and limit is None
+                       and format is None)
         if topic is None:
-            topic = "basic"
-        text = None
+            if listing:
+                topic = "commands"
+            else:
+                topic = "basic"
+        chunks = None
         command = self.controller.get_command(topic)
         help_topic = self.controller.get_help_topic(topic)
+        if listing:
+            if not isinstance(help_topic, ListingHelpTopic):
+                raise BzrCommandError(
+                    "The %s topic isn't a listing." % (topic,))
+            if (offset is not None and offset < 0 or
+                limit is not None and limit < 0):
+                raise BzrCommandError("Offset and limit can't be negative.")
+            if format is not None and format not in LISTING_FORMATS:
+                raise BzrCommandError("Unknown listing format %s." % (format,))
+            help_topic.prefix = prefix
+            help_topic.offset = offset or 0
+            help_topic.limit = limit
+            help_topic.format = format
         if help_topic:
-            text = help_topic.get_text().strip()
+            if getattr(help_topic, "iter_text", None) is not None:
+                chunks = help_topic.iter_text()
+            else:
+                chunks = [help_topic.get_text().strip()]
         elif command:
-            help_topic = CommandHelpTopic(command)
-            help_topic.controller = self.controller
-            text = help_topic.get_text()
-        if text:
-            print >>self.outf, text
+            chunks = [self._get_command_text(command)]
+        if chunks is not None:
+            self._write_text(chunks)
         elif not (command or help_topic):
             print >>self.outf, "%s is an unknown command or topic." % (topic,)
+            suggestions = self.controller.get_suggestions(topic)
+            if suggestions:
+                print >>self.outf, "Did you mean %s?" % (
+                    " or ".join(suggestions),)
+
+    def _get_command_text(self, command):
+        """Get help text rendered for C{command}.
+
+        Rendered text is cached in the controller's help cache directory,
+        if it has one, keyed by the command's name, the size and
+        modification time of the file it was loaded from, and the program
+        and C{bzrlib} versions.
+        """
+        directory = self.controller.help_cache_directory
+        fingerprint = None
+        if directory is not None:
+            fingerprint = self._get_command_fingerprint(command)
+        if fingerprint is not None:
+            from commandant.cache import DiskCache
+            cache = DiskCache(directory)
+            text = cache.get(command.name(), fingerprint)
+            if text is not None:
+                return text
+        help_topic = CommandHelpTopic(command)
+        help_topic.controller = self.controller
+        text = help_topic.get_text()
+        if fingerprint is not None:
+            try:
+                cache.set(command.name(), fingerprint, text)
+            except (IOError, OSError, UnicodeError):
+                # The text is rendered again next time.
+                pass
+        return text
+
+    def _get_command_fingerprint(self, command):
+        """Get a fingerprint of the source of C{command}'s help text.
+
+        @return: A C{tuple}, or C{None} if the command's source isn't known.
+        """
+        entry = self.controller.get_help_index().get_command(command.name())
+        if entry is None or entry.path is None:
+            return None
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            return None
+        return (entry.path, stat.st_mtime, stat.st_size,
+                self.controller.program_name,
+                self.controller.program_version, bzrlib.version_string)
+
+    def _write_text(self, chunks):
+        """Write C{chunks} of help text, followed by a newline.
+
+        Text is written through a pager if L{outf} is a terminal and the
+        pager in the C{PAGER} environment variable, or C{less} by default,
+        can be started.  Nothing is written if the text is empty.
+        """
+        pager = None
+        isatty = getattr(self.outf, "isatty", None)
+        if isatty is not None and isatty():
+            pager = self._start_pager()
+        if pager is None:
+            write = self.outf.write
+        else:
+            encoding = getattr(self.outf, "encoding", None) or "utf-8"
+
+            def write(chunk):
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode(encoding, "replace")
+                pager.stdin.write(chunk)
+        try:
+            try:
+                written = False
+                for chunk in chunks:
+                    if chunk:
+                        write(chunk)
+                        written = True
+                if written:
+                    write("\n")
+            except IOError, e:
+                # The pager may be closed before all text has been shown.
+                if pager is None or e.errno != errno.EPIPE:
+                    raise
+        finally:
+            if pager is not None:
+                try:
+                    pager.stdin.close()
+                except IOError:
+                    pass
+                pager.wait()
+
+    def _start_pager(self):
+        """Start a pager that reads from its standard input.
+
+        Like git, C{LESS} is set to C{FRX} if it isn't already set, so
+        C{less} exits straight away when the text fits on one screen, and
+        leaves it on the terminal when it exits.
+
+        @return: A C{subprocess.Popen} instance, or C{None} if a pager
+            couldn't be started.
+        """
+        command = shlex.split(os.environ.get("PAGER", "less"))
+        if not command:
+            return None
+        import subprocess
+
+        environment = dict(os.environ)
+        environment.setdefault("LESS", "FRX")
+        self.outf.flush()
+        try:
+            return subprocess.Popen(command, stdin=subprocess.PIPE,
+                                    env=environment)
+        except OSError:
+            return None
+
+
+class cmd_run_graph(Command):
+    """Run a graph of commands with dependencies between them.
+
+    The graph is a JSON file containing a list of nodes.  Each node has a
+    name, a command line to run, the names of the nodes it requires and,
+    optionally, the paths it reads from:
+
+      [{"name": "build", "command": ["build"], "inputs": ["src"]},
+       {"name": "deploy", "command": ["deploy"], "requires": ["build"]}]
+
+    Nodes run in parallel as soon as their requirements have succeeded.
+    Nodes on the critical path of previous runs are started first, and nodes
+    whose inputs haven't changed since their last successful run are skipped.
+    """
+
+    takes_args = ["graph"]
+    # Output from nodes is passed through untouched.
+    encoding_type = "exact"
+    takes_options = [
+        Option("jobs", short_name="j", type=int,
+               help="Number of commands to run at once."),
+        Option("state", type=unicode,
+               help="File to record durations and fingerprints in.  "
+                    "Defaults to the graph file with a .state suffix."),
+        Option("force", help="Run all nodes, even if they're unchanged."),
+        Option("output", type=str,
+               help="Collect output from nodes running at the same time: "
+                    "prefix each line with the node name, group it by "
+                    "node, or spill it to a file per node."),
+        Option("spill-directory", type=unicode,
+               help="Directory to write output files to in spill mode.")]
+
+    def run(self, graph, jobs=1, state=None, force=False, output=None,
+            spill_directory=None):
+        """Run the nodes in C{graph} and report the ones that failed."""
+        from commandant.errors import GraphError
+        from commandant.graph import (
+            load_graph, GraphState, GraphRunner, FAILED, CANCELLED)
+        from commandant.output import OutputMultiplexer, MODES, SPILL
+
+        multiplexer = None
+        if output is not None:
+            if output not in MODES:
+                raise BzrCommandError(
+                    "Output must be one of: %s." % (", ".join(MODES),))
+            if output == SPILL and spill_directory is None:
+                raise BzrCommandError(
+                    "Spill mode requires --spill-directory.")
+            multiplexer = OutputMultiplexer(
+                self.outf, output, spill_directory=spill_directory)
+        try:
+            command_graph = load_graph(graph)
+        except GraphError, e:
+            raise BzrCommandError(str(e))
+        if state is None:
+            state = "%s.state" % (graph,)
+        graph_state = GraphState(state)
+        graph_state.load()
+        runner = GraphRunner(self.controller, command_graph, graph_state,
+                             jobs=jobs, force=force, outf=self.outf,
+                             multiplexer=multiplexer)
+        results = runner.run()
+        failed = sorted(name for name, result in results.iteritems()
+                        if result in (FAILED, CANCELLED))
+        if failed:
+            print >>self.outf, "Failed: %s" % (", ".join(failed),)
+            return 1
+
+
+class cmd_queue(Command):
+    """Manage a persistent queue of commands.
+
+    The queue is stored in a SQLite database and can be shared by any number
+    of processes.  The following actions are supported:
+
+      add COMMAND [ARGUMENTS...]  Add a command to the queue.
+      list                        List queued jobs and their state.
+      show JOB                    Show the state and output of a job.
+      work                        Run queued jobs until the queue is empty.
+
+    Jobs left running by a worker that died are claimed again by the next
+    worker, and count as a failed attempt.
+
+    Use -- to pass options to a queued command, as in:
+
+      queue add --priority 10 -- deploy --fast
+    """
+
+    takes_args = ["action", "arguments*"]
+    takes_options = [
+        Option("priority", type=int,
+               help="Jobs with a higher priority are run first."),
+        Option("retries", type=int,
+               help="Number of times to retry a job if it fails."),
+        Option("workers", short_name="j", type=int,
+               help="Number of jobs to run at once."),
+        Option("claim-timeout", type=int,
+               help="Seconds after which a running job is claimed again, "
+                    "even if its worker is still alive."),
+        Option("queue", type=unicode,
+               help="Path to the queue database.  Defaults to the "
+                    "COMMANDANT_QUEUE environment variable or "
+                    "~/.<program-name>/queue.db.")]
+
+    def run(self, action, arguments_list=None, priority=0, retries=0,
+            workers=1, claim_timeout=None, queue=None):
+        """Run the queue C{action}."""
+        from commandant.jobs import (
+            JobQueue, QueueWorker, get_default_queue_path)
+
+        if queue is None:
+            queue = get_default_queue_path(self.controller.program_name)
+        job_queue = JobQueue(queue, claim_timeout)
+        try:
+            if action == "add":
+                if not arguments_list:
+                    raise BzrCommandError("You must provide a command to add.")
+                job_id = job_queue.add(arguments_list, priority, retries)
+                print >>self.outf, "Added job %d." % (job_id,)
+            elif action == "list":
+                rows = [(str(job.id), job.state, " ".join(job.argv))
+                        for job in job_queue.get_jobs()]
+                print_columns(self.outf, rows, shrink_index=2)
+            elif action == "show":
+                if not arguments_list or not arguments_list[0].isdigit():
+                    raise BzrCommandError("You must provide a job ID.")
+                job = job_queue.get_job(int(arguments_list[0]))
+                if job is None:
+                    raise BzrCommandError(
+                        "Job %s doesn't exist." % (arguments_list[0],))
+                print >>self.outf, "Command: %s" % (" ".join(job.argv),)
+                print >>self.outf, "State: %s" % (job.state,)
+                print >>self.outf, "Attempts: %d of %d" % (
+                    job.attempts, job.max_attempts)
+                if job.exit_status is not None:
+                    print >>self.outf, "Exit status: %d" % (job.exit_status,)
+                if job.output:
+                    print >>self.outf
+                    self.outf.write(job.output.decode("utf-8", "replace"))
+            elif action == "work":
+                worker = QueueWorker(self.controller, job_queue, workers,
+                                     outf=self.outf)
+                worker.run()
+            else:
+                raise BzrCommandError("Unknown queue action %s." % (action,))
+        finally:
+            job_queue.close()
+
+
+class cmd_schedule(Command):
+    """Run commands on a recurring schedule.
+
+    The schedule file has one command per line, preceded by when it should
+    run.  Intervals and cron expressions are both supported:
+
+      @every 90s refresh-cache --quick
+      30 6 * * 1-5 send-report
+
+    The scheduler keeps running until it's interrupted.  Each command runs in
+    a child forked from the scheduler process, so modules the scheduler has
+    already loaded are reused, but modules loaded by a run are loaded again
+    by the next one.  A command that's still running when it's due again is
+    skipped, and commands still running when the scheduler is interrupted
+    are terminated.
+    """
+
+    takes_args = ["schedule"]
+    takes_options = [
+        Option("jitter", type=float,
+               help="Delay each run by a random number of seconds, up to "
+                    "this value.")]
+
+    def run(self, schedule, jitter=0):
+        """Run the commands in the C{schedule} file until interrupted."""
+        from commandant.scheduler import Scheduler, load_schedule
+
+        scheduler = Scheduler(self.controller, jitter=jitter, outf=self.outf)
+        for entry in load_schedule(schedule):
+            scheduler.add(entry)
+        scheduler.run()
+
+
+class cmd_worker(TwistedCommand):
+    """Run commands sent by a coordinator.
+
+    The worker listens for AMP connections from coordinators and runs the
+    commands they send in child processes forked from the worker.  Output is
+    streamed back to the coordinator as it's produced.  The worker keeps
+    running until it's interrupted.
+
+    Coordinators aren't authenticated: anyone who can connect to the port
+    can run any command as the user running the worker.  The worker only
+    listens on the loopback interface unless told otherwise.
+    """
+
+    takes_options = [
+        Option("port", type=int,
+               help="Port to listen on.  Defaults to a free port."),
+        Option("interface", type=str,
+               help="Interface to listen on.  Defaults to 127.0.0.1.  "
+                    "Connections aren't authenticated, so anyone who can "
+                    "reach the port can run commands.")]
+
+    def run(self, port=0, interface="127.0.0.1"):
+        """Listen for coordinators on C{interface} and C{port}."""
+        from twisted.internet.defer import Deferred
+        from commandant.distributed import WorkerFactory
+
+        reactor = self.get_reactor()
+        listener = reactor.listenTCP(port, WorkerFactory(self.controller),
+                                     interface=interface)
+        print >>self.outf, "Listening on %s:%d" % (
+            interface, listener.getHost().port)
+        self.outf.flush()
+        return Deferred()
+
+
+class cmd_search(Command):
+    """Search the documentation for commands and help topics.
+
+    Commands and help topics are listed with the most relevant first.  The
+    search index is stored on disk and updated before each search, reading
+    only documentation that has changed since the last search.
+    """
+
+    takes_args = ["words+"]
+    takes_options = [
+        Option("limit", type=int,
+               help="Maximum number of results to show.  Defaults to 10."),
+        Option("index", type=unicode,
+               help="Path to the search index.  Defaults to the "
+                    "COMMANDANT_SEARCH_INDEX environment variable or "
+                    "~/.<program-name>/search-index.json.")]
+
+    def run(self, words_list, limit=10, index=None):
+        """Show commands and help topics matching C{words_list}."""
+        from commandant.search import (
+            SearchIndex, get_default_search_index_path, update_search_index)
+
+        if index is None:
+            index = get_default_search_index_path(
+                self.controller.program_name)
+        search_index = SearchIndex(index)
+        search_index.load()
+        if update_search_index(self.controller, search_index):
+            try:
+                search_index.save()
+            except (IOError, OSError):
+                # An unwritable index only costs a rebuild on the next
+                # search.
+                pass
+        help_index = self.controller.get_help_index()
+        entries = []
+        for name, score in search_index.search(" ".join(words_list), limit):
+            entry = help_index.get_command(name) or help_index.get_topic(name)
+            if entry is not None:
+                entries.append(entry)
+        if not entries:
+            print >>self.outf, "No commands or topics match %s." % (
+                " ".join(words_list),)
+            return
+        self.controller.load_summaries(entries)
+        print_columns(self.outf, [(entry.name, entry.summary)
+                                  for entry in entries])
+
+
+class cmd_complete(Command):
+    """Print completion candidates for a partial command line.
+
+    The words following the program name are passed as arguments, with
+    the word being completed last, as in:
+
+      complete -- help com
+
+    Candidates are printed one per line.  The names they're drawn from are
+    cached, so that later completions can be answered by the entry point
+    without loading any commands.
+    """
+
+    hidden = True
+    takes_args = ["words*"]
+
+    def run(self, words_list=None):
+        """Print candidates for completing the last word in C{words_list}."""
+        directory = self.controller.completion_directory
+        index = None
+        if directory is not None:
+            try:
+                index = save_completion_index(directory, self.controller)
+            except (IOError, OSError):
+                # The index is built again on the next completion.
+                pass
+        if index is None:
+            index = CompletionIndex.from_controller(self.controller)
+        for candidate in index.get_candidates(words_list or []):
+            print >>self.outf, candidate
+
+
+class cmd_completion_script(Command):
+    """Generate a shell completion script for this program.
+
+    The script completes command names and aliases, the options each
+    command takes and the topics the help command accepts, without running
+    this program.  Scripts can be generated for bash, zsh and fish.  When
+    --output names an existing script generated from the same commands and
+    help topics, it isn't generated again.  Programs that take arguments
+    before the command name, like bin/commandant's path to the commands,
+    need --leading-arguments.
+    """
+
+    takes_args = ["shell"]
+    takes_options = [
+        Option("output", type=unicode,
+               help="Write the script to this path instead of standard "
+                    "output."),
+        Option("program", type=unicode,
+               help="The name of the program to complete.  Defaults to "
+                    "this program's name."),
+        Option("leading-arguments", type=int,
+               help="The number of arguments the program takes before the "
+                    "command name, like the path bin/commandant takes.  "
+                    "Defaults to 0.")]
+
+    def run(self, shell, output=None, program=None, leading_arguments=0):
+        """Write a completion script for C{shell}."""
+        from commandant.completion_scripts import (
+            SHELLS, generate_script, get_registry_fingerprint,
+            get_script_fingerprint)
+
+        if shell not in SHELLS:
+            raise BzrCommandError(
+                "Shell must be one of: %s." % (", ".join(SHELLS),))
+        if leading_arguments < 0:
+            raise BzrCommandError("--leading-arguments can't be negative.")
+        if program is None:
+            program = self.controller.program_name
+        help_index = self.controller.get_help_index()
+        commands = help_index.get_commands(hidden=False)
+        topics = help_index.get_topics()
+        # A command's summary comes from the help topic with its name, if
+        # there is one.
+        topic_paths = {}
+        for entry in commands:
+            help_topic = self.controller.get_help_topic(entry.name)
+            path = getattr(help_topic, "path", None)
+            if path is not None:
+                topic_paths[entry.name] = path
+        fingerprint = get_registry_fingerprint(
+            shell, program, commands, topics, topic_paths, leading_arguments)
+        if (output is not None and
+            get_script_fingerprint(output) == fingerprint):
+            print >>self.outf, "%s is up to date." % (output,)
+            return
+        self.controller.load_summaries(commands + topics)
+        script = generate_script(shell, program, commands, topics,
+                                 fingerprint, leading_arguments)
+        if output is None:
+            self.outf.write(script)
+            return
+        temporary_path = "%s.%d.tmp" % (output, os.getpid())
+        file = open(temporary_path, "w")
+        try:
+            file.write(script.encode("utf-8"))
+        finally:
+            file.close()
+        os.rename(temporary_path, output)
 
 
 class topic_basic(HelpTopic):
@@ -104,64 +637,41 @@ Basic commands:
        "program-url": self.controller.program_url}
 
 
-class topic_commands(HelpTopic):
+class topic_commands(ListingHelpTopic):
     """List available commands with a short summary describing each one."""
 
+    # List hidden commands instead of visible ones.
+    hidden = False
+
     def get_summary(self):
         """Get a short topic summary for use in a topic listing."""
         return "Basic help for all commands."
 
-    def get_text(self):
-        """Get topic content."""
-        stream = StringIO()
-        result = []
-        for name in self.controller.get_command_names():
-            command = self.controller.get_command(name)
-            help_topic = self.controller.get_help_topic(name)
-            if not help_topic and command:
-                help_topic = CommandHelpTopic(command)
-                if self.controller is not None:
-                    help_topic.controller = self.controller
-            summary = ""
-            if help_topic:
-                summary = help_topic.get_summary()
-            if self.include_command(command):
-                result.append((name, summary))
-        result.sort(key=lambda item: item[0])
-        print_columns(stream, result)
-        return stream.getvalue()
-
-    def include_command(self, command):
-        """Return C{True} if C{command} is visible."""
-        return not command.hidden
+    def get_entries(self):
+        """Get the L{IndexEntry}s for commands."""
+        return self.controller.get_help_index().get_commands(
+            prefix=self.prefix, offset=self.offset, limit=self.limit,
+            hidden=self.hidden)
 
 
 class topic_hidden_commands(topic_commands):
     """List hidden commands with a short summary describing each one."""
 
+    hidden = True
+
     def get_summary(self):
         """Get a short topic summary for use in a topic listing."""
         return "Basic help for hidden commands."
 
-    def include_command(self, command):
-        """Return C{True} if C{command} is hidden."""
-        return command.hidden
-
 
-class topic_topics(HelpTopic):
+class topic_topics(ListingHelpTopic):
     """List available help topics with a short summary describing each one."""
 
     def get_summary(self):
         """Get a short topic summary for use in a topic listing."""
         return "Topics list."
 
-    def get_text(self):
-        """Get topic content."""
-        stream = StringIO()
-        command_names = self.controller.get_command_names()
-        help_topic_names = self.controller.get_help_topic_names()
-        result = [(name, self.controller.get_help_topic(name).get_summary())
-                  for name in help_topic_names if name not in command_names]
-        result.sort(key=lambda item: item[0])
-        print_columns(stream, result)
-        return stream.getvalue()
+    def get_entries(self):
+        """Get the L{IndexEntry}s for help topics."""
+        return self.controller.get_help_index().get_topics(
+            prefix=self.prefix, offset=self.offset, limit=self.limit)
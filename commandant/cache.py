@@ -0,0 +1,191 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Caches for help text and other derived content."""
+
+from collections import OrderedDict
+import hashlib
+import os
+
+
+DEFAULT_BUDGET = 4 * 1024 * 1024
+
+
+def get_default_help_cache_directory(program_name):
+    """Get the path of the directory rendered help is cached in.
+
+    The C{COMMANDANT_HELP_CACHE} environment variable, if it's set, overrides
+    the default path, C{~/.<program_name>/help-cache}.
+    """
+    path = os.environ.get("COMMANDANT_HELP_CACHE")
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".%s" % (program_name,),
+                            "help-cache")
+    return path
+
+
+def get_value_size(value):
+    """Get the size of C{value} in bytes.
+
+    C{unicode} values are measured by their UTF-8 encoding, since their
+    length counts characters rather than bytes.
+    """
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return len(value)
+
+
+class LRUCache(object):
+    """A cache that holds values up to a total size budget.
+
+    Values are measured in bytes by L{get_value_size}.  When adding a value
+    takes the cache over its budget the least recently used values are
+    evicted.
+
+    @ivar budget: The maximum total size of the values in the cache, in
+        bytes.
+    @ivar hits: The number of lookups that found a value.
+    @ivar misses: The number of lookups that didn't find a value.
+    @ivar evictions: The number of values evicted to stay within budget.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._values = OrderedDict()
+        self._sizes = {}
+        self._size = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get_size(self):
+        """Get the total size of the values in the cache, in bytes."""
+        return self._size
+
+    def get(self, key):
+        """Get the value for C{key}, or C{None} if it isn't cached."""
+        try:
+            value = self._values.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._values[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Cache C{value} for C{key}, evicting values to stay within budget.
+
+        Values larger than the budget aren't cached.
+        """
+        self.remove(key)
+        size = get_value_size(value)
+        if size > self.budget:
+            return
+        self._values[key] = value
+        self._sizes[key] = size
+        self._size += size
+        while self._size > self.budget:
+            (evicted_key, evicted_value) = self._values.popitem(last=False)
+            self._size -= self._sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def remove(self, key):
+        """Remove the value for C{key}, if it's cached."""
+        if key in self._values:
+            del self._values[key]
+            self._size -= self._sizes.pop(key)
+
+    def clear(self):
+        """Remove all values and reset the counters."""
+        self._values.clear()
+        self._sizes.clear()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class DiskCache(object):
+    """A directory of cached text, with one file per name.
+
+    Each file starts with a line containing a digest of the fingerprint the
+    text was stored with, so a file is only used while the fingerprint
+    matches and is replaced when the text is stored again.
+
+    @ivar path: The path to the directory files are stored in.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _get_path(self, name):
+        """Get the path of the file for C{name}."""
+        return os.path.join(self.path, hashlib.sha1(repr(name)).hexdigest())
+
+    def _get_digest(self, fingerprint):
+        """Get a digest of C{fingerprint}."""
+        return hashlib.sha1(repr(fingerprint)).hexdigest()
+
+    def get(self, name, fingerprint):
+        """Get the C{unicode} text cached for C{name} with C{fingerprint}.
+
+        @return: The text, or C{None} if it isn't cached or was cached with a
+            different fingerprint.
+        """
+        try:
+            file = open(self._get_path(name), "rb")
+        except IOError:
+            return None
+        try:
+            if file.readline().rstrip("\n") != self._get_digest(fingerprint):
+                return None
+            data = file.read()
+        finally:
+            file.close()
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    def set(self, name, fingerprint, text):
+        """Cache C{text} for C{name} with C{fingerprint}.
+
+        @raises UnicodeError: Raised if C{text} is a C{str} that isn't UTF-8.
+        """
+        if isinstance(text, unicode):
+            data = text.encode("utf-8")
+        else:
+            data = text
+            data.decode("utf-8")
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        path = self._get_path(name)
+        temporary_path = "%s.%d.tmp" % (path, os.getpid())
+        file = open(temporary_path, "wb")
+        try:
+            file.write("%s\n" % (self._get_digest(fingerprint),))
+            file.write(data)
+        finally:
+            file.close()
+        os.rename(temporary_path, path)
@@ -23,6 +23,61 @@ import sys
 from twisted.internet.defer import Deferred
 
 from bzrlib.commands import Command
+from bzrlib.option import Option
+
+from commandant.timing import start_phase, start_span, stop_phase, stop_span
+
+
+def get_option_names(command_class):
+    """Get the command-line options accepted by C{command_class}.
+
+    Options are read from the class's C{takes_options} and
+    C{bzrlib}'s standard options, without creating the command or its
+    option parser.  Hidden options aren't included.
+
+    @return: A C{(names, value_names)} tuple.  C{names} is a sorted C{list}
+        of long and short option names, such as C{--help} and C{-h}, and
+        C{value_names} is a sorted C{list} of those that take a value.
+    """
+    options = dict(Option.STD_OPTIONS)
+    for option in getattr(command_class, "takes_options", []):
+        if isinstance(option, basestring):
+            option = Option.OPTIONS.get(option)
+            if option is None:
+                continue
+        options[option.name] = option
+    names = set()
+    value_names = set()
+    for option in options.itervalues():
+        if getattr(option, "hidden", False):
+            continue
+        option_names = ["--%s" % (option.name,)]
+        short_name = option.short_name()
+        if short_name:
+            option_names.append("-%s" % (short_name,))
+        names.update(option_names)
+        if getattr(option, "type", None) is not None:
+            value_names.update(option_names)
+    return sorted(names), sorted(value_names)
+
+
+def get_argument_placeholders(command_class):
+    """
+    Get placeholders for the arguments in C{command_class}'s C{takes_args},
+    formatted as they are in C{bzrlib} usage text, such as C{[TOPIC]} or
+    C{FILES...}.
+    """
+    placeholders = []
+    for name in getattr(command_class, "takes_args", []):
+        name = name.upper()
+        if name[-1] in ("$", "+"):
+            name = "%s..." % (name[:-1],)
+        elif name[-1] == "?":
+            name = "[%s]" % (name[:-1],)
+        elif name[-1] == "*":
+            name = "[%s...]" % (name[:-1],)
+        placeholders.append(name)
+    return placeholders
 
 
 class ExecutableCommand(Command):
@@ -42,10 +97,14 @@ class ExecutableCommand(Command):
         Run the executable, passing whatever arguments were passed to the
         command.
         """
-        if argv:
-            os.system("%s %s" % (self.path, " ".join(argv)))
-        else:
-            os.system(self.path)
+        phase = start_phase("process %s" % (self.path,))
+        try:
+            if argv:
+                os.system("%s %s" % (self.path, " ".join(argv)))
+            else:
+                os.system(self.path)
+        finally:
+            stop_phase(phase)
 
 
 class TwistedCommand(Command):
@@ -93,10 +152,17 @@ class TwistedCommand(Command):
         """Store the failure value after running the command."""
         self._failure_value = (failure.type, failure.value, failure.tb)
 
+    def _stop_span(self, result, span):
+        """Stop timing the Deferred returned by the command."""
+        stop_span(span)
+        return result
+
     def _stop_reactor(self, result):
         """Stop the reactor."""
         reactor = self.get_reactor()
         if isinstance(result, Deferred):
+            span = start_span("Deferred %s" % (self.name(),))
+            result.addBoth(self._stop_span, span)
             result.addErrback(self._capture_failure_value)
             result.addCallback(self._capture_return_value)
             # Use callLater to stop the reactor so that application code can
@@ -0,0 +1,362 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Shell completion from a cached index of command and help topic names.
+
+Completing a command line shouldn't require importing every command module,
+so a L{CompletionIndex} is saved to disk the first time it's built and
+reused for as long as the fingerprint of the command directories it was
+built from is unchanged.  A L{PrefixTrie} of command names is cached the
+same way, so abbreviated command names can be resolved without building
+one, along with a L{BKTree} of names used to suggest corrections.  This
+module deliberately avoids importing C{bzrlib} and the parts of Commandant
+that depend on it, so that the entry point can answer completion requests
+from the cache without loading them.
+"""
+
+from bisect import bisect_left
+import hashlib
+import json
+import os
+
+from commandant import __version__
+from commandant.index import BKTree, PrefixTrie
+
+
+HELP_COMMAND = "help"
+
+
+def get_default_completion_directory(program_name):
+    """Get the path of the directory completion indexes are stored in.
+
+    The C{COMMANDANT_COMPLETION_CACHE} environment variable, if it's set,
+    overrides the default path, C{~/.<program_name>/completion}.
+    """
+    path = os.environ.get("COMMANDANT_COMPLETION_CACHE")
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".%s" % (program_name,),
+                            "completion")
+    return path
+
+
+def get_paths_fingerprint(paths):
+    """Get a fingerprint of the command directories in C{paths}.
+
+    The fingerprint changes when a file is added to, removed from, or
+    changed in any of the directories, or when Commandant is upgraded.
+    """
+    digest = hashlib.sha1(__version__)
+    for path in paths:
+        digest.update("\0%s\0" % (os.path.abspath(path),))
+        for filename in sorted(os.listdir(path)):
+            try:
+                stat = os.stat(os.path.join(path, filename))
+            except OSError:
+                continue
+            digest.update("%s\0%d\0%d\0%d\0" % (
+                filename, stat.st_mtime, stat.st_size, stat.st_mode))
+    return digest.hexdigest()
+
+
+def get_index_path(directory, paths, extension="json"):
+    """
+    Get the path of the file in C{directory} that the L{CompletionIndex} for
+    the command directories in C{paths} is stored in.
+
+    @param extension: Optionally, the extension of the file, to get the
+        path of another file cached for the same command directories.
+    """
+    key = "\0".join(os.path.abspath(path) for path in paths)
+    return os.path.join(directory, "%s.%s" % (hashlib.sha1(key).hexdigest(),
+                                              extension))
+
+
+def _load_json(path, fingerprint):
+    """Load the JSON object stored in C{path}.
+
+    @return: The object, or C{None} if the file doesn't exist, can't be read
+        or was saved with a different C{fingerprint}.
+    """
+    try:
+        file = open(path, "r")
+    except IOError:
+        return None
+    try:
+        try:
+            data = json.load(file)
+        except ValueError:
+            return None
+    finally:
+        file.close()
+    if data.get("fingerprint") != fingerprint:
+        return None
+    return data
+
+
+def _save_json(path, fingerprint, data):
+    """Save the JSON object C{data} to C{path} with C{fingerprint}."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    data = dict(data, fingerprint=fingerprint)
+    temporary_path = "%s.%d.tmp" % (path, os.getpid())
+    file = open(temporary_path, "w")
+    try:
+        json.dump(data, file)
+    finally:
+        file.close()
+    os.rename(temporary_path, path)
+
+
+def _complete_prefix(names, prefix):
+    """Get the names in sorted C{names} that start with C{prefix}."""
+    result = []
+    for i in xrange(bisect_left(names, prefix), len(names)):
+        if not names[i].startswith(prefix):
+            break
+        result.append(names[i])
+    return result
+
+
+class CompletionIndex(object):
+    """Sorted names of visible commands and help topics.
+
+    Options and argument placeholders for Python commands are stored with
+    the names, so completing them doesn't require importing commands.
+
+    @ivar commands: A sorted C{list} of command names.
+    @ivar topics: A sorted C{list} of help topic names.
+    @ivar options: A C{dict} mapping command names to sorted C{list}s of
+        the options they accept.
+    @ivar value_options: A C{dict} mapping command names to the options
+        they accept that take a value.
+    @ivar arguments: A C{dict} mapping command names to placeholders for
+        the arguments they accept.
+    @ivar aliases: A C{dict} mapping command aliases to command names.
+    """
+
+    def __init__(self, commands, topics, options=None, value_options=None,
+                 arguments=None, aliases=None):
+        self.commands = sorted(commands)
+        self.topics = sorted(topics)
+        self.options = options or {}
+        self.value_options = value_options or {}
+        self.arguments = arguments or {}
+        self.aliases = aliases or {}
+
+    @classmethod
+    def from_controller(cls, controller):
+        """Create a L{CompletionIndex} for the names known to C{controller}."""
+        help_index = controller.get_help_index()
+        entries = help_index.get_commands(hidden=False)
+        return cls([entry.name for entry in entries],
+                   [entry.name for entry in help_index.get_topics()],
+                   dict((entry.name, entry.options)
+                        for entry in entries if entry.options),
+                   dict((entry.name, entry.value_options)
+                        for entry in entries if entry.value_options),
+                   dict((entry.name, entry.arguments)
+                        for entry in entries if entry.arguments),
+                   controller.get_aliases())
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        """Load the index stored in C{path}.
+
+        @return: A L{CompletionIndex}, or C{None} if the file doesn't exist,
+            can't be read or was saved with a different C{fingerprint}.
+        """
+        data = _load_json(path, fingerprint)
+        if data is None:
+            return None
+        return cls(data["commands"], data["topics"], data.get("options"),
+                   data.get("value_options"), data.get("arguments"),
+                   data.get("aliases"))
+
+    def save(self, path, fingerprint):
+        """Save the index to C{path} with C{fingerprint}."""
+        _save_json(path, fingerprint,
+                   {"commands": self.commands, "topics": self.topics,
+                    "options": self.options,
+                    "value_options": self.value_options,
+                    "arguments": self.arguments, "aliases": self.aliases})
+
+    def get_candidates(self, words):
+        """Get completion candidates for a partial command line.
+
+        The first word is completed with command names and the word after
+        C{help} with command and help topic names.  Words after a Python
+        command starting with C{-} are completed with its options.  An empty
+        word is completed with its options and a placeholder for the
+        argument at its position, if there is one.  A command alias is
+        completed like the command it refers to.
+
+        @param words: The words following the program name.  The last word
+            is the one being completed and may be empty.
+        @return: A sorted C{list} of candidate words.
+        """
+        if not words:
+            words = [""]
+        prefix = words[-1]
+        if len(words) == 1:
+            return _complete_prefix(self.commands, prefix)
+        command = self.aliases.get(words[0], words[0])
+        if (len(words) == 2 and command == HELP_COMMAND and
+            not prefix.startswith("-")):
+            return sorted(set(_complete_prefix(self.commands, prefix) +
+                              _complete_prefix(self.topics, prefix)))
+        options = self.options.get(command, [])
+        if prefix.startswith("-"):
+            return _complete_prefix(options, prefix)
+        if prefix:
+            return []
+        (position, is_value) = self._get_position(command, words[1:-1])
+        if is_value:
+            return []
+        candidates = list(options)
+        arguments = self.arguments.get(command, [])
+        if position < len(arguments):
+            candidates.append(arguments[position])
+        elif arguments and arguments[-1].endswith(("...", "...]")):
+            # The last argument accepts any number of values.
+            candidates.append(arguments[-1])
+        return sorted(candidates)
+
+    def _get_position(self, command, words):
+        """Get the position of the argument following C{words}.
+
+        @return: A C{(position, is_value)} tuple.  C{is_value} is C{True} if
+            the word following C{words} is the value of an option.
+        """
+        value_options = self.value_options.get(command, [])
+        position = 0
+        is_value = False
+        options_ended = False
+        for word in words:
+            if is_value:
+                is_value = False
+            elif word == "--" and not options_ended:
+                options_ended = True
+            elif word.startswith("-") and not options_ended:
+                is_value = word in value_options
+            else:
+                position += 1
+        return position, is_value
+
+
+def complete_from_cache(directory, paths, words):
+    """
+    Get completion candidates from the L{CompletionIndex} cached in
+    C{directory} for the command directories in C{paths}.
+
+    @return: A C{list} of candidates, or C{None} if there's no up-to-date
+        cached index.
+    """
+    try:
+        fingerprint = get_paths_fingerprint(paths)
+    except OSError:
+        return None
+    index = CompletionIndex.load(get_index_path(directory, paths),
+                                 fingerprint)
+    if index is None:
+        return None
+    return index.get_candidates(words)
+
+
+def save_completion_index(directory, controller):
+    """
+    Build a L{CompletionIndex} for C{controller} and save it in C{directory},
+    keyed by the command directories the controller has loaded.  The
+    controller's command name L{PrefixTrie} is saved with it.
+
+    @return: The L{CompletionIndex}.
+    """
+    index = CompletionIndex.from_controller(controller)
+    paths = controller.loaded_paths
+    if paths:
+        index.save(get_index_path(directory, paths),
+                   get_paths_fingerprint(paths))
+        save_command_trie(directory, controller)
+    return index
+
+
+def resolve_from_cache(directory, paths, name):
+    """
+    Resolve an abbreviated command name with the L{PrefixTrie} cached in
+    C{directory} for the command directories in C{paths}.
+
+    @return: The C{list} of names returned by L{PrefixTrie.resolve}, with
+        just C{name} if it's the name of a hidden command or an alias, or
+        C{None} if there's no up-to-date cached trie.
+    """
+    try:
+        fingerprint = get_paths_fingerprint(paths)
+    except OSError:
+        return None
+    data = _load_json(get_index_path(directory, paths, "trie.json"),
+                      fingerprint)
+    if data is None:
+        return None
+    if name in data["exact"]:
+        return [name]
+    return PrefixTrie.from_data(data["trie"]).resolve(name)
+
+
+def save_command_trie(directory, controller):
+    """
+    Save the command name L{PrefixTrie} for C{controller} in C{directory},
+    keyed by the command directories the controller has loaded.
+    """
+    paths = controller.loaded_paths
+    if not paths:
+        return
+    help_index = controller.get_help_index()
+    # Hidden command names and aliases aren't in the trie, but they
+    # mustn't be resolved to the visible commands they're prefixes of.
+    exact = [entry.name for entry in help_index.get_commands(hidden=True)]
+    exact.extend(controller.get_aliases())
+    _save_json(get_index_path(directory, paths, "trie.json"),
+               get_paths_fingerprint(paths),
+               {"trie": help_index.get_command_trie().to_data(),
+                "exact": exact})
+
+
+def load_suggestion_tree(directory, paths, fingerprint):
+    """
+    Load the L{BKTree} cached in C{directory} for the command directories in
+    C{paths}.
+
+    @param fingerprint: A fingerprint of the names in the tree.
+    @return: The L{BKTree}, or C{None} if there's no cached tree for the
+        same names.
+    """
+    data = _load_json(get_index_path(directory, paths, "suggestions.json"),
+                      fingerprint)
+    if data is None:
+        return None
+    return BKTree.from_data(data["tree"])
+
+
+def save_suggestion_tree(directory, paths, fingerprint, tree):
+    """
+    Save a L{BKTree} in C{directory} for the command directories in
+    C{paths}.
+
+    @param fingerprint: A fingerprint of the names in the tree.
+    """
+    _save_json(get_index_path(directory, paths, "suggestions.json"),
+               fingerprint, {"tree": tree.to_data()})
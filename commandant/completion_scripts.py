@@ -0,0 +1,334 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Generate static shell completion scripts for Commandant programs.
+
+A generated script contains the names, aliases and options of a
+program's commands and the names of its help topics, so completing a
+command line doesn't run the program at all.  Each script records a
+fingerprint of the registry it was generated from, so an up-to-date script
+doesn't need to be generated again.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from commandant import __version__
+from commandant.completion import HELP_COMMAND
+
+
+BASH = "bash"
+ZSH = "zsh"
+FISH = "fish"
+SHELLS = (BASH, ZSH, FISH)
+
+FINGERPRINT_PREFIX = "# fingerprint: "
+
+
+def _get_source(path):
+    """Get the path, modification time and size of the file at C{path}.
+
+    @return: A C{list}, or C{None} if C{path} is C{None} or doesn't exist.
+    """
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [path, stat.st_mtime, stat.st_size]
+
+
+def get_registry_fingerprint(shell, program_name, commands, topics,
+                             topic_paths=None, offset=0):
+    """Get a fingerprint of the registry a completion script is built from.
+
+    The fingerprint covers command and help topic names, aliases and
+    options, and the size and modification time of the files they were
+    loaded from, so it changes when their summaries might have changed.
+
+    @param shell: One of L{SHELLS}.
+    @param program_name: The name of the program being completed.
+    @param commands: The L{IndexEntry}s for visible commands.
+    @param topics: The L{IndexEntry}s for help topics.
+    @param topic_paths: Optionally, a C{dict} mapping the names of commands
+        with a help topic of the same name, which their summary comes
+        from, to the path of the topic's file.
+    @param offset: The number of arguments the program takes before the
+        command name.
+    """
+    if topic_paths is None:
+        topic_paths = {}
+    data = [shell, program_name, __version__, offset]
+    for entry in commands + topics:
+        data.append([entry.kind, entry.name, entry.aliases, entry.options,
+                     entry.value_options, _get_source(entry.path),
+                     _get_source(topic_paths.get(entry.name))])
+    return hashlib.sha1(json.dumps(data)).hexdigest()
+
+
+def get_script_fingerprint(path):
+    """Get the fingerprint recorded in the completion script at C{path}.
+
+    @return: The fingerprint, or C{None} if the file doesn't exist or
+        doesn't contain one.
+    """
+    try:
+        file = open(path, "r")
+    except IOError:
+        return None
+    try:
+        for i in range(5):
+            line = file.readline()
+            if line.startswith(FINGERPRINT_PREFIX):
+                return line[len(FINGERPRINT_PREFIX):].strip()
+    finally:
+        file.close()
+    return None
+
+
+def _quote(text):
+    """Quote C{text} as a single-quoted C{sh} word."""
+    return "'%s'" % (text.replace("'", "'\\''"),)
+
+
+def _quote_fish(text):
+    """Quote C{text} as a single-quoted C{fish} word."""
+    return "'%s'" % (text.replace("\\", "\\\\").replace("'", "\\'"),)
+
+
+def _get_function_name(program_name):
+    """Get the name of the shell function that completes C{program_name}."""
+    return "_%s" % (re.sub(r"[^A-Za-z0-9_]", "_", program_name),)
+
+
+def _get_names(entry):
+    """Get the name and aliases of a command to offer as candidates.
+
+    Aliases that don't start with a letter or digit, such as C{?} and
+    C{--help}, are left out.
+    """
+    return [entry.name] + [alias for alias in entry.aliases
+                           if re.match(r"\w", alias)]
+
+
+def _get_help_names(commands):
+    """Get the name and all aliases of the C{help} command."""
+    for entry in commands:
+        if entry.name == HELP_COMMAND:
+            return [entry.name] + entry.aliases
+    return [HELP_COMMAND]
+
+
+def _generate_bash(program_name, commands, topics, offset):
+    """Generate a bash completion script."""
+    function_name = _get_function_name(program_name)
+    names = []
+    for entry in commands:
+        names.extend(_get_names(entry))
+    help_names = sorted(set([entry.name for entry in commands] +
+                            [entry.name for entry in topics]))
+    lines = [
+        "%s()" % (function_name,),
+        "{",
+        "    local cur=${COMP_WORDS[COMP_CWORD]}",
+        "    local options="]
+    if offset:
+        lines.extend([
+            "    if [ $COMP_CWORD -le %d ]; then" % (offset,),
+            "        return",
+            "    fi"])
+    lines.extend([
+        "    if [ $COMP_CWORD -eq %d ]; then" % (offset + 1,),
+        "        COMPREPLY=( $( compgen -W %s -- \"$cur\" ) )" % (
+            _quote(" ".join(sorted(names))),),
+        "        return",
+        "    fi",
+        "    case \"${COMP_WORDS[%d]}\" in" % (offset + 1,)])
+    for entry in commands:
+        if entry.name == HELP_COMMAND:
+            patterns = _get_help_names(commands)
+        else:
+            patterns = [entry.name] + entry.aliases
+        lines.append("    %s)" % ("|".join(_quote(pattern)
+                                            for pattern in patterns),))
+        if entry.name == HELP_COMMAND:
+            lines.extend([
+                "        if [ $COMP_CWORD -eq %d ] && [[ \"$cur\" != -* ]]; "
+                "then" % (offset + 2,),
+                "            COMPREPLY=( $( compgen -W %s -- \"$cur\" ) )" % (
+                    _quote(" ".join(help_names)),),
+                "            return",
+                "        fi"])
+        lines.extend([
+            "        options=%s" % (_quote(" ".join(entry.options)),),
+            "        ;;"])
+    lines.extend([
+        "    esac",
+        "    if [[ \"$cur\" == -* ]]; then",
+        "        COMPREPLY=( $( compgen -W \"$options\" -- \"$cur\" ) )",
+        "    fi",
+        "}",
+        "",
+        "complete -F %s -o default %s" % (function_name,
+                                          _quote(program_name))])
+    return lines
+
+
+def _describe_zsh(entry, name=None):
+    """Format C{entry} as a C{name:description} item for C{_describe}.
+
+    @param name: Optionally, the name to describe, like one of the entry's
+        aliases.  Defaults to the entry's name.
+    """
+    if name is None:
+        name = entry.name
+    summary = (entry.summary or "").replace("\n", " ")
+    return _quote("%s:%s" % (name.replace(":", "\\:"), summary))
+
+
+def _generate_zsh(program_name, commands, topics, offset):
+    """Generate a zsh completion script."""
+    function_name = _get_function_name(program_name)
+    lines = [
+        "%s()" % (function_name,),
+        "{",
+        "    local -a commands topics options",
+        "    commands=("]
+    for entry in commands:
+        for name in _get_names(entry):
+            lines.append("        %s" % (_describe_zsh(entry, name),))
+    lines.extend([
+        "    )",
+        "    topics=("])
+    for entry in topics:
+        lines.append("        %s" % (_describe_zsh(entry),))
+    lines.append("    )")
+    if offset:
+        lines.extend([
+            "    if (( CURRENT <= %d )); then" % (offset + 1,),
+            "        _default",
+            "        return",
+            "    fi"])
+    lines.extend([
+        "    if (( CURRENT == %d )); then" % (offset + 2,),
+        "        _describe -t commands command commands",
+        "        return",
+        "    fi",
+        "    case $words[%d] in" % (offset + 2,)])
+    for entry in commands:
+        if entry.name == HELP_COMMAND:
+            patterns = _get_help_names(commands)
+        else:
+            patterns = [entry.name] + entry.aliases
+        lines.append("    %s)" % ("|".join(_quote(pattern)
+                                            for pattern in patterns),))
+        if entry.name == HELP_COMMAND:
+            lines.extend([
+                "        if (( CURRENT == %d )) && [[ $PREFIX != -* ]]; "
+                "then" % (offset + 3,),
+                "            _describe -t commands command commands",
+                "            _describe -t topics topic topics",
+                "            return",
+                "        fi"])
+        lines.extend([
+            "        options=(%s)" % (" ".join(_quote(option)
+                                             for option in entry.options),),
+            "        ;;"])
+    lines.extend([
+        "    esac",
+        "    if [[ $PREFIX == -* ]]; then",
+        "        compadd -- $options",
+        "    else",
+        "        _default",
+        "    fi",
+        "}",
+        "",
+        "compdef %s %s" % (function_name, _quote(program_name))])
+    return lines
+
+
+def _generate_fish(program_name, commands, topics, offset):
+    """Generate a fish completion script."""
+    program = _quote_fish(program_name)
+    if offset:
+        command_condition = _quote_fish(
+            "test (count (commandline -opc)) -eq %d" % (offset + 1,))
+    else:
+        command_condition = _quote_fish("__fish_use_subcommand")
+    lines = []
+    for entry in commands:
+        for name in _get_names(entry):
+            lines.append(
+                "complete -c %s -n %s -a %s -d %s" % (
+                    program, command_condition, _quote_fish(name),
+                    _quote_fish(entry.summary or "")))
+    help_condition = _quote_fish(
+        "__fish_seen_subcommand_from %s" % (
+            " ".join(_get_help_names(commands)),))
+    for entry in commands + topics:
+        lines.append("complete -c %s -n %s -a %s -d %s" % (
+            program, help_condition, _quote_fish(entry.name),
+            _quote_fish(entry.summary or "")))
+    for entry in commands:
+        if not entry.options:
+            continue
+        condition = _quote_fish("__fish_seen_subcommand_from %s" % (
+            " ".join([entry.name] + entry.aliases),))
+        for option in entry.options:
+            if option.startswith("--"):
+                flag = "-l %s" % (_quote_fish(option[2:]),)
+            else:
+                flag = "-s %s" % (_quote_fish(option[1:]),)
+            if option in entry.value_options:
+                flag += " -r"
+            lines.append("complete -c %s -n %s %s" % (program, condition,
+                                                     flag))
+    return lines
+
+
+GENERATORS = {BASH: _generate_bash, ZSH: _generate_zsh, FISH: _generate_fish}
+
+
+def generate_script(shell, program_name, commands, topics, fingerprint,
+                    offset=0):
+    """Generate a completion script.
+
+    @param shell: One of L{SHELLS}.
+    @param program_name: The name of the program being completed.
+    @param commands: The L{IndexEntry}s for visible commands, with
+        summaries loaded.
+    @param topics: The L{IndexEntry}s for help topics, with summaries
+        loaded.
+    @param fingerprint: The fingerprint from L{get_registry_fingerprint}.
+    @param offset: The number of arguments the program takes before the
+        command name, like the path to the commands that C{bin/commandant}
+        takes.  Defaults to 0, for programs that take the command name
+        first.
+    @return: The script, as a C{unicode} string.
+    """
+    lines = [
+        "# %s completion for %s, generated by Commandant %s." % (
+            shell, program_name, __version__),
+        "%s%s" % (FINGERPRINT_PREFIX, fingerprint),
+        ""]
+    lines.extend(GENERATORS[shell](program_name, commands, topics, offset))
+    return u"\n".join(unicode(line) if isinstance(line, unicode)
+                      else line.decode("utf-8", "replace")
+                      for line in lines) + u"\n"
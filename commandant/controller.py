@@ -17,30 +17,51 @@
 
 """Infrastructure to run C{bzrlib.commands.Command}s and L{HelpTopic}s."""
 
+import hashlib
+import json
 import os
+from Queue import Queue, Empty
 import shutil
 import stat
 import sys
 import tempfile
+import threading
 
 import bzrlib.ui
 from bzrlib.commands import run_bzr, Command
+from bzrlib.errors import BzrCommandError
 
 from commandant import __version__
-from commandant.commands import ExecutableCommand
-from commandant.help_topics import FileHelpTopic
+from commandant.allocations import trace_run
+from commandant.cache import LRUCache
+from commandant.commands import (
+    ExecutableCommand, get_option_names, get_argument_placeholders)
+from commandant.completion import load_suggestion_tree, save_suggestion_tree
+from commandant.errors import AmbiguousCommandError
+from commandant.help_topics import FileHelpTopic, CommandHelpTopic
+from commandant.index import (
+    BKTree, HelpIndex, IndexEntry, COMMAND, EXECUTABLE, TOPIC)
+from commandant.profiling import extract_profile_path, profile_run
+from commandant.timing import get_timer, start_phase, stop_phase
 
 
 DEFAULT_PROGRAM_NAME = "commandant"
 DEFAULT_PROGRAM_VERSION = __version__
 DEFAULT_PROGRAM_SUMMARY = "A toolkit for building command-oriented tools."
 DEFAULT_PROGRAM_URL = "https://github.com/jkakar/commandant"
+DEFAULT_SUMMARY_WORKERS = 8
+MAX_SUGGESTIONS = 3
 
 
 class CommandRegistry(object):
 
     def __init__(self):
         self._commands = {}
+        self._aliases = {}
+        self._command_aliases = {}
+        self._profile_path = None
+        self.alias_conflicts = []
+        self.trace_allocations = False
 
     def install_bzrlib_hooks(self):
         """
@@ -79,27 +100,66 @@ class CommandRegistry(object):
         @return: The C{bzrlib.commands.Command} from the index or C{command}
             if one isn't available for C{name}.
         """
-        try:
-            local_command = self._commands[name]()
-        except KeyError:
+        if name not in self._commands:
+            name = self._aliases.get(name)
+        command_class = self._commands.get(name)
+        if command_class is None:
             return command
+        local_command = command_class()
         local_command.controller = self
+        if get_timer() is not None:
+            local_command.run = _time_run(name, local_command.run)
+        if self._profile_path is not None:
+            local_command.run = profile_run(local_command.run,
+                                            self._profile_path)
+        if self.trace_allocations:
+            local_command.run = trace_run(local_command.run, name)
         return local_command
 
     def register_command(self, name, command_class):
         """Register a C{bzrlib.commands.Command} with this controller.
 
+        The command's C{aliases} are added to a table mapping aliases to
+        command names, so that aliases are resolved without instantiating
+        commands.  An alias that's already used by another command, or
+        that's the name of a command, is recorded in L{alias_conflicts} as
+        an C{(alias, name, new_name)} tuple.  The most recently registered
+        command wins an alias, and a command name always wins over an
+        alias.  The aliases each command was given are kept too, so that
+        registering a command again only removes its own old aliases.
+
         @param name: The name to register the command with.
         @param command_class: A type object, typically a subclass of
             C{bzrlib.commands.Command} to use when the command is invoked.
         """
+        for alias in self._command_aliases.pop(name, []):
+            if self._aliases.get(alias) == name:
+                del self._aliases[alias]
+        if name in self._aliases:
+            self.alias_conflicts.append((name, self._aliases[name], name))
         self._commands[name] = command_class
+        for alias in getattr(command_class, "aliases", []):
+            if alias == name:
+                continue
+            existing_name = self._aliases.get(alias)
+            if alias in self._commands:
+                existing_name = alias
+            if existing_name is not None:
+                self.alias_conflicts.append((alias, existing_name, name))
+            self._aliases[alias] = name
+            self._command_aliases.setdefault(name, []).append(alias)
+
+    def get_aliases(self):
+        """Get a C{dict} mapping command aliases to command names."""
+        return dict(self._aliases)
 
 
 class HelpTopicRegistry(object):
 
     def __init__(self):
         self._help_topics = {}
+        self.help_cache = LRUCache()
+        self.help_cache_directory = None
 
     def register_help_topic(self, name, help_topic_class):
         """Register a C{bzrlib.commands.Command} to this controller.
@@ -126,8 +186,251 @@ class HelpTopicRegistry(object):
         return help_topic
 
 
+class HelpIndexMixin(object):
+    """Maintain a L{HelpIndex} of registered commands and help topics.
+
+    Entries are updated when names are registered, so listings can be
+    rendered from the index without instantiating every command and help
+    topic.  Summaries are loaded the first time they're needed and kept
+    with their entries.
+
+    @ivar summary_workers: The maximum number of threads used to load
+        summaries at once.
+    @ivar abbreviations: C{True} if L{run} accepts abbreviated command
+        names.
+    """
+
+    def __init__(self):
+        self._help_index = HelpIndex()
+        self._stale_names = set()
+        self._suggestion_tree = None
+        self.summary_workers = DEFAULT_SUMMARY_WORKERS
+        self.abbreviations = False
+
+    def install_bzrlib_hooks(self):
+        """
+        Register this controller with C{Command.hooks}.
+        L{_get_missing_command} is registered as a callback for the
+        C{get_missing_command} hook, so unknown command names are reported
+        with suggestions.
+        """
+        super(HelpIndexMixin, self).install_bzrlib_hooks()
+        Command.hooks.install_named_hook(
+            "get_missing_command", self._get_missing_command,
+            "commandant suggestions")
+
+    def _get_missing_command(self, name):
+        """
+        Hook called by C{bzrlib} when a command called C{name} can't be
+        found.
+
+        @raise BzrCommandError: Raised with suggested command names if there
+            are names similar to C{name}.
+        @return: C{None}, to let C{bzrlib} report the unknown command if
+            there aren't any suggestions.
+        """
+        suggestions = self.get_suggestions(name)
+        if suggestions:
+            raise BzrCommandError('unknown command "%s".  Did you mean %s?' % (
+                name, " or ".join(suggestions)))
+        return None
+
+    def register_command(self, name, command_class):
+        """Register a C{bzrlib.commands.Command} with this controller.
+
+        @param name: The name to register the command with.
+        @param command_class: A type object, typically a subclass of
+            C{bzrlib.commands.Command} to use when the command is invoked.
+        """
+        super(HelpIndexMixin, self).register_command(name, command_class)
+        self._stale_names.add(name)
+
+    def register_help_topic(self, name, help_topic_class):
+        """Register a L{HelpTopic} with this controller.
+
+        @param name: The name to register the help topic with.
+        @param help_topic_class: A type object, typically a subclass of
+            L{HelpTopic} to use when the help topic is shown.
+        """
+        super(HelpIndexMixin, self).register_help_topic(name,
+                                                        help_topic_class)
+        self._stale_names.add(name)
+
+    def get_help_index(self):
+        """
+        Get the L{HelpIndex} for this controller, updated with names
+        registered since it was last used.
+        """
+        for name in self._stale_names:
+            self._index_name(name)
+        self._stale_names.clear()
+        return self._help_index
+
+    def resolve_command_name(self, name):
+        """Resolve an abbreviated command name to the full name.
+
+        Visible commands can be abbreviated to any prefix that's unique
+        among their names.  Prefixes are resolved with a L{PrefixTrie}
+        that's built once from the help index.
+
+        @raise AmbiguousCommandError: Raised if C{name} isn't a command name
+            or alias and several commands start with it.
+        @return: The full name of the command C{name} abbreviates, or
+            C{name} if it's a command name or alias or doesn't abbreviate
+            one.
+        """
+        if name in self._commands or name in self._aliases:
+            return name
+        candidates = self.get_help_index().get_command_trie().resolve(name)
+        if len(candidates) > 1:
+            raise AmbiguousCommandError(name, candidates)
+        elif candidates:
+            return candidates[0]
+        return name
+
+    def get_suggestions(self, name, limit=MAX_SUGGESTIONS):
+        """Get visible command and help topic names similar to C{name}.
+
+        Names are found with a L{BKTree}, built the first time it's needed
+        after the registered names change.  The tree is cached in
+        L{completion_directory}, if it's set, for as long as the names are
+        unchanged, so it doesn't need to be built for every typo.
+
+        @param limit: The maximum number of names to return.
+        @return: A C{list} of up to C{limit} names within two edits of
+            C{name}, or one edit if it's shorter than four characters,
+            closest first.
+        """
+        max_distance = min(2, max(1, len(name) // 2))
+        matches = self._get_suggestion_tree().search(name, max_distance)
+        return [match for distance, match in matches
+                if match != name][:limit]
+
+    def _get_suggestion_tree(self):
+        """Get the L{BKTree} of visible command and help topic names."""
+        help_index = self.get_help_index()
+        names = set(entry.name
+                    for entry in help_index.get_commands(hidden=False))
+        names.update(entry.name for entry in help_index.get_topics())
+        names = sorted(names)
+        fingerprint = hashlib.sha1(json.dumps(names)).hexdigest()
+        if (self._suggestion_tree is not None and
+            self._suggestion_tree[0] == fingerprint):
+            return self._suggestion_tree[1]
+        directory = self.completion_directory
+        paths = self.loaded_paths
+        tree = None
+        if directory is not None and paths:
+            tree = load_suggestion_tree(directory, paths, fingerprint)
+        if tree is None:
+            tree = BKTree(names)
+            if directory is not None and paths:
+                try:
+                    save_suggestion_tree(directory, paths, fingerprint, tree)
+                except (IOError, OSError):
+                    # The tree is built again next time.
+                    pass
+        self._suggestion_tree = (fingerprint, tree)
+        return tree
+
+    def _index_name(self, name):
+        """Create the L{IndexEntry} for the command or help topic C{name}."""
+        self._help_index.remove(name)
+        command_class = self._commands.get(name)
+        if command_class is not None:
+            hidden = bool(getattr(command_class, "hidden", False))
+            if (isinstance(command_class, type) and
+                issubclass(command_class, ExecutableCommand)):
+                entry = IndexEntry(name, EXECUTABLE, hidden=hidden,
+                                   path=command_class.path)
+            else:
+                (options, value_options) = get_option_names(command_class)
+                entry = IndexEntry(
+                    name, COMMAND, hidden=hidden,
+                    path=self.get_source_path(command_class),
+                    options=options, value_options=value_options,
+                    arguments=get_argument_placeholders(command_class),
+                    aliases=list(getattr(command_class, "aliases", [])))
+            self._help_index.set_command(entry)
+        elif name in self._help_topics:
+            path = getattr(self._help_topics[name], "path", None)
+            self._help_index.set_topic(IndexEntry(name, TOPIC, path=path))
+
+    def load_summaries(self, entries):
+        """Load summaries for L{IndexEntry}s that don't have one yet.
+
+        A command's summary comes from the help topic with the same name, if
+        one is registered, or from the command itself.  Summaries read from
+        text file help topics are loaded by up to L{summary_workers}
+        threads at once, so that reading many files on a slow filesystem
+        takes about as long as reading the slowest one.  Other summaries,
+        including those of executables, don't come from files and would
+        only be slowed down by threads, so they're loaded in the calling
+        thread.
+        The order of C{entries} isn't changed.
+        """
+        pending = Queue()
+        for entry in entries:
+            if entry.summary is not None:
+                continue
+            if self._is_file_backed(entry):
+                pending.put(entry)
+            else:
+                entry.summary = self._load_summary(entry)
+        workers = min(self.summary_workers, pending.qsize())
+        if workers < 2:
+            while not pending.empty():
+                entry = pending.get()
+                entry.summary = self._load_summary(entry)
+            return
+
+        errors = []
+
+        def load():
+            while not errors:
+                try:
+                    entry = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    entry.summary = self._load_summary(entry)
+                except:
+                    errors.append(sys.exc_info())
+
+        threads = [threading.Thread(target=load) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            (error_type, error, traceback) = errors[0]
+            raise error_type, error, traceback
+
+    def _is_file_backed(self, entry):
+        """
+        Return C{True} if the summary for C{entry} is read from a text file
+        help topic.
+        """
+        topic_class = self._help_topics.get(entry.name)
+        return (isinstance(topic_class, type) and
+                issubclass(topic_class, FileHelpTopic))
+
+    def _load_summary(self, entry):
+        """Load the summary for C{entry}."""
+        help_topic = self.get_help_topic(entry.name)
+        if help_topic is None:
+            help_topic = CommandHelpTopic(self.get_command(entry.name))
+            help_topic.controller = self
+        return help_topic.get_summary()
+
+
 class CommandDiscoveryMixin(object):
 
+    def __init__(self):
+        self._module_paths = {}
+        self.loaded_paths = []
+        self.completion_directory = None
+
     def load_path(self, path):
         """Load C{bzrlib.commands.Command}s and L{HelpTopic}s from C{path}.
 
@@ -136,6 +439,7 @@ class CommandDiscoveryMixin(object):
         L{ExecutableCommand}s are created for executable programs in C{path}
         and L{FileHelpTopic}s are created for text file help topics.
         """
+        self.loaded_paths.append(path)
         package_path = tempfile.mkdtemp()
         try:
             for filename in os.listdir(path):
@@ -152,8 +456,13 @@ class CommandDiscoveryMixin(object):
                         {"path": file_path})
                     self.register_command(sanitized_name, executable)
                 elif filename.endswith(".py"):
-                    command_module = import_module(filename, file_path,
-                                                   package_path)
+                    phase = start_phase("import %s" % (filename,))
+                    try:
+                        command_module = import_module(filename, file_path,
+                                                       package_path)
+                    finally:
+                        stop_phase(phase)
+                    self._module_paths[command_module.__name__] = file_path
                     self.load_module(command_module)
                 elif filename.endswith(".txt"):
                     sanitized_name = filename.replace("_", "-")[:-4]
@@ -179,6 +488,19 @@ class CommandDiscoveryMixin(object):
                 sanitized_name = name[6:].replace("_", "-")
                 self.register_help_topic(sanitized_name, module.__dict__[name])
 
+    def get_source_path(self, command_class):
+        """Get the path of the Python file C{command_class} was loaded from.
+
+        @return: The path, or C{None} if it isn't known.
+        """
+        module_name = getattr(command_class, "__module__", None)
+        path = self._module_paths.get(module_name)
+        if path is None:
+            path = getattr(sys.modules.get(module_name), "__file__", None)
+            if path is not None and path.endswith((".pyc", ".pyo")):
+                path = path[:-1]
+        return path
+
     def get_command_names(self):
         """
         Get the C{set} of C{bzrlib.commands.Command} names registered with
@@ -203,12 +525,37 @@ class CommandExecutionMixin(object):
     def run(self, argv):
         """Run the C{bzrlib.commands.Command} specified in C{argv}.
 
+        If L{abbreviations} is C{True} the command name can be abbreviated
+        to a prefix that's unique among visible command names.
+
+        The C{--profile-command=PATH} global option profiles the command's
+        C{run} method, and nothing else, and writes the results to C{PATH}.
+        See L{commandant.profiling} for the formats it can write.
+
         @raise BzrCommandError: Raised if a matching command can't be found.
+        @raise AmbiguousCommandError: Raised if an abbreviated command name
+            matches several commands.
+        @return: The value returned by the command.
         """
-        run_bzr(argv)
+        profile_path, argv = extract_profile_path(argv)
+        if self.abbreviations and argv and not argv[0].startswith("-"):
+            argv = [self.resolve_command_name(argv[0])] + list(argv[1:])
+        # The path is picked up by _get_command, when bzrlib asks for the
+        # command, and restored afterwards in case this run is nested in
+        # another.
+        original_profile_path = self._profile_path
+        self._profile_path = profile_path
+        # When timing is enabled the command's run method is timed on its
+        # own, so the rest of this phase is spent parsing options.
+        phase = start_phase("dispatch and parse options")
+        try:
+            return run_bzr(argv)
+        finally:
+            stop_phase(phase)
+            self._profile_path = original_profile_path
 
 
-class CommandController(CommandRegistry, HelpTopicRegistry,
+class CommandController(HelpIndexMixin, CommandRegistry, HelpTopicRegistry,
                         CommandDiscoveryMixin, CommandExecutionMixin):
     """C{bzrlib.commands.Command} discovery and execution controller.
 
@@ -221,18 +568,43 @@ class CommandController(CommandRegistry, HelpTopicRegistry,
 
     A controller is an execution engine for commands.  The L{run} method
     accepts command line arguments, finds a matching command, and runs it.
+    Command names can be abbreviated to unique prefixes if L{abbreviations}
+    is C{True}, and the memory each command allocates is reported if
+    L{trace_allocations} is C{True}.
+
+    The controller keeps a L{HelpIndex} of the commands and help topics it
+    knows about, which is used to render listings efficiently, and a
+    size-bounded L{LRUCache} of loaded help text in L{help_cache}.  Help
+    rendered for commands is also cached on disk in L{help_cache_directory},
+    if it's set, and the C{complete} command caches names for shell
+    completion in L{completion_directory}.
     """
 
     def __init__(self, program_name=None, program_version=None,
                  program_summary=None, program_url=None):
+        HelpIndexMixin.__init__(self)
         CommandRegistry.__init__(self)
         HelpTopicRegistry.__init__(self)
+        CommandDiscoveryMixin.__init__(self)
         self.program_name = program_name or DEFAULT_PROGRAM_NAME
         self.program_version = program_version or DEFAULT_PROGRAM_VERSION
         self.program_summary = program_summary or DEFAULT_PROGRAM_SUMMARY
         self.program_url = program_url or DEFAULT_PROGRAM_URL
 
 
+def _time_run(name, run):
+    """Wrap a command's C{run} method to time it as a phase."""
+
+    def timed_run(*args, **kwargs):
+        phase = start_phase("run %s" % (name,))
+        try:
+            return run(*args, **kwargs)
+        finally:
+            stop_phase(phase)
+
+    return timed_run
+
+
 def import_module(filename, file_path, package_path):
     """Import a module and make it a child of C{commandant_command}.
 
@@ -0,0 +1,512 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure to run commands on worker processes using AMP.
+
+A worker is a process that listens for connections from a coordinator and
+runs the commands it's sent with its own L{CommandController}.  Each
+command runs in a child forked from the worker, with its standard input,
+output and error connected to pipes.  Output is streamed back to the
+coordinator as it's produced and standard input is streamed to the command
+as the coordinator sends it.  Workers can run on the same host as the
+coordinator or on other hosts.
+"""
+
+import errno
+import os
+import signal
+import sys
+
+from zope.interface import implements
+
+from twisted.internet import fdesc, protocol
+from twisted.internet.abstract import FileDescriptor
+from twisted.internet.defer import Deferred, DeferredList, fail, succeed
+from twisted.internet.interfaces import IConsumer, IPushProducer
+from twisted.protocols import amp
+from twisted.protocols.basic import FileSender
+
+from commandant.errors import WorkerError
+from commandant.process import fork_command, wait_for_child
+
+
+# AMP limits values to 64KiB, so stdin is sent in smaller chunks.
+CHUNK_SIZE = 32768
+
+STDOUT = 1
+STDERR = 2
+
+# The parent's ends of the pipes connected to running children.  A newly
+# forked child closes all of them, otherwise a child holding a copy of
+# another child's stdin pipe would stop that child from ever seeing EOF.
+_parent_fds = set()
+
+
+class UnknownJob(Exception):
+    """Raised when a worker receives input for a job it isn't running."""
+
+
+class RunCommand(amp.Command):
+    """Run a command on a worker and wait for it to exit."""
+
+    arguments = [("job", amp.Integer()),
+                 ("name", amp.Unicode()),
+                 ("arguments", amp.ListOf(amp.Unicode())),
+                 ("stdin", amp.Boolean())]
+    response = [("status", amp.Integer())]
+
+
+class WriteInput(amp.Command):
+    """Send a chunk of standard input to a running command."""
+
+    arguments = [("job", amp.Integer()),
+                 ("data", amp.String())]
+    response = []
+    errors = {UnknownJob: "UNKNOWN_JOB"}
+
+
+class CloseInput(amp.Command):
+    """Close the standard input of a running command."""
+
+    arguments = [("job", amp.Integer())]
+    response = []
+    errors = {UnknownJob: "UNKNOWN_JOB"}
+
+
+class WriteOutput(amp.Command):
+    """Send a chunk of a command's output to the coordinator."""
+
+    arguments = [("job", amp.Integer()),
+                 ("stream", amp.Integer()),
+                 ("data", amp.String())]
+    requiresAnswer = False
+
+
+class PipeReader(FileDescriptor):
+    """Read from a pipe and pass the data to a callback."""
+
+    def __init__(self, fd, data_received, reactor=None):
+        FileDescriptor.__init__(self, reactor)
+        fdesc.setNonBlocking(fd)
+        self.fd = fd
+        self.closed = Deferred()
+        self._data_received = data_received
+        self.startReading()
+
+    def fileno(self):
+        return self.fd
+
+    def doRead(self):
+        return fdesc.readFromFD(self.fd, self._data_received)
+
+    def connectionLost(self, reason):
+        FileDescriptor.connectionLost(self, reason)
+        _parent_fds.discard(self.fd)
+        os.close(self.fd)
+        self.closed.callback(None)
+
+
+class InputGate(object):
+    """Hold back input while a L{PipeWriter}'s buffer is full.
+
+    The gate is registered as the writer's producer, so the writer pauses it
+    when its buffer fills up and resumes it when the buffer drains.
+    """
+
+    implements(IPushProducer)
+
+    def __init__(self):
+        self._paused = False
+        self._waiting = []
+
+    def wait(self):
+        """
+        @return: A C{Deferred} that fires when the writer can take more data.
+        """
+        if not self._paused:
+            return succeed(None)
+        deferred = Deferred()
+        self._waiting.append(deferred)
+        return deferred
+
+    def pauseProducing(self):
+        self._paused = True
+
+    def resumeProducing(self):
+        self._paused = False
+        waiting, self._waiting = self._waiting, []
+        for deferred in waiting:
+            deferred.callback(None)
+
+    def stopProducing(self):
+        self.resumeProducing()
+
+
+class PipeWriter(FileDescriptor):
+    """Buffer data and write it to a pipe when it's writable."""
+
+    def __init__(self, fd, reactor=None):
+        FileDescriptor.__init__(self, reactor)
+        fdesc.setNonBlocking(fd)
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def writeSomeData(self, data):
+        return fdesc.writeToFD(self.fd, data)
+
+    def connectionLost(self, reason):
+        FileDescriptor.connectionLost(self, reason)
+        _parent_fds.discard(self.fd)
+        os.close(self.fd)
+
+
+def install_fresh_reactor():
+    """Replace the reactor inherited from a parent process with a new one.
+
+    A forked child can't reuse the parent's running reactor, which would
+    otherwise break commands, like L{TwistedCommand}s, that run one.
+    """
+    sys.modules.pop("twisted.internet.reactor", None)
+    from twisted.internet import default
+    default.install()
+
+
+class ChildCommand(object):
+    """A command running in a child process with its I/O on pipes.
+
+    @param controller: The L{CommandController} to run the command with.
+    @param argv: The command-line arguments to run the command with.
+    @param write_output: A callable invoked with a stream number, L{STDOUT}
+        or L{STDERR}, and a chunk of data when the command writes output.
+    @param stdin: C{True} if the command's standard input will be written
+        with L{write_input}, otherwise it's connected to C{/dev/null}.
+    """
+
+    def __init__(self, controller, argv, write_output, stdin=False,
+                 reactor=None, poll_interval=0.01):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.controller = controller
+        self.argv = argv
+        self.pid = None
+        self._write_output = write_output
+        self._stdin = stdin
+        self._reactor = reactor
+        self._poll_interval = poll_interval
+        self._input = None
+        self._gate = InputGate()
+
+    def start(self):
+        """Start the command.
+
+        @return: A C{Deferred} that fires with the command's exit status.
+        """
+        if self._stdin:
+            stdin_read, stdin_write = os.pipe()
+        else:
+            stdin_read, stdin_write = os.open(os.devnull, os.O_RDONLY), None
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        _parent_fds.update(fd for fd in (stdin_write, stdout_read, stderr_read)
+                           if fd is not None)
+
+        def setup():
+            for fd in _parent_fds:
+                os.close(fd)
+            install_fresh_reactor()
+
+        try:
+            self.pid = fork_command(
+                self.controller, self.argv, stdin=stdin_read,
+                stdout=stdout_write, stderr=stderr_write, setup=setup)
+        finally:
+            for fd in (stdin_read, stdout_write, stderr_write):
+                os.close(fd)
+        if stdin_write is not None:
+            self._input = PipeWriter(stdin_write, self._reactor)
+            self._input.registerProducer(self._gate, True)
+        readers = [
+            PipeReader(stdout_read,
+                       lambda data: self._write_output(STDOUT, data),
+                       self._reactor),
+            PipeReader(stderr_read,
+                       lambda data: self._write_output(STDERR, data),
+                       self._reactor)]
+        closed = DeferredList([reader.closed for reader in readers])
+        return closed.addCallback(lambda ignored: self._wait())
+
+    def _wait(self):
+        """Wait for the child to exit and return its exit status."""
+        deferred = Deferred()
+
+        def poll():
+            pid, exit_status = wait_for_child(self.pid, block=False)
+            if pid == 0:
+                self._reactor.callLater(self._poll_interval, poll)
+            else:
+                if self._input is not None:
+                    self._input.loseConnection()
+                # Input the command will never read isn't held back.
+                self._gate.stopProducing()
+                deferred.callback(exit_status)
+
+        poll()
+        return deferred
+
+    def write_input(self, data):
+        """Write C{data} to the command's standard input.
+
+        @return: A C{Deferred} that fires when the command's standard input
+            can take more data.
+        """
+        if self._input is not None and not self._input.disconnecting:
+            self._input.write(data)
+        return self._gate.wait()
+
+    def close_input(self):
+        """Close the command's standard input."""
+        if self._input is not None:
+            self._input.loseConnection()
+
+    def kill(self):
+        """Terminate the command.
+
+        The child is reaped, and the C{Deferred} returned by L{start} fires,
+        once it exits.
+        """
+        if self.pid is None:
+            return
+        try:
+            os.kill(self.pid, signal.SIGTERM)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+
+
+class WorkerProtocol(amp.AMP):
+    """The worker side of the protocol, which runs commands it's sent."""
+
+    def __init__(self, controller):
+        amp.AMP.__init__(self)
+        self.controller = controller
+        self._jobs = {}
+
+    @RunCommand.responder
+    def run_command(self, job, name, arguments, stdin):
+        """Run a command in a child process and stream its output back."""
+
+        def write_output(stream, data):
+            if job in self._jobs:
+                self.callRemote(WriteOutput, job=job, stream=stream, data=data)
+
+        child = ChildCommand(self.controller, [name] + arguments,
+                             write_output, stdin=stdin)
+        self._jobs[job] = child
+        deferred = child.start()
+
+        def finish(exit_status):
+            self._jobs.pop(job, None)
+            return {"status": exit_status}
+
+        return deferred.addCallback(finish)
+
+    def connectionLost(self, reason):
+        """Terminate the commands that are still running."""
+        amp.AMP.connectionLost(self, reason)
+        jobs, self._jobs = self._jobs, {}
+        for child in jobs.itervalues():
+            child.kill()
+
+    def _get_job(self, job):
+        """Get the L{ChildCommand} running C{job}."""
+        try:
+            return self._jobs[job]
+        except KeyError:
+            raise UnknownJob("Job %d isn't running." % (job,))
+
+    @WriteInput.responder
+    def write_input(self, job, data):
+        """Write a chunk of standard input to a running command.
+
+        The answer is sent once the command's standard input can take more
+        data, so the coordinator doesn't send more than the pipe drains.
+        """
+        deferred = self._get_job(job).write_input(data)
+        return deferred.addCallback(lambda ignored: {})
+
+    @CloseInput.responder
+    def close_input(self, job):
+        """Close the standard input of a running command."""
+        self._get_job(job).close_input()
+        return {}
+
+
+class WorkerFactory(protocol.ServerFactory):
+    """Create L{WorkerProtocol}s for connections from coordinators."""
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def buildProtocol(self, address):
+        return WorkerProtocol(self.controller)
+
+
+class InputConsumer(object):
+    """Send the data from a pull producer to a job's standard input.
+
+    Each chunk is sent once the worker has answered for the previous one.
+    """
+
+    implements(IConsumer)
+
+    def __init__(self, protocol, job):
+        self._protocol = protocol
+        self._job = job
+        self._producer = None
+
+    def registerProducer(self, producer, streaming):
+        self._producer = producer
+        producer.resumeProducing()
+
+    def unregisterProducer(self):
+        self._producer = None
+
+    def write(self, data):
+        deferred = self._protocol.callRemote(WriteInput, job=self._job,
+                                             data=data)
+        deferred.addCallbacks(self._resume, self._stop)
+
+    def _resume(self, ignored):
+        if self._producer is not None:
+            self._producer.resumeProducing()
+
+    def _stop(self, failure):
+        # The job exited, or the connection was lost, before all of its
+        # input was sent.
+        producer, self._producer = self._producer, None
+        if producer is not None:
+            producer.stopProducing()
+
+
+class CoordinatorProtocol(amp.AMP):
+    """The coordinator side of the protocol, which receives output."""
+
+    def __init__(self):
+        amp.AMP.__init__(self)
+        self._outputs = {}
+        self.running = 0
+
+    def run(self, job, argv, write_output, stdin=None):
+        """Run C{argv} on the worker.
+
+        @param job: A unique ID for the job.
+        @param argv: The command-line arguments to run the command with.
+        @param write_output: A callable invoked with a stream number and a
+            chunk of data when the command writes output.
+        @param stdin: Optionally, a file-like object to read the command's
+            standard input from.
+        @return: A C{Deferred} that fires with the command's exit status.
+        """
+        self._outputs[job] = write_output
+        self.running += 1
+        deferred = self.callRemote(
+            RunCommand, job=job, name=argv[0], arguments=list(argv[1:]),
+            stdin=stdin is not None)
+        if stdin is not None:
+            sender = FileSender()
+            sender.CHUNK_SIZE = CHUNK_SIZE
+            sending = sender.beginFileTransfer(stdin,
+                                               InputConsumer(self, job))
+            sending.addCallback(
+                lambda ignored: self.callRemote(CloseInput, job=job))
+            sending.addErrback(lambda failure: None)
+
+        def finish(result):
+            del self._outputs[job]
+            self.running -= 1
+            return result
+
+        deferred.addBoth(finish)
+        return deferred.addCallback(lambda response: response["status"])
+
+    @WriteOutput.responder
+    def write_output(self, job, stream, data):
+        """Pass a chunk of output to the callback for C{job}."""
+        write_output = self._outputs.get(job)
+        if write_output is not None:
+            write_output(stream, data)
+        return {}
+
+
+class Coordinator(object):
+    """Distribute commands across a pool of connected workers.
+
+    Each command is sent to the worker with the fewest running commands.
+    """
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._workers = []
+        self._next_job = 1
+
+    def connect(self, host, port):
+        """Connect to the worker listening on C{host} and C{port}.
+
+        @return: A C{Deferred} that fires when the connection is made.
+        """
+        creator = protocol.ClientCreator(self._reactor, CoordinatorProtocol)
+        deferred = creator.connectTCP(host, port)
+        return deferred.addCallback(self.add_worker)
+
+    def add_worker(self, worker):
+        """Add a connected L{CoordinatorProtocol} to the pool."""
+        self._workers.append(worker)
+        return worker
+
+    def disconnect(self):
+        """Disconnect from all workers."""
+        for worker in self._workers:
+            worker.transport.loseConnection()
+        self._workers = []
+
+    def run(self, argv, outf=None, errf=None, stdin=None):
+        """Run C{argv} on the least busy worker.
+
+        @param argv: The command-line arguments to run the command with.
+        @param outf: Optionally, a stream to write the command's standard
+            output to.  Defaults to C{sys.stdout}.
+        @param errf: Optionally, a stream to write the command's standard
+            error to.  Defaults to C{sys.stderr}.
+        @param stdin: Optionally, a file-like object to read the command's
+            standard input from.
+        @return: A C{Deferred} that fires with the command's exit status.
+        """
+        if not self._workers:
+            return fail(WorkerError("There aren't any connected workers."))
+        streams = {STDOUT: outf or sys.stdout, STDERR: errf or sys.stderr}
+
+        def write_output(stream, data):
+            streams[stream].write(data)
+
+        worker = min(self._workers, key=lambda worker: worker.running)
+        job = self._next_job
+        self._next_job += 1
+        return worker.run(job, argv, write_output, stdin)
@@ -17,9 +17,21 @@
 
 """Bootstrap code starts and runs Commandant."""
 
-from commandant import builtins
+import os
+import sys
+
+from commandant.completion import (
+    complete_from_cache, get_default_completion_directory,
+    resolve_from_cache, save_command_trie)
 from commandant.errors import UsageError
-from commandant.controller import CommandController
+from commandant.timing import (
+    get_process_start_time, get_time, start_timing, stop_timing,
+    start_phase, stop_phase)
+
+
+# The entry point always uses the controller's default program name.  It's
+# repeated here so completions can be answered without importing bzrlib.
+PROGRAM_NAME = "commandant"
 
 
 def main(argv):
@@ -32,17 +44,143 @@ def main(argv):
        the path to C{bzrlib.commands.Command}s and L{HelpTopic}s to load and
        the second argument should be the name of the command to run.  Any
        further arguments are passed to the command.
+    @return: The value returned by the command, to be used as the exit
+        status of the process.
+
+    If the C{COMMANDANT_TIMING} environment variable is set, a breakdown of
+    the time spent in each phase of the run is written to C{stderr} when
+    it finishes.  If the C{COMMANDANT_TRACE} environment variable is set,
+    the phases are written to the file it names as a Chrome trace.  If the
+    C{COMMANDANT_TRACE_ALLOCATIONS} environment variable is set, the memory
+    allocated by each command is reported to C{stderr}.  If the
+    C{COMMANDANT_DEBUG} environment variable is set, conflicting command
+    aliases are reported to C{stderr}.
     """
+    timing = os.environ.get("COMMANDANT_TIMING")
+    trace_path = os.environ.get("COMMANDANT_TRACE")
+    if not timing and not trace_path:
+        return _main(argv)
+    now = get_time()
+    start = get_process_start_time()
+    timer = start_timing(start)
+    if start is not None:
+        timer.add_phase("interpreter startup", start, now)
+    try:
+        return _main(argv)
+    finally:
+        stop_timing()
+        if timing:
+            timer.report(sys.stderr)
+        if trace_path:
+            write_trace(timer, trace_path, sys.stderr)
+
+
+def write_trace(timer, path, stream):
+    """Write the phases recorded by C{timer} to C{path} as a Chrome trace.
+
+    @param timer: The L{Timer} phases were recorded with.
+    @param path: The path of the file to write the trace to.
+    @param stream: The stream to write a warning to if the trace can't be
+        written.
+    """
+    try:
+        trace_file = open(path, "w")
+        try:
+            timer.write_trace(trace_file)
+        finally:
+            trace_file.close()
+    except IOError, e:
+        stream.write("commandant: warning: can't write trace to %s: %s\n"
+                     % (path, e.strerror))
+
+
+def _main(argv):
+    """Run the command named in C{argv}, as described by L{main}."""
     if len(argv) < 2 or (len(argv) > 1 and argv[1].startswith("-")):
         raise UsageError(
             "You must provide a path to the commands you want to run.")
     elif len(argv) < 3:
         argv.append("help")
 
+    completion_directory = get_default_completion_directory(PROGRAM_NAME)
+    if argv[2] == "complete":
+        words = argv[3:]
+        if words and words[0] == "--":
+            words = words[1:]
+        candidates = complete_from_cache(completion_directory, [argv[1]],
+                                         words)
+        if candidates is not None:
+            for candidate in candidates:
+                print >>sys.stdout, candidate
+            return
+
+    # Abbreviated command names are resolved with the cached trie, if it's
+    # up to date, so that the controller doesn't need to build one.
+    abbreviations = bool(os.environ.get("COMMANDANT_ABBREVIATIONS"))
+    candidates = None
+    if abbreviations and not argv[2].startswith("-"):
+        candidates = resolve_from_cache(completion_directory, [argv[1]],
+                                        argv[2])
+        if candidates is not None and len(candidates) == 1:
+            argv[2] = candidates[0]
+
+    # Import these here, rather than at the top of the module, so that
+    # completions can be answered from the cache without loading them.
+    # bzrlib and Twisted are imported first so their cost is timed
+    # separately.
+    phase = start_phase("import bzrlib")
+    __import__("bzrlib.commands")
+    stop_phase(phase)
+    phase = start_phase("import Twisted")
+    __import__("twisted.internet.defer")
+    stop_phase(phase)
+    phase = start_phase("import commandant")
+    from commandant import builtins
+    from commandant.cache import get_default_help_cache_directory
+    from commandant.controller import CommandController
+    stop_phase(phase)
+
     # Load commands topic from the user-supplied path after loading builtins,
     # in case any of the user's commands or topics replace builtin ones.
     controller = CommandController()
+    controller.help_cache_directory = get_default_help_cache_directory(
+        controller.program_name)
+    controller.completion_directory = completion_directory
+    phase = start_phase("load builtins")
     controller.load_module(builtins)
+    stop_phase(phase)
+    phase = start_phase("load path")
     controller.load_path(argv[1])
+    stop_phase(phase)
+    if os.environ.get("COMMANDANT_DEBUG"):
+        print_alias_conflicts(controller, sys.stderr)
+    controller.abbreviations = abbreviations
+    controller.trace_allocations = bool(
+        os.environ.get("COMMANDANT_TRACE_ALLOCATIONS"))
+    if abbreviations and candidates is None:
+        try:
+            save_command_trie(completion_directory, controller)
+        except (IOError, OSError):
+            # The trie is built again on the next run.
+            pass
+    phase = start_phase("install bzrlib hooks")
     controller.install_bzrlib_hooks()
-    controller.run(argv[2:])
+    stop_phase(phase)
+    return controller.run(argv[2:])
+
+
+def print_alias_conflicts(controller, stream):
+    """
+    Print a warning to C{stream} for each alias conflict recorded by
+    C{controller}, saying which command the alias runs.
+    """
+    for alias, name, new_name in controller.alias_conflicts:
+        if alias in controller.get_command_names():
+            if name == alias:
+                name = new_name
+            message = ("%s is a command and an alias of %s; the command is "
+                       "run." % (alias, name))
+        else:
+            message = "%s is an alias of both %s and %s; %s is run." % (
+                alias, name, new_name, new_name)
+        print >>stream, "%s: warning: %s" % (PROGRAM_NAME, message)
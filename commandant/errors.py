@@ -26,3 +26,33 @@ class CommandantError(StandardError):
 class UsageError(CommandantError):
     """Raised when too few command-line arguments are provided."""
     pass
+
+
+class GraphError(CommandantError):
+    """Raised when a command graph is malformed."""
+    pass
+
+
+class ScheduleError(CommandantError):
+    """Raised when a schedule can't be parsed."""
+    pass
+
+
+class WorkerError(CommandantError):
+    """Raised when a command can't be sent to a worker."""
+    pass
+
+
+class AmbiguousCommandError(CommandantError):
+    """Raised when an abbreviated command name matches several commands.
+
+    @ivar name: The abbreviated name.
+    @ivar candidates: The sorted names of the commands it matches.
+    """
+
+    def __init__(self, name, candidates):
+        super(AmbiguousCommandError, self).__init__(
+            "%s is ambiguous and could be any of: %s." % (
+                name, ", ".join(candidates)))
+        self.name = name
+        self.candidates = candidates
@@ -0,0 +1,436 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure to run a graph of commands with dependencies between them.
+
+A command graph is described by a JSON file containing a list of nodes::
+
+  [{"name": "build", "command": ["build", "--release"],
+    "inputs": ["src"]},
+   {"name": "test", "command": ["test"], "requires": ["build"]},
+   {"name": "deploy", "command": ["deploy"], "requires": ["build", "test"]}]
+
+Each node has a unique name, the command line to run, the names of the
+nodes that must complete successfully before it can run and, optionally,
+the paths it reads from.  Input paths are relative to the directory
+containing the graph file.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from commandant.errors import GraphError
+from commandant.output import OutputPump
+from commandant.process import fork_command, wait_for_child
+
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+DEFAULT_DURATION = 1.0
+
+
+class GraphNode(object):
+    """A command invocation in a L{CommandGraph}.
+
+    @ivar name: The unique name of the node.
+    @ivar argv: The command-line arguments to run the command with.
+    @ivar requires: The names of the nodes that must succeed before this
+        one can run.
+    @ivar inputs: The paths this node reads from.
+    """
+
+    def __init__(self, name, argv, requires=None, inputs=None):
+        self.name = name
+        self.argv = list(argv)
+        self.requires = list(requires or [])
+        self.inputs = list(inputs or [])
+
+
+class CommandGraph(object):
+    """A directed acyclic graph of L{GraphNode}s."""
+
+    def __init__(self, base_path=None):
+        self.base_path = base_path or os.getcwd()
+        self._nodes = {}
+        self._dependents = {}
+
+    def add_node(self, node):
+        """Add C{node} to the graph.
+
+        @raise GraphError: Raised if a node with the same name already exists.
+        """
+        if node.name in self._nodes:
+            raise GraphError("Node %s is defined more than once." %
+                             (node.name,))
+        self._nodes[node.name] = node
+        self._dependents.setdefault(node.name, [])
+        for name in node.requires:
+            self._dependents.setdefault(name, []).append(node.name)
+
+    def get_node(self, name):
+        """Get the L{GraphNode} called C{name}."""
+        return self._nodes[name]
+
+    def get_node_names(self):
+        """Get a C{set} of node names."""
+        return set(self._nodes.iterkeys())
+
+    def get_dependents(self, name):
+        """Get the names of the nodes that require the node called C{name}."""
+        return list(self._dependents.get(name, []))
+
+    def validate(self):
+        """Check that all requirements exist and that there are no cycles.
+
+        @raise GraphError: Raised if the graph is malformed.
+        """
+        for node in self._nodes.itervalues():
+            for name in node.requires:
+                if name not in self._nodes:
+                    raise GraphError("Node %s requires unknown node %s." %
+                                     (node.name, name))
+        self.get_sorted_names()
+
+    def get_sorted_names(self):
+        """Get node names in an order that respects their requirements.
+
+        @raise GraphError: Raised if the graph contains a cycle.
+        """
+        remaining = dict((name, len(node.requires))
+                         for name, node in self._nodes.iteritems())
+        ready = sorted(name for name, count in remaining.iteritems()
+                       if count == 0)
+        result = []
+        while ready:
+            name = ready.pop(0)
+            result.append(name)
+            for dependent in self.get_dependents(name):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        if len(result) != len(self._nodes):
+            cycle = sorted(name for name in self._nodes
+                           if name not in result)
+            raise GraphError("Nodes %s have circular requirements." %
+                             (", ".join(cycle),))
+        return result
+
+    def get_priorities(self, durations):
+        """Calculate the length of the critical path starting at each node.
+
+        @param durations: A C{dict} mapping node names to the time they took
+            to run previously.  Nodes without a recorded duration are assumed
+            to take the average of the known durations.
+        @return: A C{dict} mapping node names to the total expected duration
+            of the longest chain of nodes starting with them.  Running nodes
+            with the highest priority first shortens the overall run.
+        """
+        known = [durations[name] for name in self._nodes if name in durations]
+        default = DEFAULT_DURATION
+        if known:
+            default = sum(known) / len(known)
+        priorities = {}
+        for name in reversed(self.get_sorted_names()):
+            longest = 0
+            for dependent in self.get_dependents(name):
+                longest = max(longest, priorities[dependent])
+            priorities[name] = durations.get(name, default) + longest
+        return priorities
+
+    def get_fingerprint(self, name):
+        """Get a fingerprint of the command line and inputs for a node.
+
+        @raise GraphError: Raised if an input can't be read.
+        @return: A hex digest that changes when the node's command line or the
+            content of any of its inputs changes, or C{None} if the node
+            doesn't have any inputs.
+        """
+        node = self._nodes[name]
+        if not node.inputs:
+            return None
+        digest = hashlib.sha1()
+        digest.update(repr(node.argv))
+        for input_path in node.inputs:
+            path = os.path.join(self.base_path, input_path)
+            digest.update("\0%s\0" % (input_path,))
+            for file_path in _walk(path):
+                digest.update("%s\0" % (file_path,))
+                try:
+                    file = open(file_path, "rb")
+                    try:
+                        data = file.read(65536)
+                        while data:
+                            digest.update(data)
+                            data = file.read(65536)
+                    finally:
+                        file.close()
+                except IOError, e:
+                    raise GraphError("Can't read input %s of node %s: %s" %
+                                     (file_path, name, e.strerror))
+        return digest.hexdigest()
+
+
+def _walk(path):
+    """Generate the paths of all files in C{path}, in a stable order."""
+    if os.path.isfile(path):
+        yield path
+    elif os.path.isdir(path):
+        for directory, subdirectories, filenames in os.walk(path):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                yield os.path.join(directory, filename)
+
+
+def load_graph(path):
+    """Load a L{CommandGraph} from the JSON file at C{path}.
+
+    @raise GraphError: Raised if the file can't be read or parsed or the
+        graph is malformed.
+    """
+    try:
+        file = open(path, "r")
+    except IOError, e:
+        raise GraphError("Can't read %s: %s" % (path, e.strerror))
+    try:
+        try:
+            data = json.load(file)
+        except ValueError, e:
+            raise GraphError("Can't parse %s: %s" % (path, e))
+    finally:
+        file.close()
+    if not isinstance(data, list):
+        raise GraphError("%s must contain a list of nodes." % (path,))
+    graph = CommandGraph(os.path.dirname(os.path.abspath(path)))
+    for item in data:
+        try:
+            node = GraphNode(item["name"], item["command"],
+                             item.get("requires"), item.get("inputs"))
+        except (KeyError, TypeError, AttributeError):
+            raise GraphError(
+                "Each node in %s must have a name and a command." % (path,))
+        graph.add_node(node)
+    graph.validate()
+    return graph
+
+
+class GraphState(object):
+    """Durations and fingerprints recorded by previous runs of a graph.
+
+    @ivar path: The path to the file the state is stored in, or C{None} if
+        the state isn't persistent.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._durations = {}
+        self._fingerprints = {}
+
+    def load(self):
+        """Load the state from L{path}, if it exists."""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        file = open(self.path, "r")
+        try:
+            try:
+                data = json.load(file)
+            except ValueError:
+                # A corrupt state file only costs a full run.
+                return
+        finally:
+            file.close()
+        self._durations = data.get("durations", {})
+        self._fingerprints = data.get("fingerprints", {})
+
+    def save(self):
+        """Write the state to L{path}."""
+        if self.path is None:
+            return
+        temporary_path = "%s.tmp" % (self.path,)
+        file = open(temporary_path, "w")
+        try:
+            json.dump({"durations": self._durations,
+                       "fingerprints": self._fingerprints}, file)
+        finally:
+            file.close()
+        os.rename(temporary_path, self.path)
+
+    def get_durations(self):
+        """Get a C{dict} mapping node names to their last recorded duration."""
+        return dict(self._durations)
+
+    def is_unchanged(self, name, fingerprint):
+        """
+        Return C{True} if C{fingerprint} matches the one recorded the last
+        time the node called C{name} succeeded.
+        """
+        return (fingerprint is not None and
+                self._fingerprints.get(name) == fingerprint)
+
+    def record_success(self, name, duration, fingerprint):
+        """Record a successful run of the node called C{name}."""
+        self._durations[name] = duration
+        if fingerprint is None:
+            self._fingerprints.pop(name, None)
+        else:
+            self._fingerprints[name] = fingerprint
+
+    def record_failure(self, name):
+        """Record a failed run of the node called C{name}."""
+        self._fingerprints.pop(name, None)
+
+
+class GraphRunner(object):
+    """Run the nodes in a L{CommandGraph} in parallel child processes.
+
+    Nodes are started as soon as all of their requirements have succeeded,
+    with at most C{jobs} nodes running at once.  When more nodes are ready
+    than there are free jobs, the nodes at the head of the longest critical
+    path, based on durations recorded by previous runs, are started first.
+    Nodes with inputs that haven't changed since their last successful run
+    are skipped, as long as none of their requirements had to be run.
+
+    If an L{OutputMultiplexer} is provided, the output of each node is
+    collected through it.  Otherwise nodes write straight to the inherited
+    standard output and standard error.
+    """
+
+    def __init__(self, controller, graph, state, jobs=1, force=False,
+                 outf=None, multiplexer=None):
+        self.controller = controller
+        self.graph = graph
+        self.state = state
+        self.jobs = max(1, jobs)
+        self.force = force
+        self.outf = outf
+        self.multiplexer = multiplexer
+        self._pump = OutputPump()
+
+    def _report(self, message):
+        """Write a progress C{message} to L{outf}."""
+        if self.outf is not None:
+            print >>self.outf, message
+            self.outf.flush()
+
+    def start_node(self, node):
+        """Start running C{node} and return the child's process ID."""
+        if self.multiplexer is None:
+            return fork_command(self.controller, node.argv)
+        read_fd, write_fd = os.pipe()
+        try:
+            pid = fork_command(self.controller, node.argv, stdout=write_fd,
+                               stderr=write_fd)
+        finally:
+            os.close(write_fd)
+        self._pump.add(pid, read_fd, self.multiplexer.open(node.name))
+        return pid
+
+    def wait_for_node(self):
+        """
+        Wait for a node started by L{start_node} to finish and return a
+        C{(pid, exit_status)} tuple.
+        """
+        if self.multiplexer is None:
+            return wait_for_child()
+        return self._pump.wait()
+
+    def run(self):
+        """Run the graph.
+
+        @return: A C{dict} mapping node names to one of L{SUCCEEDED},
+            L{FAILED}, L{SKIPPED} or L{CANCELLED}.
+        """
+        priorities = self.graph.get_priorities(self.state.get_durations())
+        pending = self.graph.get_node_names()
+        results = {}
+        running = {}
+        fingerprints = {}
+        while pending or running:
+            ready = self._update_pending(pending, results, fingerprints)
+            ready.sort(key=lambda name: (-priorities[name], name))
+            for name in ready:
+                if len(running) >= self.jobs:
+                    break
+                node = self.graph.get_node(name)
+                self._report("Running %s" % (name,))
+                pid = self.start_node(node)
+                running[pid] = (name, fingerprints[name], time.time())
+                pending.remove(name)
+            if not running:
+                break
+            pid, exit_status = self.wait_for_node()
+            if pid not in running:
+                continue
+            name, fingerprint, start_time = running.pop(pid)
+            if exit_status == 0:
+                results[name] = SUCCEEDED
+                self.state.record_success(name, time.time() - start_time,
+                                          fingerprint)
+            else:
+                results[name] = FAILED
+                self.state.record_failure(name)
+                self._report("%s failed with exit status %d" %
+                             (name, exit_status))
+        self.state.save()
+        return results
+
+    def _update_pending(self, pending, results, fingerprints):
+        """Skip and cancel nodes in C{pending} where possible.
+
+        The fingerprint of each node is computed once its requirements have
+        finished and is kept in C{fingerprints}, so it's computed only once
+        per run.  A node whose inputs can't be read fails.
+
+        @return: The names of the nodes that need to run and are ready to.
+        """
+        while True:
+            ready = []
+            changed = False
+            for name in sorted(pending):
+                node = self.graph.get_node(name)
+                states = [results.get(required) for required in node.requires]
+                if FAILED in states or CANCELLED in states:
+                    results[name] = CANCELLED
+                    self._report("Cancelled %s" % (name,))
+                elif None in states:
+                    continue
+                else:
+                    try:
+                        if name not in fingerprints:
+                            fingerprints[name] = self.graph.get_fingerprint(
+                                name)
+                    except GraphError, e:
+                        results[name] = FAILED
+                        self.state.record_failure(name)
+                        self._report(str(e))
+                    else:
+                        if (self.force or SUCCEEDED in states or
+                            not self.state.is_unchanged(name,
+                                                        fingerprints[name])):
+                            ready.append(name)
+                            continue
+                        results[name] = SKIPPED
+                        self._report("Skipped %s, inputs are unchanged" %
+                                     (name,))
+                pending.remove(name)
+                changed = True
+            if not changed:
+                return ready
@@ -17,7 +17,29 @@
 
 """Infrastructure for building L{HelpTopic} components."""
 
+from cStringIO import StringIO
 from inspect import getdoc
+import json
+import os
+
+from commandant.formatting import print_columns
+
+
+CHUNK_SIZE = 64 * 1024
+
+JSONL = "jsonl"
+TSV = "tsv"
+LISTING_FORMATS = (JSONL, TSV)
+LISTING_BATCH_SIZE = 64
+
+
+def get_help_cache(help_topic):
+    """
+    Get the L{LRUCache} for help text used by the controller of
+    C{help_topic}, or C{None} if it doesn't have one.
+    """
+    controller = getattr(help_topic, "controller", None)
+    return getattr(controller, "help_cache", None)
 
 
 class HelpTopic(object):
@@ -33,9 +55,96 @@ class HelpTopic(object):
         """Get topic content."""
         raise NotImplementedError("Must be implemented by sub-class.")
 
+    def iter_text(self):
+        """Get topic content, stripped of surrounding whitespace, in chunks.
+
+        The default implementation yields the result of L{get_text}.
+        Sub-classes can override it to avoid loading all content at once.
+        """
+        yield self.get_text().strip()
+
+
+class ListingHelpTopic(HelpTopic):
+    """A help topic that lists entries from its controller's L{HelpIndex}.
+
+    Entries are listed in aligned columns by default.  In the L{JSONL} and
+    L{TSV} formats each entry is written as a record with its name,
+    summary, kind, hidden flag and path, and records are produced as
+    summaries are loaded, without measuring every row first.  TSV records
+    have those fields in that order.
+
+    @ivar prefix: Optionally, a prefix that listed names must start with.
+    @ivar offset: The number of matching entries to skip.
+    @ivar limit: Optionally, the maximum number of entries to list.
+    @ivar format: Optionally, one of L{LISTING_FORMATS}.
+    """
+
+    prefix = None
+    offset = 0
+    limit = None
+    format = None
+
+    def get_entries(self):
+        """Get the L{IndexEntry}s to list, filtered by L{prefix}, L{offset}
+        and L{limit}.
+        """
+        raise NotImplementedError("Must be implemented by sub-class.")
+
+    def get_text(self):
+        """Get topic content."""
+        if self.format is not None:
+            return "".join(self.iter_text())
+        stream = StringIO()
+        entries = self.get_entries()
+        self.controller.load_summaries(entries)
+        print_columns(stream, [(entry.name, entry.summary)
+                               for entry in entries])
+        return stream.getvalue()
+
+    def iter_text(self):
+        """Get topic content in chunks.
+
+        Records are yielded one at a time, after loading summaries for
+        L{LISTING_BATCH_SIZE} entries at once.
+        """
+        if self.format is None:
+            yield self.get_text().strip()
+            return
+        if self.format == JSONL:
+            format_entry = self._format_json
+        elif self.format == TSV:
+            format_entry = self._format_tsv
+        else:
+            raise ValueError("Unknown listing format %s." % (self.format,))
+        entries = self.get_entries()
+        for start in range(0, len(entries), LISTING_BATCH_SIZE):
+            batch = entries[start:start + LISTING_BATCH_SIZE]
+            self.controller.load_summaries(batch)
+            for entry in batch:
+                if entry is not entries[0]:
+                    yield "\n"
+                yield format_entry(entry)
+
+    def _format_json(self, entry):
+        """Format C{entry} as a JSON object."""
+        return json.dumps({"name": entry.name, "summary": entry.summary,
+                           "kind": entry.kind, "hidden": entry.hidden,
+                           "path": entry.path}, sort_keys=True)
+
+    def _format_tsv(self, entry):
+        """Format C{entry} as tab-separated fields."""
+        fields = [entry.name, entry.summary, entry.kind,
+                  entry.hidden and "true" or "false", entry.path or ""]
+        return "\t".join(field.replace("\t", " ").replace("\n", " ")
+                         for field in fields)
+
 
 class DocstringHelpTopic(object):
-    """A help topic that loads content from its docstring."""
+    """A help topic that loads content from its docstring.
+
+    Text is kept in the controller's help cache, if it has one, and
+    otherwise by the help topic instance.
+    """
 
     def __init__(self):
         super(DocstringHelpTopic, self).__init__()
@@ -59,21 +168,47 @@ class DocstringHelpTopic(object):
         lines = [line for line in docstring.splitlines()]
         return lines[0], "\n".join(lines[1:]).strip()
 
+    def _load_summary(self):
+        """Load the summary without loading the rest of the text content."""
+        docstring = self._get_docstring()
+        if not docstring:
+            return ""
+        return docstring.splitlines()[0]
+
     def get_summary(self):
         """Get a short topic summary for use in a topic listing."""
         if self._summary is None:
-            (self._summary, self._text) = self._load_help_text()
+            self._summary = self._load_summary()
         return self._summary
 
     def get_text(self):
         """Get topic content."""
-        if self._text is None:
-            (self._summary, self._text) = self._load_help_text()
-        return self._text
+        cache = get_help_cache(self)
+        if cache is None:
+            if self._text is None:
+                (self._summary, self._text) = self._load_help_text()
+            return self._text
+        key = self._get_cache_key()
+        text = cache.get(key)
+        if text is None:
+            (summary, text) = self._load_help_text()
+            if self._summary is None:
+                self._summary = summary
+            cache.set(key, text)
+        return text
+
+    def _get_cache_key(self):
+        """Get the key for this help topic's text in the help cache."""
+        return ("docstring", self.__class__)
 
 
 class FileHelpTopic(HelpTopic):
-    """A help topic that loads content from a file."""
+    """A help topic that loads content from a file.
+
+    Text is kept in the controller's help cache, if it has one, keyed by
+    the file's path, modification time and size, so changes to the file are
+    picked up.  Otherwise it's kept by the help topic instance.
+    """
 
     path = None
 
@@ -82,37 +217,152 @@ class FileHelpTopic(HelpTopic):
         self._summary = None
         self._text = None
 
-    def _load(self):
-        """Load and cache summary and text content."""
+    def _load_summary(self):
+        """Load the summary from the first line of the file."""
+        file = open(self.path, "r")
+        try:
+            return file.readline().strip()
+        finally:
+            file.close()
+
+    def _load_text(self):
+        """Load the text content following the summary line."""
         file = open(self.path, "r")
-        self._summary = file.readline().strip()
-        self._text = file.read().strip()
-        # FIXME Test this.
-        file.close()
+        try:
+            file.readline()
+            return file.read().strip()
+        finally:
+            file.close()
 
     def get_summary(self):
-        """Get a short topic summary for use in a topic listing."""
+        """Get a short topic summary for use in a topic listing.
+
+        Only the first line of the file is read.
+        """
         if self._summary is None:
-            self._load()
+            self._summary = self._load_summary()
         return self._summary
 
     def get_text(self):
         """Get topic content."""
-        if self._text is None:
-            self._load()
-        return self._text
+        cache = get_help_cache(self)
+        if cache is None:
+            if self._text is None:
+                self._text = self._load_text()
+            return self._text
+        key = self._get_cache_key()
+        text = cache.get(key)
+        if text is None:
+            text = self._load_text()
+            cache.set(key, text)
+        return text
+
+    def _get_cache_key(self):
+        """Get the key for this help topic's text in the help cache."""
+        stat = os.stat(self.path)
+        return ("file", self.path, stat.st_mtime, stat.st_size)
+
+    def iter_text(self, chunk_size=CHUNK_SIZE):
+        """Get topic content, stripped of surrounding whitespace, in chunks.
+
+        The file is read C{chunk_size} bytes at a time, so content is
+        available before the whole file has been read.  Trailing whitespace
+        is held back until more content follows it.  Text that fits in the
+        help cache is added to it once the whole file has been read.
+        """
+        cache = get_help_cache(self)
+        if cache is None:
+            if self._text is not None:
+                yield self._text
+            else:
+                for chunk in self._iter_file(chunk_size):
+                    yield chunk
+            return
+        key = self._get_cache_key()
+        text = cache.get(key)
+        if text is not None:
+            yield text
+            return
+        chunks = []
+        size = 0
+        for chunk in self._iter_file(chunk_size):
+            if chunks is not None:
+                size += len(chunk)
+                if size > cache.budget:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            cache.set(key, "".join(chunks))
+
+    def _iter_file(self, chunk_size):
+        """Read the text content following the summary line in chunks."""
+        file = open(self.path, "r")
+        try:
+            file.readline()
+            started = False
+            pending = ""
+            while True:
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                if not started:
+                    chunk = chunk.lstrip()
+                    if not chunk:
+                        continue
+                    started = True
+                stripped = chunk.rstrip()
+                if stripped:
+                    yield pending + stripped
+                    pending = chunk[len(stripped):]
+                else:
+                    pending += chunk
+        finally:
+            file.close()
 
 
 class CommandHelpTopic(DocstringHelpTopic):
     """
     A help topic that loads content from a C{bzrlib.commands.Command}
     docstring.
+
+    Summaries are cached per command class and help text is kept in the
+    controller's help cache per command class, command name and program
+    name, so the cost of generating them is only paid once, no matter how
+    many topics are created.
     """
 
+    _summary_cache = {}
+
     def __init__(self, command):
         super(CommandHelpTopic, self).__init__()
         self.command = command
 
+    @classmethod
+    def clear_cache(cls):
+        """Forget all cached summaries."""
+        cls._summary_cache.clear()
+
+    def get_summary(self):
+        """Get a short topic summary for use in a topic listing.
+
+        Full help text isn't generated to get the summary.
+        """
+        if self._summary is None:
+            key = self.command.__class__
+            summary = self._summary_cache.get(key)
+            if summary is None:
+                summary = self._load_summary()
+                self._summary_cache[key] = summary
+            self._summary = summary
+        return self._summary
+
+    def _get_cache_key(self):
+        """Get the key for the command's help text in the help cache."""
+        return ("command", self.command.__class__, self.command.name(),
+                self.controller.program_name)
+
     def _get_docstring(self):
         """Get the docstring for the command."""
         return getdoc(self.command)
@@ -0,0 +1,320 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure for indexing command and help topic metadata."""
+
+from bisect import bisect_left
+
+
+COMMAND = "command"
+EXECUTABLE = "executable"
+TOPIC = "topic"
+
+
+class IndexEntry(object):
+    """Metadata about a command or help topic in a L{HelpIndex}.
+
+    @ivar name: The name of the command or help topic.
+    @ivar kind: One of L{COMMAND}, L{EXECUTABLE} or L{TOPIC}.
+    @ivar hidden: C{True} if the command is hidden.
+    @ivar path: The path to the file the command or help topic was loaded
+        from, or C{None} if it isn't known.
+    @ivar summary: The summary shown in listings, or C{None} if it hasn't
+        been loaded yet.
+    @ivar options: A sorted C{list} of option names a Python command
+        accepts, such as C{--help} and C{-h}.
+    @ivar value_options: The subset of L{options} that take a value.
+    @ivar arguments: Placeholders for the arguments a Python command
+        accepts, such as C{[TOPIC]}.
+    @ivar aliases: The aliases a Python command declares.
+    """
+
+    def __init__(self, name, kind, hidden=False, path=None, summary=None,
+                 options=None, value_options=None, arguments=None,
+                 aliases=None):
+        self.name = name
+        self.kind = kind
+        self.hidden = hidden
+        self.path = path
+        self.summary = summary
+        self.options = options or []
+        self.value_options = value_options or []
+        self.arguments = arguments or []
+        self.aliases = aliases or []
+
+
+class HelpIndex(object):
+    """A sorted index of L{IndexEntry}s for commands and help topics.
+
+    Sorted lists of entries are built on demand and kept until the index is
+    changed, so listings don't need to sort the registry every time.
+    Prefix, offset and limit filters use a binary search over the sorted
+    names, so their cost is proportional to the number of entries returned
+    rather than to the size of the index.
+    """
+
+    def __init__(self):
+        self._commands = {}
+        self._topics = {}
+        self._sorted = {}
+        self._trie = None
+
+    def set_command(self, entry):
+        """Add or replace the L{IndexEntry} for a command."""
+        self._commands[entry.name] = entry
+        self._sorted.clear()
+        self._trie = None
+
+    def set_topic(self, entry):
+        """Add or replace the L{IndexEntry} for a help topic."""
+        self._topics[entry.name] = entry
+        self._sorted.clear()
+
+    def remove(self, name):
+        """Remove the command and help topic entries for C{name}."""
+        command = self._commands.pop(name, None)
+        topic = self._topics.pop(name, None)
+        if command is not None or topic is not None:
+            self._sorted.clear()
+            self._trie = None
+
+    def get_command(self, name):
+        """Get the L{IndexEntry} for the command called C{name}, or C{None}."""
+        return self._commands.get(name)
+
+    def get_topic(self, name):
+        """
+        Get the L{IndexEntry} for the help topic called C{name}, or C{None}.
+        """
+        return self._topics.get(name)
+
+    def get_commands(self, prefix=None, offset=0, limit=None, hidden=None):
+        """Get command L{IndexEntry}s sorted by name.
+
+        @param prefix: Optionally, a prefix that names must start with.
+        @param offset: The number of matching entries to skip.
+        @param limit: Optionally, the maximum number of entries to return.
+        @param hidden: Optionally, C{True} to only return hidden commands or
+            C{False} to only return visible ones.  All commands are returned
+            by default.
+        """
+        key = ("commands", hidden)
+        if key not in self._sorted:
+            entries = [entry for entry in self._commands.itervalues()
+                       if hidden is None or entry.hidden == hidden]
+            self._sorted[key] = self._sort(entries)
+        return self._select(self._sorted[key], prefix, offset, limit)
+
+    def get_topics(self, prefix=None, offset=0, limit=None):
+        """Get help topic L{IndexEntry}s sorted by name.
+
+        @param prefix: Optionally, a prefix that names must start with.
+        @param offset: The number of matching entries to skip.
+        @param limit: Optionally, the maximum number of entries to return.
+        """
+        key = ("topics", None)
+        if key not in self._sorted:
+            self._sorted[key] = self._sort(self._topics.values())
+        return self._select(self._sorted[key], prefix, offset, limit)
+
+    def get_command_trie(self):
+        """
+        Get a L{PrefixTrie} of visible command names, built the first time
+        it's needed after the index changes.
+        """
+        if self._trie is None:
+            self._trie = PrefixTrie(
+                entry.name for entry in self._commands.itervalues()
+                if not entry.hidden)
+        return self._trie
+
+    def _sort(self, entries):
+        """Get C{entries} sorted by name and a matching C{list} of names."""
+        entries.sort(key=lambda entry: entry.name)
+        return (entries, [entry.name for entry in entries])
+
+    def _select(self, sorted_entries, prefix, offset, limit):
+        """Get a slice of C{sorted_entries} matching the filters."""
+        (entries, names) = sorted_entries
+        start = offset
+        if prefix:
+            start += bisect_left(names, prefix)
+        end = len(entries)
+        if limit is not None:
+            end = min(end, start + limit)
+        if not prefix:
+            return entries[start:end]
+        result = []
+        for i in xrange(start, end):
+            if not names[i].startswith(prefix):
+                break
+            result.append(entries[i])
+        return result
+
+
+class PrefixTrie(object):
+    """A trie of names that resolves unambiguous prefixes.
+
+    Each node is a C{[count, name, is_name, children]} list, where C{count}
+    is the number of names starting with the node's prefix, C{name} is one
+    of them, C{is_name} is C{True} if the prefix is a name itself and
+    C{children} maps the next character to a child node.  A prefix of a
+    single name resolves to it without visiting the rest of the trie.  Nodes
+    are made of lists and dicts so the trie can be serialized as JSON.
+    """
+
+    def __init__(self, names=()):
+        self._root = [0, None, False, {}]
+        for name in names:
+            self.add(name)
+
+    @classmethod
+    def from_data(cls, data):
+        """Create a L{PrefixTrie} from the value returned by L{to_data}."""
+        trie = cls()
+        trie._root = data
+        return trie
+
+    def to_data(self):
+        """Get the trie as a structure of lists and dicts."""
+        return self._root
+
+    def add(self, name):
+        """Add C{name} to the trie."""
+        nodes = [self._root]
+        for character in name:
+            children = nodes[-1][3]
+            if character not in children:
+                children[character] = [0, None, False, {}]
+            nodes.append(children[character])
+        if nodes[-1][2]:
+            return
+        nodes[-1][2] = True
+        for node in nodes:
+            node[0] += 1
+            if node[1] is None:
+                node[1] = name
+
+    def resolve(self, prefix):
+        """Get the names C{prefix} could be an abbreviation of.
+
+        @return: A C{list} with C{prefix} itself if it's a name, a C{list}
+            with the single name starting with C{prefix} if there's only one,
+            and otherwise a sorted C{list} of every name starting with
+            C{prefix}, which is empty if there aren't any.
+        """
+        node = self._root
+        for character in prefix:
+            node = node[3].get(character)
+            if node is None:
+                return []
+        if node[2]:
+            return [prefix]
+        if node[0] == 1:
+            return [node[1]]
+        names = []
+        pending = [(prefix, node)]
+        while pending:
+            (name, node) = pending.pop()
+            if node[2]:
+                names.append(name)
+            for character, child in node[3].iteritems():
+                pending.append((name + character, child))
+        return sorted(names)
+
+
+def get_edit_distance(first, second):
+    """
+    Get the Levenshtein distance between C{first} and C{second}: the number
+    of characters that must be inserted, deleted or substituted to turn one
+    into the other.
+    """
+    if len(first) < len(second):
+        (first, second) = (second, first)
+    previous = range(len(second) + 1)
+    for i, first_character in enumerate(first):
+        current = [i + 1]
+        for j, second_character in enumerate(second):
+            current.append(min(previous[j + 1] + 1, current[j] + 1,
+                               previous[j] + (first_character !=
+                                              second_character)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree(object):
+    """A Burkhard-Keller tree of names for finding similar names quickly.
+
+    Each node is a C{[name, children]} list, where C{children} maps the
+    edit distance between a child's name and C{name} to the child node.
+    Because edit distance is a metric, a search only visits children whose
+    distance is within the search radius of the distance to the node's
+    name, rather than comparing every name.  Distances are stored as string
+    keys so the tree can be serialized as JSON.
+    """
+
+    def __init__(self, names=()):
+        self._root = None
+        for name in names:
+            self.add(name)
+
+    @classmethod
+    def from_data(cls, data):
+        """Create a L{BKTree} from the value returned by L{to_data}."""
+        tree = cls()
+        tree._root = data
+        return tree
+
+    def to_data(self):
+        """Get the tree as a structure of lists and dicts."""
+        return self._root
+
+    def add(self, name):
+        """Add C{name} to the tree."""
+        if self._root is None:
+            self._root = [name, {}]
+            return
+        node = self._root
+        while True:
+            distance = get_edit_distance(name, node[0])
+            if distance == 0:
+                return
+            key = str(distance)
+            if key not in node[1]:
+                node[1][key] = [name, {}]
+                return
+            node = node[1][key]
+
+    def search(self, name, max_distance):
+        """Find names within C{max_distance} edits of C{name}.
+
+        @return: A C{list} of C{(distance, name)} tuples, closest first.
+        """
+        matches = []
+        if self._root is None:
+            return matches
+        pending = [self._root]
+        while pending:
+            node = pending.pop()
+            distance = get_edit_distance(name, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[0]))
+            for key, child in node[1].iteritems():
+                if abs(int(key) - distance) <= max_distance:
+                    pending.append(child)
+        matches.sort()
+        return matches
@@ -0,0 +1,364 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure for a persistent queue of commands to run later."""
+
+import errno
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+
+from commandant.process import fork_command, wait_for_child
+
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS job (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        argv TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 1,
+        exit_status INTEGER,
+        output BLOB,
+        created REAL NOT NULL,
+        finished REAL,
+        claimed REAL,
+        worker_host TEXT,
+        worker_pid INTEGER)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS job_state_priority
+        ON job (state, priority, id)
+    """]
+
+# Columns added after the job table was first created, which are added to
+# existing databases when they're opened.
+CLAIM_COLUMNS = [("claimed", "REAL"), ("worker_host", "TEXT"),
+                 ("worker_pid", "INTEGER")]
+
+JOB_COLUMNS = ("id, argv, priority, state, attempts, max_attempts, "
+               "exit_status, output, created, finished, claimed, "
+               "worker_host, worker_pid")
+
+
+def get_default_queue_path(program_name):
+    """Get the path of the queue database for C{program_name}.
+
+    The C{COMMANDANT_QUEUE} environment variable, if it's set, overrides the
+    default path, C{~/.<program_name>/queue.db}.
+    """
+    path = os.environ.get("COMMANDANT_QUEUE")
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".%s" % (program_name,),
+                            "queue.db")
+    return path
+
+
+def is_process_alive(pid):
+    """Return C{True} if a process with C{pid} exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        # The process exists if it just can't be signalled by this user.
+        return e.errno == errno.EPERM
+    return True
+
+
+class Job(object):
+    """A command in a L{JobQueue}.
+
+    @ivar claimed: The time the job was last claimed, or C{None}.
+    @ivar worker_host: The name of the host of the worker that last claimed
+        the job, or C{None}.
+    @ivar worker_pid: The process ID of the worker that last claimed the
+        job, or C{None}.
+    """
+
+    def __init__(self, id, argv, priority, state, attempts, max_attempts,
+                 exit_status, output, created, finished, claimed=None,
+                 worker_host=None, worker_pid=None):
+        self.id = id
+        self.argv = argv
+        self.priority = priority
+        self.state = state
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.exit_status = exit_status
+        self.output = output
+        self.created = created
+        self.finished = finished
+        self.claimed = claimed
+        self.worker_host = worker_host
+        self.worker_pid = worker_pid
+
+    @classmethod
+    def from_row(cls, row):
+        """Create a L{Job} from a database row."""
+        row = list(row)
+        row[1] = json.loads(row[1])
+        if row[7] is not None:
+            row[7] = str(row[7])
+        return cls(*row)
+
+
+class JobQueue(object):
+    """A queue of commands stored in a SQLite database.
+
+    The database can be shared by any number of processes adding jobs and
+    running them.  Jobs are claimed inside an exclusive transaction, so each
+    one is only run by a single worker at a time.  Each claim records the
+    time, host and process ID of the worker, so jobs abandoned by a worker
+    that died, or whose claim has expired, can be claimed again.
+
+    @ivar claim_timeout: Optionally, the number of seconds after which a
+        running job is considered abandoned, even if its worker is alive.
+    """
+
+    def __init__(self, path, claim_timeout=None):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._connection = sqlite3.connect(path, timeout=30,
+                                           isolation_level=None)
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+        columns = set(row[1] for row in
+                      self._connection.execute("PRAGMA table_info(job)"))
+        for name, type in CLAIM_COLUMNS:
+            if name not in columns:
+                self._connection.execute(
+                    "ALTER TABLE job ADD COLUMN %s %s" % (name, type))
+
+    def close(self):
+        """Close the database connection."""
+        self._connection.close()
+
+    def add(self, argv, priority=0, retries=0):
+        """Add a command to the queue.
+
+        @param argv: The command-line arguments for the command to run.
+        @param priority: Jobs with a higher priority are run first.
+        @param retries: The number of times to retry the command if it fails.
+        @return: The ID of the new job.
+        """
+        cursor = self._connection.execute(
+            "INSERT INTO job (argv, priority, state, max_attempts, created) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (json.dumps(list(argv)), priority, PENDING, retries + 1,
+             time.time()))
+        return cursor.lastrowid
+
+    def get_job(self, job_id):
+        """Get the L{Job} with C{job_id}, or C{None} if it doesn't exist."""
+        row = self._connection.execute(
+            "SELECT %s FROM job WHERE id = ?" % (JOB_COLUMNS,),
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        return Job.from_row(row)
+
+    def get_jobs(self, state=None):
+        """Get a list of L{Job}s, optionally limited to those in C{state}."""
+        if state is None:
+            rows = self._connection.execute(
+                "SELECT %s FROM job ORDER BY id" % (JOB_COLUMNS,))
+        else:
+            rows = self._connection.execute(
+                "SELECT %s FROM job WHERE state = ? ORDER BY id"
+                % (JOB_COLUMNS,), (state,))
+        return [Job.from_row(row) for row in rows]
+
+    def claim(self):
+        """Claim the pending job with the highest priority.
+
+        Running jobs that have been abandoned are returned to the queue
+        first, or marked as failed if they've used up their retry limit.
+        A job is abandoned if its worker ran on this host and has exited,
+        or if it was claimed more than L{claim_timeout} seconds ago.
+
+        @return: The claimed L{Job}, or C{None} if there aren't any pending
+            jobs.
+        """
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._reclaim_abandoned_jobs(now)
+            row = self._connection.execute(
+                "SELECT %s FROM job WHERE state = ? "
+                "ORDER BY priority DESC, id LIMIT 1" % (JOB_COLUMNS,),
+                (PENDING,)).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE job SET state = ?, attempts = attempts + 1, "
+                    "claimed = ?, worker_host = ?, worker_pid = ? "
+                    "WHERE id = ?",
+                    (RUNNING, now, socket.gethostname(), os.getpid(),
+                     row[0]))
+        except:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        return self.get_job(row[0])
+
+    def _reclaim_abandoned_jobs(self, now):
+        """Put running jobs whose worker has gone back in the queue.
+
+        Each abandoned job counts as a failed attempt, so jobs that have
+        used up their retry limit are marked as failed instead.
+        """
+        host = socket.gethostname()
+        rows = self._connection.execute(
+            "SELECT id, attempts, max_attempts, claimed, worker_host, "
+            "worker_pid FROM job WHERE state = ?", (RUNNING,)).fetchall()
+        for (job_id, attempts, max_attempts, claimed, worker_host,
+             worker_pid) in rows:
+            if claimed is None or worker_pid is None:
+                # Claimed before workers were recorded, so there's no way
+                # to tell if the job is still running.
+                abandoned = True
+            elif (self.claim_timeout is not None and
+                  claimed + self.claim_timeout < now):
+                abandoned = True
+            else:
+                abandoned = (worker_host == host and
+                             not is_process_alive(worker_pid))
+            if not abandoned:
+                continue
+            if attempts < max_attempts:
+                self._connection.execute(
+                    "UPDATE job SET state = ? WHERE id = ?",
+                    (PENDING, job_id))
+            else:
+                self._connection.execute(
+                    "UPDATE job SET state = ?, finished = ? WHERE id = ?",
+                    (FAILED, now, job_id))
+
+    def finish(self, job, exit_status, output):
+        """Record the result of running a claimed C{job}.
+
+        Failed jobs are returned to the queue until they've been attempted
+        as many times as their retry limit allows.  Nothing is recorded if
+        the job was reclaimed, and perhaps claimed again, after C{job} was
+        claimed.
+
+        @return: The job's new state, or C{None} if its claim was lost.
+        """
+        claim = (RUNNING, job.worker_pid, job.claimed, job.id)
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute(
+                "SELECT attempts, max_attempts FROM job "
+                "WHERE state = ? AND worker_pid = ? AND claimed = ? "
+                "AND id = ?", claim).fetchone()
+            if row is not None:
+                attempts, max_attempts = row
+                if exit_status == 0:
+                    state = SUCCEEDED
+                elif attempts < max_attempts:
+                    state = PENDING
+                else:
+                    state = FAILED
+                self._connection.execute(
+                    "UPDATE job SET state = ?, exit_status = ?, output = ?, "
+                    "finished = ? WHERE state = ? AND worker_pid = ? "
+                    "AND claimed = ? AND id = ?",
+                    (state, exit_status, sqlite3.Binary(output), time.time())
+                    + claim)
+        except:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+        if row is None:
+            return None
+        return state
+
+
+class QueueWorker(object):
+    """Run the commands in a L{JobQueue} until it's empty.
+
+    Each job is run in a child process forked from the current one, so the
+    commands and modules loaded by the controller are reused rather than
+    reloaded for every job.  Output written by a job to its standard output
+    and standard error is captured and stored with the job.
+    """
+
+    def __init__(self, controller, queue, workers=1, outf=None):
+        self.controller = controller
+        self.queue = queue
+        self.workers = max(1, workers)
+        self.outf = outf
+
+    def _report(self, message):
+        """Write a progress C{message} to L{outf}."""
+        if self.outf is not None:
+            print >>self.outf, message
+            self.outf.flush()
+
+    def start_job(self, job, output_fd):
+        """Start running C{job} and return the child's process ID."""
+        return fork_command(self.controller, job.argv, stdout=output_fd,
+                            stderr=output_fd)
+
+    def run(self):
+        """Run jobs until the queue is empty.
+
+        @return: The number of jobs that were run.
+        """
+        running = {}
+        count = 0
+        while True:
+            while len(running) < self.workers:
+                job = self.queue.claim()
+                if job is None:
+                    break
+                output_file = tempfile.TemporaryFile()
+                pid = self.start_job(job, output_file.fileno())
+                running[pid] = (job, output_file)
+                self._report("Running job %d: %s" %
+                             (job.id, " ".join(job.argv)))
+            if not running:
+                return count
+            pid, exit_status = wait_for_child()
+            if pid not in running:
+                continue
+            job, output_file = running.pop(pid)
+            output_file.seek(0)
+            output = output_file.read()
+            output_file.close()
+            state = self.queue.finish(job, exit_status, output)
+            count += 1
+            if state is None:
+                self._report("Job %d exited with status %d after its claim "
+                             "was lost, so its result was discarded" %
+                             (job.id, exit_status))
+            else:
+                self._report("Job %d exited with status %d and is %s" %
+                             (job.id, exit_status, state))
@@ -0,0 +1,311 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure to collect output from commands running concurrently.
+
+An L{OutputMultiplexer} gives each concurrently running command its own
+stream and combines them into a single output stream, in one of three
+modes:
+
+ - L{PREFIX} writes each complete line as soon as it's available, prefixed
+   with the name of the command that wrote it.
+ - L{GROUP} writes the output of each command as a contiguous block.  One
+   command's output is passed straight through while the others are
+   buffered until it completes.
+ - L{SPILL} writes the output of each command to its own file.
+
+Memory used for buffering is limited to a fixed budget.  Once it's used up,
+writers to streams that can't make progress block until it's freed.
+"""
+
+import errno
+import os
+import select
+import threading
+
+from commandant.process import wait_for_child
+
+
+PREFIX = "prefix"
+GROUP = "group"
+SPILL = "spill"
+MODES = (PREFIX, GROUP, SPILL)
+
+DEFAULT_BUDGET = 4 * 1024 * 1024
+
+
+class CommandOutput(object):
+    """A file-like stream for the output of a single command.
+
+    Streams are created by L{OutputMultiplexer.open}.
+    """
+
+    def __init__(self, multiplexer, name):
+        self.multiplexer = multiplexer
+        self.name = name
+        self.closed = False
+        self._chunks = []
+        self._size = 0
+        self._file = None
+
+    def writable(self):
+        """Return C{True} if a write won't block."""
+        return self.multiplexer._is_writable(self)
+
+    def get_writable_size(self):
+        """
+        Get the number of bytes that can be written without blocking, or
+        C{None} if there's no limit.
+        """
+        return self.multiplexer._get_writable_size(self)
+
+    def write(self, data):
+        """Write C{data}, blocking if the memory budget is used up."""
+        self.multiplexer._write(self, data)
+
+    def writelines(self, lines):
+        """Write each string in C{lines}."""
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Streams are flushed by the multiplexer, so this does nothing."""
+
+    def close(self):
+        """Mark the command's output as complete."""
+        self.multiplexer._close(self)
+
+
+class OutputMultiplexer(object):
+    """Combine the output of concurrently running commands.
+
+    @param outf: The stream to write combined output to.
+    @param mode: One of L{PREFIX}, L{GROUP} or L{SPILL}.
+    @param budget: The maximum number of bytes to buffer in memory.
+    @param spill_directory: The directory to write output files to in
+        L{SPILL} mode.
+    """
+
+    def __init__(self, outf, mode=PREFIX, budget=DEFAULT_BUDGET,
+                 spill_directory=None):
+        if mode not in MODES:
+            raise ValueError("Unknown output mode %s." % (mode,))
+        if mode == SPILL and spill_directory is None:
+            raise ValueError("Spill mode requires a spill directory.")
+        self.outf = outf
+        self.mode = mode
+        self.budget = budget
+        self.spill_directory = spill_directory
+        self._condition = threading.Condition()
+        self._buffered = 0
+        self._open = []
+        self._completed = []
+        self._live = None
+
+    def open(self, name):
+        """Create a L{CommandOutput} stream for the command called C{name}."""
+        stream = CommandOutput(self, name)
+        self._condition.acquire()
+        try:
+            if self.mode == SPILL:
+                filename = name.replace(os.sep, "_") + ".log"
+                stream._file = open(
+                    os.path.join(self.spill_directory, filename), "wb")
+            self._open.append(stream)
+            if self.mode == GROUP and self._live is None:
+                self._live = stream
+        finally:
+            self._condition.release()
+        return stream
+
+    def get_buffered_size(self):
+        """Get the number of bytes currently buffered in memory."""
+        return self._buffered
+
+    def _is_writable(self, stream):
+        """Return C{True} if writing to C{stream} won't block."""
+        if self.mode != GROUP or stream is self._live:
+            return True
+        return self._buffered < self.budget
+
+    def _get_writable_size(self, stream):
+        """
+        Get the number of bytes that can be written to C{stream} without
+        blocking, or C{None} if there's no limit.
+        """
+        if self.mode != GROUP or stream is self._live:
+            return None
+        return max(0, self.budget - self._buffered)
+
+    def _write(self, stream, data):
+        """Write C{data} to C{stream}."""
+        if not data:
+            return
+        self._condition.acquire()
+        try:
+            if stream.closed:
+                raise ValueError("I/O operation on closed stream.")
+            if self.mode == SPILL:
+                stream._file.write(data)
+            elif self.mode == PREFIX:
+                self._write_lines(stream, data)
+            else:
+                # Data is buffered as the budget allows, so the budget is
+                # never exceeded.
+                while data:
+                    while not self._is_writable(stream):
+                        self._condition.wait()
+                    size = self._get_writable_size(stream)
+                    if size is None:
+                        self.outf.write(data)
+                        break
+                    self._buffer(stream, data[:size])
+                    data = data[size:]
+        finally:
+            self._condition.release()
+
+    def _buffer(self, stream, data):
+        """Buffer C{data} for C{stream}."""
+        stream._chunks.append(data)
+        stream._size += len(data)
+        self._buffered += len(data)
+
+    def _release(self, stream):
+        """Free the data buffered for C{stream} and wake blocked writers."""
+        self._buffered -= stream._size
+        stream._chunks = []
+        stream._size = 0
+        self._condition.notifyAll()
+
+    def _write_lines(self, stream, data):
+        """Write the complete lines in C{data}, prefixed with a name.
+
+        Only the trailing partial line is buffered, and its chunks are
+        joined once the line is complete.
+        """
+        lines = data.split("\n")
+        if len(lines) > 1:
+            lines[0] = "".join(stream._chunks) + lines[0]
+            self._release(stream)
+            for line in lines[:-1]:
+                self.outf.write("%s: %s\n" % (stream.name, line))
+        if lines[-1]:
+            self._buffer(stream, lines[-1])
+            # A partial line longer than the budget is written rather than
+            # held forever.
+            if self._buffered > self.budget:
+                self.outf.write(
+                    "%s: %s\n" % (stream.name, "".join(stream._chunks)))
+                self._release(stream)
+
+    def _close(self, stream):
+        """Mark C{stream} as complete and write any output it's holding."""
+        self._condition.acquire()
+        try:
+            if stream.closed:
+                return
+            stream.closed = True
+            self._open.remove(stream)
+            if self.mode == SPILL:
+                stream._file.close()
+            elif self.mode == PREFIX:
+                if stream._chunks:
+                    self.outf.write(
+                        "%s: %s\n" % (stream.name, "".join(stream._chunks)))
+                    self._release(stream)
+            elif stream is self._live:
+                for completed in self._completed:
+                    self.outf.write("".join(completed._chunks))
+                    self._release(completed)
+                self._completed = []
+                self._live = None
+                if self._open:
+                    self._live = self._open[0]
+                    self.outf.write("".join(self._live._chunks))
+                    self._release(self._live)
+            else:
+                self._completed.append(stream)
+            self.outf.flush()
+        finally:
+            self._condition.release()
+
+
+class _Child(object):
+    """A child process writing to a pipe."""
+
+    def __init__(self, fd, stream):
+        self.fd = fd
+        self.stream = stream
+
+
+class OutputPump(object):
+    """Copy output from child processes to L{CommandOutput} streams.
+
+    Pipes are only read when their stream is writable, so a child whose
+    output can't be written yet blocks when its pipe fills up.
+    """
+
+    def __init__(self, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self._children = {}
+
+    def add(self, pid, fd, stream):
+        """Copy output read from C{fd} for child C{pid} to C{stream}."""
+        self._children[pid] = _Child(fd, stream)
+
+    def wait(self):
+        """Wait for a child to exit after all of its output is copied.
+
+        @return: A C{(pid, exit_status)} tuple.
+        """
+        if not self._children:
+            return wait_for_child()
+        while True:
+            for pid, child in self._children.items():
+                if child.fd is not None:
+                    continue
+                finished_pid, exit_status = wait_for_child(pid, block=False)
+                if finished_pid:
+                    del self._children[pid]
+                    child.stream.close()
+                    return pid, exit_status
+            children = dict((child.fd, child)
+                            for child in self._children.itervalues()
+                            if child.fd is not None and
+                            child.stream.writable())
+            try:
+                readable = select.select(children.keys(), [], [],
+                                         self.poll_interval)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                child = children[fd]
+                # Reads are limited to what the stream can take, so the
+                # pump never blocks on a write.
+                size = child.stream.get_writable_size()
+                if size is None:
+                    size = 65536
+                elif size == 0:
+                    continue
+                data = os.read(fd, min(size, 65536))
+                if data:
+                    child.stream.write(data)
+                else:
+                    os.close(fd)
+                    child.fd = None
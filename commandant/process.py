@@ -0,0 +1,121 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure to run commands in forked child processes."""
+
+import errno
+import os
+import sys
+
+from commandant.timing import start_span, stop_span
+
+
+# Spans timing running children, keyed by process ID.
+_spans = {}
+
+
+def fork_command(controller, argv, stdin=None, stdout=None, stderr=None,
+                 setup=None):
+    """Run the command in C{argv} with C{controller} in a child process.
+
+    The child is forked from the current process, so it inherits the
+    commands, help topics and modules that have already been loaded and
+    doesn't pay the cost of starting a new interpreter.
+
+    @param controller: The L{CommandController} to run the command with.
+    @param argv: The command-line arguments to pass to C{controller.run}.
+    @param stdin: Optionally, a file descriptor to use as the child's
+        standard input.
+    @param stdout: Optionally, a file descriptor to use as the child's
+        standard output.
+    @param stderr: Optionally, a file descriptor to use as the child's
+        standard error.
+    @param setup: Optionally, a callable to run in the child before the
+        command is run.
+    @return: The process ID of the child.
+    """
+    # Flush buffered output so that it isn't written twice, once by each
+    # process.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        name = " ".join(argv[:1])
+        _spans[pid] = start_span("process %s (pid %d)" % (name, pid))
+        return pid
+
+    status = 1
+    try:
+        try:
+            for fd, target in ((stdin, 0), (stdout, 1), (stderr, 2)):
+                if fd is not None:
+                    os.dup2(fd, target)
+            if setup is not None:
+                setup()
+            result = controller.run(argv)
+            if result is None:
+                status = 0
+            elif isinstance(result, int):
+                status = result
+        except StandardError, e:
+            print >>sys.stderr, str(e)
+        except SystemExit, e:
+            if isinstance(e.code, int):
+                status = e.code
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+
+def get_exit_status(status):
+    """Convert a status returned by C{os.waitpid} into an exit status.
+
+    Children killed by a signal are given the exit status a shell would
+    report for them, 128 plus the signal number.
+    """
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def wait_for_child(pid=-1, block=True):
+    """Wait for a child process to exit.
+
+    @param pid: The process ID of the child to wait for.  Defaults to any
+        child.
+    @param block: Set to C{False} to return immediately if no child has
+        exited.
+    @return: A C{(pid, exit_status)} tuple, or C{(0, None)} if C{block} is
+        C{False} and no child has exited.
+    """
+    options = 0
+    if not block:
+        options = os.WNOHANG
+    while True:
+        try:
+            pid, status = os.waitpid(pid, options)
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if pid == 0:
+            return 0, None
+        stop_span(_spans.pop(pid, None))
+        return pid, get_exit_status(status)
@@ -0,0 +1,162 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Profile the C{run} method of a single command.
+
+The C{--profile-command=PATH} global option, handled by
+L{CommandController.run}, profiles the selected command's C{run} method,
+without the cost of starting Commandant and loading commands, and writes
+the results to C{PATH}.  Results are written in C{pstats} format, unless
+the file's name starts with C{callgrind.out}, the convention C{bzr
+--lsprof-file} uses, in which case they're written in callgrind format
+for tools like KCachegrind.
+"""
+
+import cProfile
+import os
+import sys
+
+from twisted.internet.defer import Deferred
+
+from bzrlib.errors import BzrCommandError
+
+
+PROFILE_OPTION = "--profile-command"
+CALLGRIND_PREFIX = "callgrind.out"
+
+
+def extract_profile_path(argv):
+    """Remove the C{--profile-command} global option from C{argv}.
+
+    The option can be given as C{--profile-command=PATH} or
+    C{--profile-command PATH} before the name of the command.  Arguments
+    after the command name belong to the command and are left alone.
+
+    @param argv: A list of command-line arguments.
+    @raise BzrCommandError: Raised if the option is missing its path.
+    @return: A C{(path, argv)} tuple, with the path to write the profile
+        to, or C{None} if the option isn't present, and the remaining
+        arguments.
+    """
+    path = None
+    remaining = []
+    i = 0
+    while i < len(argv):
+        argument = argv[i]
+        if not argument.startswith("-") or argument == "--":
+            break
+        if argument.startswith(PROFILE_OPTION + "="):
+            path = argument[len(PROFILE_OPTION) + 1:]
+        elif argument == PROFILE_OPTION:
+            i += 1
+            if i == len(argv):
+                raise BzrCommandError(
+                    "option %s requires a path." % (PROFILE_OPTION,))
+            path = argv[i]
+        else:
+            remaining.append(argument)
+        i += 1
+    return path, remaining + list(argv[i:])
+
+
+class CommandProfiler(object):
+    """A deterministic profiler that writes its results to a file.
+
+    @ivar path: The path to write results to.
+    @ivar format: C{"callgrind"} or C{"pstats"}, depending on C{path}.
+    @ivar stream: The stream to write a warning to if the results can't be
+        written.  Defaults to C{sys.stderr}.
+    """
+
+    def __init__(self, path, stream=None):
+        self.path = path
+        self.stream = stream
+        if os.path.basename(path).startswith(CALLGRIND_PREFIX):
+            self.format = "callgrind"
+        else:
+            self.format = "pstats"
+        self._profiler = None
+
+    def start(self):
+        """Start profiling."""
+        if self.format == "callgrind":
+            # bzrlib.lsprof is only needed to write callgrind output.
+            from bzrlib.lsprof import BzrProfiler
+            self._profiler = BzrProfiler()
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        """Stop profiling and write the results to L{path}.
+
+        The command has already run by the time results are written, so a
+        warning is written to L{stream}, rather than an error being raised,
+        if they can't be.
+        """
+        profiler = self._profiler
+        self._profiler = None
+        try:
+            if self.format == "callgrind":
+                stats = profiler.stop()
+                stats.save(self.path, format="callgrind")
+            else:
+                profiler.disable()
+                profiler.dump_stats(self.path)
+        except IOError, e:
+            stream = self.stream
+            if stream is None:
+                stream = sys.stderr
+            stream.write(
+                "commandant: warning: can't write profile to %s: %s\n"
+                % (self.path, e.strerror))
+
+
+def profile_run(run, path):
+    """Wrap a command's C{run} method to profile it.
+
+    If C{run} returns a C{Deferred}, as a L{TwistedCommand}'s may, the
+    profiler keeps running until it fires, so the reactor callbacks that
+    do the command's work are profiled too.
+
+    @param run: The command's C{run} method.
+    @param path: The path to write the results to.
+    @return: A function to use in place of C{run}.
+    """
+
+    def profiled_run(*args, **kwargs):
+        profiler = CommandProfiler(path)
+        profiler.start()
+        try:
+            result = run(*args, **kwargs)
+        except:
+            profiler.stop()
+            raise
+        if isinstance(result, Deferred):
+            result.addBoth(_stop_profiler, profiler)
+        else:
+            profiler.stop()
+        return result
+
+    return profiled_run
+
+
+def _stop_profiler(result, profiler):
+    """Stop C{profiler} when the C{Deferred} returned by a command fires."""
+    profiler.stop()
+    return result
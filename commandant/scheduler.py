@@ -0,0 +1,347 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Infrastructure to run commands on a recurring schedule.
+
+Schedules are described in a crontab-like file.  Each line contains a
+schedule followed by the command line to run::
+
+  # Refresh the cache every 90 seconds.
+  @every 90s refresh-cache --quick
+  # Send a report at 6:30 every weekday.
+  30 6 * * 1-5 send-report
+
+A schedule is either C{@every} followed by an interval in seconds, minutes
+(C{m}) or hours (C{h}), one of C{@hourly} or C{@daily}, or five cron fields
+for the minute, hour, day of month, month and day of week.
+"""
+
+from datetime import datetime, timedelta
+import errno
+import os
+import random
+import shlex
+import signal
+import time
+
+from commandant.errors import ScheduleError
+from commandant.process import fork_command, wait_for_child
+
+
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600}
+SCHEDULE_ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *"}
+
+# Cron fields as (name, minimum value, maximum value) tuples.
+CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31),
+               ("month", 1, 12), ("day of week", 0, 7)]
+
+# The number of days to search for a matching time before giving up on a
+# schedule that can never fire, like "0 0 30 2 *".
+MAX_CRON_DAYS = 366 * 5
+
+
+class IntervalSchedule(object):
+    """A schedule that fires every C{interval} seconds."""
+
+    def __init__(self, interval):
+        if interval <= 0:
+            raise ScheduleError("Intervals must be greater than zero.")
+        self.interval = interval
+
+    def get_next_time(self, now):
+        """Get the first time after C{now} that the schedule fires."""
+        return now + self.interval
+
+
+class CronSchedule(object):
+    """A schedule that fires at times matching a cron expression."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != len(CRON_FIELDS):
+            raise ScheduleError(
+                "Cron schedule '%s' must have five fields." % (expression,))
+        values = [_parse_cron_field(field, name, minimum, maximum)
+                  for field, (name, minimum, maximum)
+                  in zip(fields, CRON_FIELDS)]
+        (self.minutes, self.hours, self.days, self.months,
+         self.weekdays) = values
+        # Sunday may be written as 0 or 7.
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _matches_day(self, date):
+        """Return C{True} if the day of C{date} matches the schedule."""
+        day_matches = date.day in self.days
+        weekday_matches = (date.weekday() + 1) % 7 in self.weekdays
+        # Like cron, a day matches either field when both are restricted.
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def get_next_time(self, now):
+        """Get the first time after C{now} that the schedule fires.
+
+        @raise ScheduleError: Raised if the schedule never fires.
+        """
+        current = datetime.fromtimestamp(now).replace(second=0, microsecond=0)
+        current += timedelta(minutes=1)
+        limit = current + timedelta(days=MAX_CRON_DAYS)
+        while current < limit:
+            if current.month not in self.months or not self._matches_day(
+                current):
+                current = current.replace(hour=0, minute=0)
+                current += timedelta(days=1)
+            elif current.hour not in self.hours:
+                current = current.replace(minute=0)
+                current += timedelta(hours=1)
+            elif current.minute not in self.minutes:
+                current += timedelta(minutes=1)
+            else:
+                return time.mktime(current.timetuple())
+        raise ScheduleError(
+            "Cron schedule '%s' never fires." % (self.expression,))
+
+
+def _parse_cron_field(field, name, minimum, maximum):
+    """Parse a cron C{field} into the C{set} of values it matches."""
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/", 1)
+            if not step.isdigit() or int(step) == 0:
+                raise ScheduleError("Invalid step in %s field '%s'." %
+                                    (name, field))
+            step = int(step)
+        if part == "*":
+            start, end = minimum, maximum
+        elif "-" in part:
+            start, end = part.split("-", 1)
+            if not (start.isdigit() and end.isdigit()):
+                raise ScheduleError("Invalid range in %s field '%s'." %
+                                    (name, field))
+            start, end = int(start), int(end)
+        elif part.isdigit():
+            start = end = int(part)
+        else:
+            raise ScheduleError("Invalid %s field '%s'." % (name, field))
+        if start < minimum or end > maximum or start > end:
+            raise ScheduleError("Value out of range in %s field '%s'." %
+                                (name, field))
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_schedule(text):
+    """Parse a schedule specification.
+
+    @param text: An C{@every} interval, a schedule alias or a cron
+        expression.
+    @return: An L{IntervalSchedule} or L{CronSchedule}.
+    @raise ScheduleError: Raised if C{text} can't be parsed.
+    """
+    text = SCHEDULE_ALIASES.get(text, text)
+    if text.startswith("@every "):
+        interval = text[len("@every "):].strip()
+        multiplier = 1
+        if interval[-1:] in INTERVAL_UNITS:
+            multiplier = INTERVAL_UNITS[interval[-1]]
+            interval = interval[:-1]
+        try:
+            return IntervalSchedule(float(interval) * multiplier)
+        except ValueError:
+            raise ScheduleError("Invalid interval '%s'." % (text,))
+    return CronSchedule(text)
+
+
+class ScheduleEntry(object):
+    """A command run on a schedule.
+
+    @ivar schedule: The L{IntervalSchedule} or L{CronSchedule} to run the
+        command on.
+    @ivar argv: The command-line arguments to run the command with.
+    @ivar pid: The process ID of the current run, or C{None} if the command
+        isn't running.
+    """
+
+    def __init__(self, schedule, argv):
+        self.schedule = schedule
+        self.argv = argv
+        self.pid = None
+        self.next_time = None
+        self.due_time = None
+
+
+def load_schedule(path):
+    """Load a list of L{ScheduleEntry}s from the schedule file at C{path}.
+
+    @raise ScheduleError: Raised if a line in the file can't be parsed.
+    """
+    entries = []
+    file = open(path, "r")
+    try:
+        for number, line in enumerate(file):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            words = line.split()
+            if words[0] == "@every":
+                count = 2
+            elif words[0].startswith("@"):
+                count = 1
+            else:
+                count = len(CRON_FIELDS)
+            if len(words) <= count:
+                raise ScheduleError("Line %d of %s doesn't have a command." %
+                                    (number + 1, path))
+            schedule = parse_schedule(" ".join(words[:count]))
+            argv = shlex.split(line)[count:]
+            entries.append(ScheduleEntry(schedule, argv))
+    finally:
+        file.close()
+    return entries
+
+
+class Scheduler(object):
+    """Run commands on a schedule from a long-lived controller.
+
+    Each run is forked from the scheduler's process, so the commands and
+    modules the controller has loaded are reused rather than reloaded every
+    time a command fires.  A command that is still running when it's due to
+    fire again is skipped.  Each firing is delayed by a random amount of up
+    to C{jitter} seconds, to spread out commands that are scheduled to start
+    at the same time.
+    """
+
+    def __init__(self, controller, jitter=0, outf=None, clock=time.time,
+                 sleep=time.sleep):
+        self.controller = controller
+        self.jitter = jitter
+        self.outf = outf
+        self._clock = clock
+        self._sleep = sleep
+        self._entries = []
+
+    def _report(self, message):
+        """Write a progress C{message} to L{outf}."""
+        if self.outf is not None:
+            print >>self.outf, message
+            self.outf.flush()
+
+    def add(self, entry):
+        """Add a L{ScheduleEntry} to the scheduler."""
+        self._schedule(entry, self._clock())
+        self._entries.append(entry)
+
+    def _schedule(self, entry, now):
+        """Work out when C{entry} should next fire."""
+        if entry.next_time is None:
+            entry.next_time = entry.schedule.get_next_time(now)
+        else:
+            next_time = entry.schedule.get_next_time(entry.next_time)
+            if next_time <= now:
+                # Runs missed while the scheduler was busy aren't made up.
+                next_time = entry.schedule.get_next_time(now)
+            entry.next_time = next_time
+        entry.due_time = entry.next_time + random.uniform(0, self.jitter)
+
+    def start_entry(self, entry):
+        """Start running C{entry} and return the child's process ID."""
+
+        def setup():
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        return fork_command(self.controller, entry.argv, setup=setup)
+
+    def stop_entry(self, entry):
+        """Terminate the running C{entry} and wait for it to exit."""
+        try:
+            os.kill(entry.pid, signal.SIGTERM)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+        wait_for_child(entry.pid)
+
+    def poll_entry(self, entry):
+        """
+        Get the exit status of the running C{entry} or C{None} if it hasn't
+        exited.
+        """
+        pid, exit_status = wait_for_child(entry.pid, block=False)
+        if pid == 0:
+            return None
+        return exit_status
+
+    def tick(self):
+        """Reap finished commands and start the ones that are due.
+
+        @return: The number of seconds until the next command is due.
+        """
+        now = self._clock()
+        for entry in self._entries:
+            if entry.pid is not None:
+                exit_status = self.poll_entry(entry)
+                if exit_status is not None:
+                    entry.pid = None
+                    if exit_status != 0:
+                        self._report("%s failed with exit status %d" %
+                                     (" ".join(entry.argv), exit_status))
+            if entry.due_time > now:
+                continue
+            if entry.pid is None:
+                entry.pid = self.start_entry(entry)
+            else:
+                self._report("Skipped %s, it's still running" %
+                             (" ".join(entry.argv),))
+            self._schedule(entry, now)
+        if not self._entries:
+            return None
+        return max(0, min(entry.due_time for entry in self._entries) - now)
+
+    def stop(self):
+        """Terminate the commands that are still running."""
+        for entry in self._entries:
+            if entry.pid is not None:
+                self.stop_entry(entry)
+                entry.pid = None
+
+    def run(self, poll_interval=1.0):
+        """Run scheduled commands until interrupted.
+
+        Commands that are still running are terminated when the scheduler
+        is interrupted or sent C{SIGTERM}.
+        """
+
+        def terminate(signum, frame):
+            raise SystemExit(128 + signum)
+
+        handler = signal.signal(signal.SIGTERM, terminate)
+        try:
+            while True:
+                delay = self.tick()
+                if delay is None:
+                    delay = poll_interval
+                self._sleep(min(delay, poll_interval))
+        finally:
+            try:
+                self.stop()
+            finally:
+                signal.signal(signal.SIGTERM, handler)
@@ -0,0 +1,308 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Full-text search over command and help topic documentation.
+
+A L{SearchIndex} is an inverted index mapping terms to the documents that
+contain them.  Each document is stored with a fingerprint of its source
+file, so the index can be updated incrementally: only documents whose
+source has changed since the index was last saved are read again.
+Results are ranked by tf-idf relevance.
+"""
+
+import json
+import math
+import os
+import re
+
+from commandant.help_topics import CommandHelpTopic, ListingHelpTopic
+from commandant.index import TOPIC
+
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def get_default_search_index_path(program_name):
+    """Get the path of the search index for C{program_name}.
+
+    The C{COMMANDANT_SEARCH_INDEX} environment variable, if it's set,
+    overrides the default path, C{~/.<program_name>/search-index.json}.
+    """
+    path = os.environ.get("COMMANDANT_SEARCH_INDEX")
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".%s" % (program_name,),
+                            "search-index.json")
+    return path
+
+
+def tokenize(text):
+    """Split C{text} into a C{list} of lowercase terms."""
+    return TERM_PATTERN.findall(text.lower())
+
+
+class SearchIndex(object):
+    """An inverted index of command and help topic documentation.
+
+    @ivar path: The path to the file the index is stored in, or C{None} if
+        the index isn't persistent.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._documents = {}
+        self._postings = {}
+        self._changed = False
+
+    def load(self):
+        """Load the index from L{path}, if it exists."""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        file = open(self.path, "r")
+        try:
+            try:
+                data = json.load(file)
+            except ValueError:
+                # A corrupt index only costs a rebuild.
+                return
+        finally:
+            file.close()
+        self._documents = data.get("documents", {})
+        self._postings = data.get("postings", {})
+        self._changed = False
+
+    def save(self):
+        """Write the index to L{path}, if it has changed since it was loaded.
+        """
+        if self.path is None or not self._changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_path = "%s.tmp" % (self.path,)
+        file = open(temporary_path, "w")
+        try:
+            json.dump({"documents": self._documents,
+                       "postings": self._postings}, file)
+        finally:
+            file.close()
+        os.rename(temporary_path, self.path)
+        self._changed = False
+
+    def get_names(self):
+        """Get the C{set} of document names in the index."""
+        return set(self._documents.iterkeys())
+
+    def is_unchanged(self, name, fingerprint):
+        """
+        Return C{True} if the document called C{name} was indexed with
+        C{fingerprint}.
+        """
+        document = self._documents.get(name)
+        return (fingerprint is not None and document is not None and
+                document["fingerprint"] == fingerprint)
+
+    def add(self, name, text, fingerprint=None):
+        """Add the document called C{name}, replacing any existing document.
+
+        @param name: The name of the document.
+        @param text: The text to index.
+        @param fingerprint: Optionally, a fingerprint of the document's
+            source, used by L{is_unchanged}.
+        @return: C{True} if the index changed, or C{False} if the same
+            document was already in it.
+        """
+        counts = {}
+        terms = tokenize(text)
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        if self._is_indexed(name, counts, fingerprint):
+            return False
+        self.remove(name)
+        for term, count in counts.iteritems():
+            self._postings.setdefault(term, {})[name] = count
+        self._documents[name] = {"fingerprint": fingerprint,
+                                 "length": len(terms),
+                                 "terms": sorted(counts)}
+        self._changed = True
+        return True
+
+    def _is_indexed(self, name, counts, fingerprint):
+        """
+        Return C{True} if the document called C{name} has the term
+        C{counts} and C{fingerprint}.
+        """
+        document = self._documents.get(name)
+        if (document is None or document["fingerprint"] != fingerprint or
+            document["terms"] != sorted(counts)):
+            return False
+        for term, count in counts.iteritems():
+            if self._postings[term].get(name) != count:
+                return False
+        return True
+
+    def remove(self, name):
+        """Remove the document called C{name}, if it's in the index."""
+        document = self._documents.pop(name, None)
+        if document is None:
+            return
+        for term in document["terms"]:
+            postings = self._postings[term]
+            del postings[name]
+            if not postings:
+                del self._postings[term]
+        self._changed = True
+
+    def search(self, query, limit=None):
+        """Find documents matching C{query}.
+
+        Each term in C{query} contributes its frequency in a document,
+        normalized by the document's length and weighted by how rare the
+        term is across all documents.  Documents must contain at least one
+        term to match.
+
+        @param query: The text to search for.
+        @param limit: Optionally, the maximum number of results to return.
+        @return: A C{list} of C{(name, score)} tuples, most relevant first.
+        """
+        document_count = len(self._documents)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            weight = math.log(1.0 + float(document_count) / len(postings))
+            for name, count in postings.iteritems():
+                length = self._documents[name]["length"]
+                scores[name] = (scores.get(name, 0.0) +
+                                weight * count / math.sqrt(length))
+        results = sorted(scores.iteritems(),
+                         key=lambda item: (-item[1], item[0]))
+        if limit is not None:
+            results = results[:limit]
+        return results
+
+
+def get_topic_source_path(controller, help_topic):
+    """Get the path of the file C{help_topic}'s text is read from.
+
+    Help topics defined in Python, rather than loaded from files, are
+    identified by the source file of the module they're defined in, like
+    commands.
+
+    @return: The path, or C{None} if it isn't known.
+    """
+    path = getattr(help_topic, "path", None)
+    if path is None:
+        path = controller.get_source_path(type(help_topic))
+    return path
+
+
+def get_source_paths(controller, entry):
+    """
+    Get the paths of the files a L{HelpIndex} entry's documentation is read
+    from.
+
+    A command's documentation comes from the help topic with the same name,
+    if one is registered, so that topic's file is included along with the
+    command's own.
+
+    @return: A C{list} of paths, which contains C{None} for any file that
+        isn't known.
+    """
+    paths = []
+    if entry.kind != TOPIC:
+        paths.append(entry.path)
+    help_topic = controller.get_help_topic(entry.name)
+    if help_topic is not None:
+        paths.append(get_topic_source_path(controller, help_topic))
+    elif entry.kind == TOPIC:
+        paths.append(entry.path)
+    return paths
+
+
+def get_fingerprint(controller, entry):
+    """Get a fingerprint of the sources for a L{HelpIndex} entry.
+
+    @return: A C{str} fingerprint, or C{None} if one of the entry's source
+        files isn't known, in which case it's always read again.
+    """
+    parts = [entry.kind]
+    for path in get_source_paths(controller, entry):
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        parts.append("%s:%d:%d" % (path, stat.st_mtime, stat.st_size))
+    parts.append(controller.program_name)
+    return ":".join(parts)
+
+
+def get_document_text(controller, entry):
+    """Get the text to index for a L{HelpIndex} entry."""
+    help_topic = controller.get_help_topic(entry.name)
+    if help_topic is None and entry.kind != TOPIC:
+        help_topic = CommandHelpTopic(controller.get_command(entry.name))
+        help_topic.controller = controller
+    if help_topic is None:
+        return entry.name
+    return "%s\n%s\n%s" % (entry.name, help_topic.get_summary(),
+                           help_topic.get_text())
+
+
+def is_listing(controller, entry):
+    """
+    Return C{True} if a L{HelpIndex} entry is a L{ListingHelpTopic}, like
+    C{commands}.  Listings are left out of the index because rendering
+    them loads every summary, and their text would match every name they
+    list.
+    """
+    if entry.kind != TOPIC:
+        return False
+    help_topic = controller.get_help_topic(entry.name)
+    return isinstance(help_topic, ListingHelpTopic)
+
+
+def update_search_index(controller, search_index):
+    """
+    Update C{search_index} with the commands and help topics known to
+    C{controller}.
+
+    Documents with an unchanged fingerprint aren't read again and documents
+    for names the controller no longer knows about, or for listing topics,
+    are removed.
+
+    @return: The number of documents that were added, changed or removed.
+    """
+    help_index = controller.get_help_index()
+    entries = [entry
+               for entry in help_index.get_commands() + help_index.get_topics()
+               if not is_listing(controller, entry)]
+    updated = 0
+    for entry in entries:
+        fingerprint = get_fingerprint(controller, entry)
+        if search_index.is_unchanged(entry.name, fingerprint):
+            continue
+        if search_index.add(entry.name, get_document_text(controller, entry),
+                            fingerprint):
+            updated += 1
+    names = set(entry.name for entry in entries)
+    for name in search_index.get_names() - names:
+        search_index.remove(name)
+        updated += 1
+    return updated
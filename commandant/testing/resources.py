@@ -189,6 +189,8 @@ class BzrlibHooks(object):
         Command.hooks["list_commands"]._callback_names = {}
         Command.hooks["get_command"]._callbacks = []
         Command.hooks["get_command"]._callback_names = {}
+        Command.hooks["get_missing_command"]._callbacks = []
+        Command.hooks["get_missing_command"]._callback_names = {}
 
 
 class BzrlibHooksResource(TestResource):
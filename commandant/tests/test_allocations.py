@@ -0,0 +1,228 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.allocations}."""
+
+from StringIO import StringIO
+
+from twisted.internet.defer import Deferred
+
+from testtools import TestCase
+
+from commandant import allocations
+from commandant.allocations import (
+    AllocationTracer, count_objects, format_size, get_max_rss,
+    get_source_path, trace_run)
+
+
+class FormatSizeTest(TestCase):
+    """Tests for L{format_size}."""
+
+    def test_format_size(self):
+        """Sizes are shown in the largest unit that keeps them above 1."""
+        self.assertEquals(format_size(0), "0 B")
+        self.assertEquals(format_size(1023), "1023 B")
+        self.assertEquals(format_size(1536), "1.5 KiB")
+        self.assertEquals(format_size(5 * 1024 * 1024), "5.0 MiB")
+        self.assertEquals(format_size(3 * 1024 ** 3), "3.0 GiB")
+
+    def test_format_size_signed(self):
+        """Signed sizes are prefixed with C{+} when they're positive."""
+        self.assertEquals(format_size(2048, signed=True), "+2.0 KiB")
+        self.assertEquals(format_size(-2048, signed=True), "-2.0 KiB")
+        self.assertEquals(format_size(-2048), "-2.0 KiB")
+
+
+class MemoryStatisticsTest(TestCase):
+    """Tests for L{get_max_rss} and L{count_objects}."""
+
+    def test_get_max_rss(self):
+        """The peak resident set size is positive, if it's known."""
+        max_rss = get_max_rss()
+        if max_rss is not None:
+            self.assertTrue(max_rss > 0)
+
+    def test_get_source_path(self):
+        """Compiled module paths are mapped to their source files."""
+        self.assertEquals(get_source_path("/lib/module.pyc"),
+                          "/lib/module.py")
+        self.assertEquals(get_source_path("/lib/module.pyo"),
+                          "/lib/module.py")
+        self.assertEquals(get_source_path("/lib/module.py"),
+                          "/lib/module.py")
+
+    def test_count_objects(self):
+        """Objects tracked by C{gc} are counted by type name."""
+        objects = [[] for i in range(10)]
+        self.assertTrue(count_objects()["list"] >= len(objects))
+
+
+class AllocationTracerTest(TestCase):
+    """Tests for L{AllocationTracer}."""
+
+    def test_growth(self):
+        """
+        The objects the traced code leaves behind are recorded as heap
+        growth, with their allocation site at the top of the list.
+        """
+        objects = []
+        tracer = AllocationTracer("test")
+        tracer.start()
+        objects.extend([[i] for i in range(10000)])
+        tracer.stop()
+        self.assertTrue(tracer.growth > 0)
+        self.assertTrue(0 < len(tracer.sites) <= 10)
+        site, size, count = tracer.sites[0]
+        self.assertTrue(count >= len(objects))
+
+    def test_report(self):
+        """The report names the command and lists its allocation sites."""
+        tracer = AllocationTracer("test")
+        tracer.start()
+        tracer.stop()
+        tracer.sites = [("site", 2048, 3)]
+        stream = StringIO()
+        tracer.report(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEquals(lines[0], "commandant: allocations for test:")
+        self.assertIn("heap growth", stream.getvalue())
+        self.assertTrue(lines[-1].endswith("  site"))
+
+
+class FakeTracemalloc(object):
+    """
+    A C{tracemalloc} that was started before the tracer and can't reset
+    its peak, like the one in Python 3 before 3.9.
+    """
+
+    __file__ = "/lib/tracemalloc.pyc"
+
+    def __init__(self):
+        self.memory = 1000
+        self.peak = 5000
+
+    def is_tracing(self):
+        return True
+
+    def take_snapshot(self):
+        return FakeSnapshot()
+
+    def get_traced_memory(self):
+        return self.memory, self.peak
+
+    def Filter(self, inclusive, pattern):
+        return pattern
+
+
+class FakeSnapshot(object):
+    """A C{tracemalloc} snapshot without any traces."""
+
+    def filter_traces(self, filters):
+        self.filters = filters
+        return self
+
+    def compare_to(self, snapshot, key_type):
+        return []
+
+
+class AllocationTracerWithRunningTracemallocTest(TestCase):
+    """
+    Tests for L{AllocationTracer} when C{tracemalloc} is already tracing.
+    """
+
+    def setUp(self):
+        super(AllocationTracerWithRunningTracemallocTest, self).setUp()
+        self.addCleanup(setattr, allocations, "tracemalloc",
+                        allocations.tracemalloc)
+        self.tracemalloc = FakeTracemalloc()
+        allocations.tracemalloc = self.tracemalloc
+
+    def test_peak_unknown(self):
+        """
+        The peak isn't known if tracing was already running and its peak
+        can't be reset, since it may have been reached before the command
+        started.
+        """
+        tracer = AllocationTracer("test")
+        tracer.start()
+        self.tracemalloc.memory = 3000
+        tracer.stop()
+        self.assertEquals(tracer.peak, None)
+        self.assertEquals(tracer.growth, 2000)
+        stream = StringIO()
+        tracer.report(stream)
+        self.assertIn("peak traced memory: unknown", stream.getvalue())
+
+    def test_peak_reset(self):
+        """The peak is reset when tracing is running, if it can be."""
+        self.tracemalloc.reset_peak = lambda: setattr(
+            self.tracemalloc, "peak", self.tracemalloc.memory)
+        tracer = AllocationTracer("test")
+        tracer.start()
+        self.tracemalloc.peak = 4000
+        tracer.stop()
+        self.assertEquals(tracer.peak, 3000)
+
+
+class TraceRunTest(TestCase):
+    """Tests for L{trace_run}."""
+
+    def test_trace_run(self):
+        """
+        The wrapped function's return value is passed through and a report
+        is written when it returns.
+        """
+        stream = StringIO()
+        self.assertEquals(trace_run(lambda: 45, "test", stream)(), 45)
+        self.assertTrue(stream.getvalue().startswith(
+            "commandant: allocations for test:\n"))
+
+    def test_trace_run_with_exception(self):
+        """A report is written if the wrapped function raises."""
+        stream = StringIO()
+
+        def fail():
+            raise RuntimeError("KABOOM!")
+
+        self.assertRaises(RuntimeError, trace_run(fail, "test", stream))
+        self.assertNotEquals(stream.getvalue(), "")
+
+    def test_trace_run_nested(self):
+        """
+        Functions run while another is traced in the same process are
+        included in its report rather than getting one of their own.
+        """
+        stream = StringIO()
+        inner = trace_run(lambda: None, "inner", stream)
+        trace_run(inner, "outer", stream)()
+        self.assertIn("allocations for outer", stream.getvalue())
+        self.assertNotIn("allocations for inner", stream.getvalue())
+
+    def test_trace_run_with_deferred(self):
+        """
+        If the wrapped function returns a C{Deferred}, tracing continues
+        until it fires.
+        """
+        stream = StringIO()
+        deferred = Deferred()
+        result = trace_run(lambda: deferred, "test", stream)()
+        self.assertEquals(stream.getvalue(), "")
+        results = []
+        result.addCallback(results.append)
+        deferred.callback("value")
+        self.assertEquals(results, ["value"])
+        self.assertNotEquals(stream.getvalue(), "")
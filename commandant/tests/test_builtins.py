@@ -18,22 +18,33 @@
 """Unit tests for L{commandant.builtins}."""
 
 import doctest
+import json
 import os
+from StringIO import StringIO
 from textwrap import dedent
 
 from bzrlib.commands import Command
+from bzrlib.errors import BzrCommandError
 
 from testresources import ResourcedTestCase
 from testtools.matchers import DocTestMatches
 
 from commandant import __version__
 from commandant.builtins import (
-    cmd_version, cmd_help,
+    cmd_version, cmd_help, cmd_complete, cmd_completion_script,
     topic_basic, topic_commands, topic_hidden_commands, topic_topics)
+from commandant.completion import complete_from_cache
 from commandant.testing.basic import CommandantTestCase
 from commandant.testing.resources import CommandFactoryResource
 
 
+class TerminalStringIO(StringIO):
+    """A C{StringIO} that claims to be a terminal."""
+
+    def isatty(self):
+        return True
+
+
 class VersionCommandTest(ResourcedTestCase):
     """Tests for L{cmd_version}."""
 
@@ -170,6 +181,88 @@ help     Show help about a command or topic.
 version  Show version of commandant.
 """)
 
+    def test_run_commands_with_prefix(self):
+        """
+        The C{commands} topic only lists commands with names starting with
+        the prefix passed to C{help}.
+        """
+        self.factory.create_command("version", cmd_version)
+        self.command.run(topic="commands", prefix="ver")
+        self.assertEquals(self.command.outf.getvalue(),
+                          "version  Show version of commandant.\n")
+
+    def test_run_commands_with_offset_and_limit(self):
+        """The C{commands} topic can be paged with an offset and limit."""
+        self.factory.create_command("version", cmd_version)
+        self.factory.create_command("fake-command")
+        self.command.run(topic="commands", offset=1, limit=1)
+        self.assertEquals(self.command.outf.getvalue(),
+                          "help  Show help about a command or topic.\n")
+
+    def test_run_with_filter_lists_commands(self):
+        """The C{commands} topic is shown if a filter is used without a topic.
+        """
+        self.factory.create_command("version", cmd_version)
+        self.command.run(limit=1)
+        self.assertEquals(self.command.outf.getvalue(),
+                          "help  Show help about a command or topic.\n")
+
+    def test_run_topics_with_prefix(self):
+        """The C{topics} topic can be filtered by prefix."""
+        self.command.run(topic="topics", prefix="hidden")
+        self.assertEquals(self.command.outf.getvalue(),
+                          "hidden-commands  Basic help for hidden commands.\n")
+
+    def test_run_with_filter_on_unfilterable_topic(self):
+        """An error is raised if a topic that isn't a listing is filtered."""
+        error = self.assertRaises(BzrCommandError, self.command.run,
+                                  topic="basic", prefix="a")
+        self.assertEquals(str(error), "The basic topic isn't a listing.")
+
+    def test_run_commands_with_jsonl_format(self):
+        """
+        The C{commands} topic writes a JSON object per command in the
+        C{jsonl} format.
+        """
+
+        class cmd_secret(Command):
+            """A hidden command."""
+
+            hidden = True
+
+        self.factory.create_command("secret", cmd_secret)
+        self.factory.create_command("version", cmd_version)
+        self.command.run(topic="hidden-commands", format="jsonl")
+        record = json.loads(self.command.outf.getvalue())
+        self.assertEquals(record["name"], "secret")
+        self.assertEquals(record["summary"], "A hidden command.")
+        self.assertEquals(record["kind"], "command")
+        self.assertEquals(record["hidden"], True)
+        self.command.outf = StringIO()
+        self.command.run(format="jsonl")
+        lines = self.command.outf.getvalue().splitlines()
+        self.assertEquals([json.loads(line)["name"] for line in lines],
+                          ["help", "version"])
+
+    def test_run_topics_with_tsv_format(self):
+        """The C{topics} topic writes tab-separated records in C{tsv} format.
+        """
+        self.command.run(topic="topics", format="tsv", limit=2)
+        self.assertEquals(
+            self.command.outf.getvalue(),
+            "basic\tBasic commands.\ttopic\tfalse\t\n"
+            "commands\tBasic help for all commands.\ttopic\tfalse\t\n")
+
+    def test_run_with_unknown_format(self):
+        """An error is raised if an unknown listing format is used."""
+        self.assertRaises(BzrCommandError, self.command.run,
+                          topic="commands", format="xml")
+
+    def test_run_with_negative_limit(self):
+        """An error is raised if a negative offset or limit is used."""
+        self.assertRaises(BzrCommandError, self.command.run,
+                          topic="commands", limit=-1)
+
     def test_run_commands_without_docstring(self):
         """
         A summary is not output for Python commands that don't have a
@@ -410,6 +503,36 @@ This is descriptive text.
         self.command.run(topic="test-command")
         self.assertEquals(self.command.outf.getvalue(), "")
 
+    def test_run_with_help_cache_directory(self):
+        """
+        Help rendered for Python commands is cached in the controller's help
+        cache directory and isn't rendered again while the command's source
+        file is unchanged.
+        """
+        calls = []
+
+        class cmd_test_command(Command):
+            """A test command."""
+
+            def get_help_text(self, *args, **kwargs):
+                calls.append(True)
+                return "Help text for bzr."
+
+        controller = self.factory.controller
+        controller.help_cache_directory = os.path.join(
+            self.factory.directory.path, "help-cache")
+        self.addCleanup(setattr, controller, "help_cache_directory", None)
+        self.factory.create_command("test-command", cmd_test_command)
+        self.command.run(topic="test-command")
+        controller.help_cache.clear()
+        self.command.outf = StringIO()
+        self.command.run(topic="test-command")
+        self.assertEquals(self.command.outf.getvalue(),
+                          "Help text for commandant.\n")
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(
+            len(os.listdir(controller.help_cache_directory)), 1)
+
     def test_run_with_unknown_command_or_topic_name(self):
         """
         Running the C{help} command with an unknown topic results in an error
@@ -419,6 +542,95 @@ This is descriptive text.
         self.assertEquals(self.command.outf.getvalue(),
                           "test-command is an unknown command or topic.\n")
 
+    def test_run_with_misspelled_command_or_topic_name(self):
+        """
+        Similar command and help topic names are suggested when an unknown
+        topic is requested.
+        """
+        self.command.run(topic="hepl")
+        self.assertEquals(self.command.outf.getvalue(),
+                          "hepl is an unknown command or topic.\n"
+                          "Did you mean help?\n")
+
+    def set_environment_variable(self, name, value):
+        """Set an environment variable for the rest of the test.
+
+        @param value: The value to set, or C{None} to unset the variable.
+        """
+        original_value = os.environ.get(name)
+
+        def restore_value():
+            if original_value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = original_value
+
+        self.addCleanup(restore_value)
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+    def set_pager(self, pager):
+        """Set the C{PAGER} environment variable for the rest of the test."""
+        self.set_environment_variable("PAGER", pager)
+
+    def write_custom_topic(self):
+        """Write a custom topic and load it."""
+        path = os.path.join(self.factory.directory.path, "custom-topic.txt")
+        self.factory.directory.make_path(
+            "A custom topic.\n\nDescriptive text.\n", path)
+        self.factory.controller.load_path(self.factory.directory.path)
+
+    def test_run_with_pager(self):
+        """
+        Help text is written to the pager in the C{PAGER} environment variable
+        when the output stream is a terminal.
+        """
+        self.write_custom_topic()
+        output_path = os.path.join(self.factory.directory.path, "paged")
+        self.set_pager("sh -c 'cat > %s'" % (output_path,))
+        self.command.outf = TerminalStringIO()
+        self.command.run(topic="custom-topic")
+        self.assertEquals(self.command.outf.getvalue(), "")
+        self.assertEquals(open(output_path).read(), "Descriptive text.\n")
+
+    def test_run_with_pager_sets_less_options(self):
+        """
+        C{LESS} is set to C{FRX} for the pager if it isn't set, so short
+        help text doesn't wait for the user to quit C{less}.
+        """
+        self.write_custom_topic()
+        output_path = os.path.join(self.factory.directory.path, "options")
+        self.set_pager("sh -c 'cat > /dev/null; echo $LESS > %s'"
+                       % (output_path,))
+        self.set_environment_variable("LESS", None)
+        self.command.outf = TerminalStringIO()
+        self.command.run(topic="custom-topic")
+        self.assertEquals(open(output_path).read(), "FRX\n")
+
+    def test_run_with_pager_keeps_less_options(self):
+        """C{LESS} is left alone if it's already set."""
+        self.write_custom_topic()
+        output_path = os.path.join(self.factory.directory.path, "options")
+        self.set_pager("sh -c 'cat > /dev/null; echo $LESS > %s'"
+                       % (output_path,))
+        self.set_environment_variable("LESS", "-S")
+        self.command.outf = TerminalStringIO()
+        self.command.run(topic="custom-topic")
+        self.assertEquals(open(output_path).read(), "-S\n")
+
+    def test_run_with_unavailable_pager(self):
+        """
+        Help text is written to the output stream if the pager can't be
+        started.
+        """
+        self.write_custom_topic()
+        self.set_pager("/nonexistent/pager")
+        self.command.outf = TerminalStringIO()
+        self.command.run(topic="custom-topic")
+        self.assertEquals(self.command.outf.getvalue(), "Descriptive text.\n")
+
 
 class CustomHelpCommandTest(ResourcedTestCase):
     """Tests for L{cmd_help} with custom program details."""
@@ -445,3 +657,94 @@ Basic commands:
   test-program help commands  List all commands
   test-program help topics    List all help topics
 """)
+
+
+class CompleteCommandTest(ResourcedTestCase):
+    """Tests for L{cmd_complete}."""
+
+    resources = [("factory", CommandFactoryResource())]
+
+    def setUp(self):
+        super(CompleteCommandTest, self).setUp()
+        self.command = self.factory.create_command("complete", cmd_complete)
+        self.factory.create_command("help", cmd_help)
+        self.factory.create_help_topic("topics", topic_topics)
+
+    def test_run(self):
+        """
+        The complete command prints candidates for the last word, one per
+        line.  Hidden commands aren't candidates.
+        """
+        self.command.run(words_list=["he"])
+        self.assertEquals(self.command.outf.getvalue(), "help\n")
+
+    def test_run_with_help(self):
+        """Help topics are candidates for the word following C{help}."""
+        self.command.run(words_list=["help", "t"])
+        self.assertEquals(self.command.outf.getvalue(), "topics\n")
+
+    def test_run_saves_index(self):
+        """
+        The names candidates are drawn from are saved in the controller's
+        completion directory.
+        """
+        controller = self.factory.controller
+        command_path = self.factory.directory.make_dir()
+        controller.load_path(command_path)
+        controller.completion_directory = os.path.join(
+            self.factory.directory.path, "completion")
+        self.command.run(words_list=["he"])
+        self.assertEquals(
+            complete_from_cache(controller.completion_directory,
+                                [command_path], ["help", "to"]),
+            ["topics"])
+
+
+class CompletionScriptCommandTest(ResourcedTestCase):
+    """Tests for L{cmd_completion_script}."""
+
+    resources = [("factory", CommandFactoryResource())]
+
+    def setUp(self):
+        super(CompletionScriptCommandTest, self).setUp()
+        self.command = self.factory.create_command("completion-script",
+                                                   cmd_completion_script)
+        self.factory.create_command("help", cmd_help)
+        self.factory.create_help_topic("topics", topic_topics)
+
+    def test_run(self):
+        """
+        The completion-script command writes a script completing command
+        names, with their summaries, and help topics.
+        """
+        self.command.run("fish", program=u"test")
+        output = self.command.outf.getvalue()
+        self.assertIn("complete -c 'test' -n '__fish_use_subcommand' "
+                      "-a 'help' -d 'Show help about a command or topic.'\n",
+                      output)
+        self.assertIn("-a 'topics' -d 'Topics list.'\n", output)
+
+    def test_run_with_unknown_shell(self):
+        """An error is raised if the shell isn't supported."""
+        self.assertRaises(BzrCommandError, self.command.run, "csh")
+
+    def test_run_with_output(self):
+        """
+        The script is written to the --output path, and isn't written again
+        while the commands and help topics it completes don't change.
+        """
+        path = self.factory.directory.make_path()
+        self.command.run("bash", output=path)
+        self.assertEquals(self.command.outf.getvalue(), "")
+        content = open(path).read()
+        self.assertIn("compgen -W 'completion-script help'", content)
+        open(path, "a").write("# Unchanged.\n")
+        self.command.run("bash", output=path)
+        self.assertEquals(self.command.outf.getvalue(),
+                          "%s is up to date.\n" % (path,))
+        self.assertTrue(open(path).read().endswith("# Unchanged.\n"))
+
+        self.factory.create_command("version", cmd_version)
+        self.command.run("bash", output=path)
+        self.assertIn("compgen -W 'completion-script help version'",
+                      open(path).read())
@@ -0,0 +1,165 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.cache}."""
+
+import os
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant.cache import (
+    LRUCache, DiskCache, get_default_help_cache_directory)
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+class GetDefaultHelpCacheDirectoryTest(TestCase):
+    """Tests for L{get_default_help_cache_directory}."""
+
+    def setUp(self):
+        super(GetDefaultHelpCacheDirectoryTest, self).setUp()
+        self.original_path = os.environ.pop("COMMANDANT_HELP_CACHE", None)
+
+    def tearDown(self):
+        os.environ.pop("COMMANDANT_HELP_CACHE", None)
+        if self.original_path is not None:
+            os.environ["COMMANDANT_HELP_CACHE"] = self.original_path
+        super(GetDefaultHelpCacheDirectoryTest, self).tearDown()
+
+    def test_default_path(self):
+        """Help is cached in the program's directory by default."""
+        self.assertEquals(
+            get_default_help_cache_directory("test"),
+            os.path.join(os.path.expanduser("~"), ".test", "help-cache"))
+
+    def test_environment_variable(self):
+        """C{COMMANDANT_HELP_CACHE} overrides the default path."""
+        os.environ["COMMANDANT_HELP_CACHE"] = "/tmp/help-cache"
+        self.assertEquals(get_default_help_cache_directory("test"),
+                          "/tmp/help-cache")
+
+
+class LRUCacheTest(TestCase):
+    """Tests for L{LRUCache}."""
+
+    def test_get_missing_value(self):
+        """L{LRUCache.get} returns C{None} and counts a miss for new keys."""
+        cache = LRUCache(10)
+        self.assertEquals(cache.get("key"), None)
+        self.assertEquals((cache.hits, cache.misses), (0, 1))
+
+    def test_set_and_get(self):
+        """L{LRUCache.get} returns a cached value and counts a hit."""
+        cache = LRUCache(10)
+        cache.set("key", "value")
+        self.assertEquals(cache.get("key"), "value")
+        self.assertEquals((cache.hits, cache.misses), (1, 0))
+        self.assertEquals(cache.get_size(), 5)
+
+    def test_set_replaces_value(self):
+        """Setting a key again replaces its value and size."""
+        cache = LRUCache(10)
+        cache.set("key", "value")
+        cache.set("key", "new")
+        self.assertEquals(cache.get("key"), "new")
+        self.assertEquals(cache.get_size(), 3)
+        self.assertEquals(len(cache), 1)
+
+    def test_eviction(self):
+        """
+        The least recently used values are evicted when the cache goes over
+        its budget.
+        """
+        cache = LRUCache(10)
+        cache.set("a", "aaaa")
+        cache.set("b", "bbbb")
+        cache.get("a")
+        cache.set("c", "cccc")
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertTrue("c" in cache)
+        self.assertEquals(cache.evictions, 1)
+        self.assertEquals(cache.get_size(), 8)
+
+    def test_unicode_size(self):
+        """C{unicode} values are measured by their UTF-8 encoded size."""
+        cache = LRUCache(10)
+        cache.set("key", u"caf\xe9")
+        self.assertEquals(cache.get_size(), 5)
+        cache.set("big", u"\u2603" * 4)
+        self.assertFalse("big" in cache)
+
+    def test_value_larger_than_budget(self):
+        """Values larger than the budget aren't cached."""
+        cache = LRUCache(10)
+        cache.set("a", "aaaa")
+        cache.set("big", "x" * 11)
+        self.assertFalse("big" in cache)
+        self.assertTrue("a" in cache)
+        self.assertEquals(cache.evictions, 0)
+
+    def test_remove(self):
+        """L{LRUCache.remove} removes a value and its size."""
+        cache = LRUCache(10)
+        cache.set("a", "aaaa")
+        cache.remove("a")
+        cache.remove("missing")
+        self.assertEquals((len(cache), cache.get_size()), (0, 0))
+
+    def test_clear(self):
+        """L{LRUCache.clear} removes all values and resets the counters."""
+        cache = LRUCache(10)
+        cache.set("a", "aaaa")
+        cache.get("a")
+        cache.get("b")
+        cache.clear()
+        self.assertEquals((len(cache), cache.get_size()), (0, 0))
+        self.assertEquals((cache.hits, cache.misses, cache.evictions),
+                          (0, 0, 0))
+
+
+class DiskCacheTest(ResourcedTestCase):
+    """Tests for L{DiskCache}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def setUp(self):
+        super(DiskCacheTest, self).setUp()
+        self.cache = DiskCache(os.path.join(self.directory.path, "cache"))
+
+    def test_get_missing_text(self):
+        """L{DiskCache.get} returns C{None} if nothing is cached."""
+        self.assertEquals(self.cache.get("name", "fingerprint"), None)
+
+    def test_set_and_get(self):
+        """L{DiskCache.get} returns text cached with the same fingerprint."""
+        self.cache.set("name", ("path", 1), u"Help text \N{SNOWMAN}")
+        self.assertEquals(self.cache.get("name", ("path", 1)),
+                          u"Help text \N{SNOWMAN}")
+        self.assertEquals(self.cache.get("name", ("path", 2)), None)
+
+    def test_set_replaces_text(self):
+        """Text cached for a name replaces text with another fingerprint."""
+        self.cache.set("name", 1, "Old text")
+        self.cache.set("name", 2, "New text")
+        self.assertEquals(self.cache.get("name", 1), None)
+        self.assertEquals(self.cache.get("name", 2), u"New text")
+        self.assertEquals(len(os.listdir(self.cache.path)), 1)
+
+    def test_set_non_utf8_text(self):
+        """C{str} text that isn't UTF-8 can't be cached."""
+        self.assertRaises(UnicodeError, self.cache.set, "name", 1, "\xff")
@@ -20,18 +20,22 @@
 import os
 import sys
 
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, succeed
 from twisted.trial.unittest import TestCase
 
 from bzrlib.commands import Command
+from bzrlib.option import Option
 
 from testresources import ResourcedTestCase
 
-from commandant.commands import ExecutableCommand, TwistedCommand
+from commandant.commands import (
+    ExecutableCommand, TwistedCommand, get_option_names,
+    get_argument_placeholders)
 from commandant.testing.mocker import MockerResource
 from commandant.testing.resources import (
     TemporaryDirectoryResource, CommandFactoryResource, FakeCommand,
     StdoutResource)
+from commandant.timing import start_timing, stop_timing
 
 
 class CommandTest(ResourcedTestCase):
@@ -105,6 +109,26 @@ class ExecutableCommandTest(ResourcedTestCase):
         command.path = path
         command.run_argv_aliases(["--with-test-arg", "1"])
 
+    def test_run_timed(self):
+        """
+        Running the program is recorded as a phase when timing is enabled.
+        """
+        path = os.path.join(self.directory.path, "executable")
+        system_mock = self.mocker.replace("os.system")
+        system_mock(path)
+        self.mocker.replay()
+
+        command = self.factory.create_command("test", ExecutableCommand)
+        command.path = path
+        timer = start_timing()
+        try:
+            command.run([])
+        finally:
+            stop_timing()
+        self.assertEqual(["process %s" % (path,)],
+                         [phase.name for phase in timer.phases])
+        self.assertNotEqual(None, timer.phases[0].end)
+
 
 class TwistedCommandTest(ResourcedTestCase, TestCase):
 
@@ -199,3 +223,84 @@ class TwistedCommandTest(ResourcedTestCase, TestCase):
 
         command = self.factory.create_twisted_command("test", FakeCommand)
         self.assertRaises(RuntimeError, command.run_argv_aliases, [])
+
+    def test_deferred_timed(self):
+        """
+        The time until the C{Deferred} returned by the command fires is
+        recorded as a span of its own when timing is enabled.
+        """
+        calls = []
+
+        class FakeReactor(object):
+
+            def callLater(self, delay, function):
+                calls.append(function)
+
+        class FakeCommand(TwistedCommand):
+
+            def get_reactor(self):
+                return FakeReactor()
+
+        command = self.factory.create_command("test", FakeCommand)
+        deferred = Deferred()
+        timer = start_timing()
+        try:
+            command._stop_reactor(deferred)
+            [span] = timer.phases
+            self.assertEqual("Deferred test", span.name)
+            self.assertEqual(None, span.end)
+            deferred.callback("test-value")
+        finally:
+            stop_timing()
+        self.assertNotEqual(None, span.end)
+        self.assertEqual("test-value", command._return_value)
+        self.assertEqual(1, len(calls))
+
+
+class CommandMetadataTest(TestCase):
+    """
+    Tests for L{get_option_names} and L{get_argument_placeholders}.
+    """
+
+    def test_get_option_names(self):
+        """
+        L{get_option_names} returns the long and short names of a command's
+        options and C{bzrlib}'s standard options, and the names of those
+        that take a value.
+        """
+
+        class cmd_test(Command):
+            takes_options = [Option("jobs", type=int, short_name="j"),
+                             Option("force"),
+                             Option("secret", hidden=True)]
+
+        (names, value_names) = get_option_names(cmd_test)
+        for name in ["--jobs", "-j", "--force", "--help", "-h"]:
+            self.assertIn(name, names)
+        self.assertNotIn("--secret", names)
+        self.assertEquals(value_names, ["--jobs", "-j"])
+
+    def test_get_option_names_with_registered_option(self):
+        """Options named by string are looked up in C{Option.OPTIONS}."""
+        option = Option("test-registered-option")
+        Option.OPTIONS[option.name] = option
+        self.addCleanup(Option.OPTIONS.pop, option.name)
+
+        class cmd_test(Command):
+            takes_options = ["test-registered-option", "unknown-option"]
+
+        (names, value_names) = get_option_names(cmd_test)
+        self.assertIn("--test-registered-option", names)
+        self.assertNotIn("--unknown-option", names)
+
+    def test_get_argument_placeholders(self):
+        """
+        L{get_argument_placeholders} formats arguments as they are in
+        C{bzrlib} usage text.
+        """
+
+        class cmd_test(Command):
+            takes_args = ["action", "topic?", "words*", "files+"]
+
+        self.assertEquals(get_argument_placeholders(cmd_test),
+                          ["ACTION", "[TOPIC]", "[WORDS...]", "FILES..."])
@@ -0,0 +1,265 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.completion}."""
+
+import os
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant.completion import (
+    CompletionIndex, complete_from_cache, get_default_completion_directory,
+    get_index_path, get_paths_fingerprint, resolve_from_cache,
+    save_command_trie)
+from commandant.index import COMMAND, HelpIndex, IndexEntry
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+class FakeController(object):
+    """A controller with a L{HelpIndex} and a list of loaded paths."""
+
+    def __init__(self, loaded_paths, entries, aliases=None):
+        self.loaded_paths = loaded_paths
+        self.help_index = HelpIndex()
+        for entry in entries:
+            self.help_index.set_command(entry)
+        self.aliases = aliases or {}
+
+    def get_help_index(self):
+        return self.help_index
+
+    def get_aliases(self):
+        return dict(self.aliases)
+
+
+class GetDefaultCompletionDirectoryTest(TestCase):
+    """Tests for L{get_default_completion_directory}."""
+
+    def setUp(self):
+        super(GetDefaultCompletionDirectoryTest, self).setUp()
+        self.original_path = os.environ.pop("COMMANDANT_COMPLETION_CACHE",
+                                            None)
+
+    def tearDown(self):
+        os.environ.pop("COMMANDANT_COMPLETION_CACHE", None)
+        if self.original_path is not None:
+            os.environ["COMMANDANT_COMPLETION_CACHE"] = self.original_path
+        super(GetDefaultCompletionDirectoryTest, self).tearDown()
+
+    def test_default_path(self):
+        """Indexes are stored in the program's directory by default."""
+        self.assertEquals(
+            get_default_completion_directory("test"),
+            os.path.join(os.path.expanduser("~"), ".test", "completion"))
+
+    def test_environment_variable(self):
+        """C{COMMANDANT_COMPLETION_CACHE} overrides the default path."""
+        os.environ["COMMANDANT_COMPLETION_CACHE"] = "/tmp/completion"
+        self.assertEquals(get_default_completion_directory("test"),
+                          "/tmp/completion")
+
+
+class CompletionIndexTest(TestCase):
+    """Tests for L{CompletionIndex}."""
+
+    def setUp(self):
+        super(CompletionIndexTest, self).setUp()
+        self.index = CompletionIndex(["version", "help", "hello"],
+                                     ["topics", "commands", "hello"])
+
+    def test_complete_command_names(self):
+        """The first word is completed with command names."""
+        self.assertEquals(self.index.get_candidates(["he"]),
+                          ["hello", "help"])
+        self.assertEquals(self.index.get_candidates([]),
+                          ["hello", "help", "version"])
+        self.assertEquals(self.index.get_candidates(["x"]), [])
+
+    def test_complete_help_topics(self):
+        """
+        The word following C{help} is completed with command and help topic
+        names.
+        """
+        self.assertEquals(self.index.get_candidates(["help", ""]),
+                          ["commands", "hello", "help", "topics", "version"])
+        self.assertEquals(self.index.get_candidates(["help", "co"]),
+                          ["commands"])
+
+    def test_complete_command_arguments(self):
+        """There are no candidates for arguments to other commands."""
+        self.assertEquals(self.index.get_candidates(["version", ""]), [])
+
+    def test_complete_after_alias(self):
+        """Words following an alias are completed as for its command."""
+        index = CompletionIndex(["help"], ["topics"], aliases={"?": "help"})
+        self.assertEquals(index.get_candidates(["?", "t"]), ["topics"])
+
+
+class OptionCompletionTest(TestCase):
+    """Tests for completing options and arguments with L{CompletionIndex}."""
+
+    def setUp(self):
+        super(OptionCompletionTest, self).setUp()
+        self.index = CompletionIndex(
+            ["deploy", "help"], ["topics"],
+            options={"deploy": ["--force", "--help", "--jobs", "-h", "-j"],
+                     "help": ["--help", "--limit", "-h"]},
+            value_options={"deploy": ["--jobs", "-j"], "help": ["--limit"]},
+            arguments={"deploy": ["TARGET", "[HOSTS...]"],
+                       "help": ["[TOPIC]"]})
+
+    def test_complete_options(self):
+        """Words starting with C{-} are completed with option names."""
+        self.assertEquals(self.index.get_candidates(["deploy", "--j"]),
+                          ["--jobs"])
+        self.assertEquals(self.index.get_candidates(["help", "--l"]),
+                          ["--limit"])
+        self.assertEquals(self.index.get_candidates(["deploy", "-"]),
+                          ["--force", "--help", "--jobs", "-h", "-j"])
+
+    def test_complete_empty_word(self):
+        """
+        An empty word is completed with options and a placeholder for the
+        argument at its position.
+        """
+        self.assertEquals(
+            self.index.get_candidates(["deploy", ""]),
+            ["--force", "--help", "--jobs", "-h", "-j", "TARGET"])
+        self.assertEquals(
+            self.index.get_candidates(["deploy", "--force", "prod", ""]),
+            ["--force", "--help", "--jobs", "-h", "-j", "[HOSTS...]"])
+        self.assertEquals(
+            self.index.get_candidates(["deploy", "prod", "a", "b", ""])[-1],
+            "[HOSTS...]")
+
+    def test_complete_option_value(self):
+        """There are no candidates for the value of an option."""
+        self.assertEquals(self.index.get_candidates(["deploy", "-j", ""]), [])
+        self.assertEquals(
+            self.index.get_candidates(["deploy", "-j", "4", ""])[-1],
+            "TARGET")
+
+    def test_complete_after_double_dash(self):
+        """Words after C{--} are arguments, even if they start with C{-}."""
+        self.assertEquals(
+            self.index.get_candidates(["deploy", "--", "-x", ""])[-1],
+            "[HOSTS...]")
+
+    def test_complete_unknown_command_options(self):
+        """There are no option candidates for commands without options."""
+        self.assertEquals(self.index.get_candidates(["echo", "-"]), [])
+
+
+class CompletionCacheTest(ResourcedTestCase):
+    """Tests for saving and loading cached L{CompletionIndex}es."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def setUp(self):
+        super(CompletionCacheTest, self).setUp()
+        self.command_path = self.directory.make_dir()
+        self.cache_path = self.directory.make_dir()
+
+    def test_fingerprint_changes_with_directory(self):
+        """
+        The fingerprint of a command directory changes when a file is
+        added.
+        """
+        fingerprint = get_paths_fingerprint([self.command_path])
+        self.assertEquals(get_paths_fingerprint([self.command_path]),
+                          fingerprint)
+        self.directory.make_path(
+            "content", os.path.join(self.command_path, "hello"))
+        self.assertNotEquals(get_paths_fingerprint([self.command_path]),
+                             fingerprint)
+
+    def test_save_and_load(self):
+        """An index is loaded if its fingerprint matches."""
+        path = get_index_path(self.cache_path, [self.command_path])
+        CompletionIndex(["help"], ["topics"]).save(path, "fingerprint")
+        index = CompletionIndex.load(path, "fingerprint")
+        self.assertEquals((index.commands, index.topics),
+                          (["help"], ["topics"]))
+        self.assertEquals(CompletionIndex.load(path, "other"), None)
+
+    def test_load_missing_or_corrupt_index(self):
+        """C{None} is returned for missing or corrupt index files."""
+        path = get_index_path(self.cache_path, [self.command_path])
+        self.assertEquals(CompletionIndex.load(path, "fingerprint"), None)
+        self.directory.make_path("not json", path)
+        self.assertEquals(CompletionIndex.load(path, "fingerprint"), None)
+
+    def test_complete_from_cache(self):
+        """
+        L{complete_from_cache} uses the cached index while the command
+        directory is unchanged.
+        """
+        paths = [self.command_path]
+        self.assertEquals(
+            complete_from_cache(self.cache_path, paths, ["h"]), None)
+        CompletionIndex(["help"], []).save(
+            get_index_path(self.cache_path, paths),
+            get_paths_fingerprint(paths))
+        self.assertEquals(
+            complete_from_cache(self.cache_path, paths, ["h"]), ["help"])
+        self.directory.make_path(
+            "content", os.path.join(self.command_path, "hello"))
+        self.assertEquals(
+            complete_from_cache(self.cache_path, paths, ["h"]), None)
+
+    def test_save_and_load_options(self):
+        """Options, arguments and aliases are saved with the index."""
+        path = get_index_path(self.cache_path, [self.command_path])
+        CompletionIndex(["deploy"], [], options={"deploy": ["--jobs"]},
+                        value_options={"deploy": ["--jobs"]},
+                        arguments={"deploy": ["TARGET"]},
+                        aliases={"d": "deploy"}).save(path, "fingerprint")
+        index = CompletionIndex.load(path, "fingerprint")
+        self.assertEquals(index.options, {"deploy": ["--jobs"]})
+        self.assertEquals(index.value_options, {"deploy": ["--jobs"]})
+        self.assertEquals(index.arguments, {"deploy": ["TARGET"]})
+        self.assertEquals(index.aliases, {"d": "deploy"})
+
+    def test_resolve_from_cache(self):
+        """
+        L{resolve_from_cache} resolves abbreviated command names with the
+        cached trie while the command directory is unchanged.  Hidden
+        command names and aliases resolve to themselves.
+        """
+        paths = [self.command_path]
+        controller = FakeController(
+            paths, [IndexEntry("deploy-service", COMMAND),
+                    IndexEntry("describe", COMMAND),
+                    IndexEntry("deploy", COMMAND, hidden=True)],
+            {"dep": "describe"})
+        self.assertEquals(
+            resolve_from_cache(self.cache_path, paths, "dep"), None)
+        save_command_trie(self.cache_path, controller)
+        self.assertEquals(
+            resolve_from_cache(self.cache_path, paths, "deploy-"),
+            ["deploy-service"])
+        self.assertEquals(resolve_from_cache(self.cache_path, paths, "de"),
+                          ["deploy-service", "describe"])
+        self.assertEquals(
+            resolve_from_cache(self.cache_path, paths, "deploy"), ["deploy"])
+        self.assertEquals(
+            resolve_from_cache(self.cache_path, paths, "dep"), ["dep"])
+        self.directory.make_path(
+            "content", os.path.join(self.command_path, "hello"))
+        self.assertEquals(
+            resolve_from_cache(self.cache_path, paths, "dep"), None)
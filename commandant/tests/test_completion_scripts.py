@@ -0,0 +1,213 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.completion_scripts}."""
+
+import os
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant.completion_scripts import (
+    BASH, FISH, ZSH, generate_script, get_registry_fingerprint,
+    get_script_fingerprint)
+from commandant.index import COMMAND, TOPIC, IndexEntry
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+def make_entries():
+    """Get command and help topic entries to generate scripts from."""
+    commands = [
+        IndexEntry("help", COMMAND, summary="Show help.",
+                   options=["--format", "--limit"],
+                   value_options=["--format", "--limit"],
+                   aliases=["?", "--help"]),
+        IndexEntry("hello", COMMAND, summary="Say 'hello'.",
+                   options=["--loud", "-l"], aliases=["hi"])]
+    topics = [IndexEntry("topics", TOPIC, summary="List topics.")]
+    return commands, topics
+
+
+class GetRegistryFingerprintTest(ResourcedTestCase):
+    """Tests for L{get_registry_fingerprint}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_unchanged(self):
+        """The same registry has the same fingerprint."""
+        commands, topics = make_entries()
+        self.assertEquals(
+            get_registry_fingerprint(BASH, "test", commands, topics),
+            get_registry_fingerprint(BASH, "test", *make_entries()))
+
+    def test_changed(self):
+        """
+        The fingerprint changes with the shell, program name, command
+        names, aliases and options.
+        """
+        commands, topics = make_entries()
+        fingerprint = get_registry_fingerprint(BASH, "test", commands, topics)
+        self.assertNotEquals(
+            get_registry_fingerprint(ZSH, "test", commands, topics),
+            fingerprint)
+        self.assertNotEquals(
+            get_registry_fingerprint(BASH, "other", commands, topics),
+            fingerprint)
+        commands[1].aliases.append("hey")
+        self.assertNotEquals(
+            get_registry_fingerprint(BASH, "test", commands, topics),
+            fingerprint)
+
+    def test_changed_source(self):
+        """The fingerprint changes when a source file changes."""
+        path = self.directory.make_path("Hello.\n")
+        commands, topics = make_entries()
+        commands[1].path = path
+        fingerprint = get_registry_fingerprint(BASH, "test", commands, topics)
+        os.utime(path, (0, 0))
+        self.assertNotEquals(
+            get_registry_fingerprint(BASH, "test", commands, topics),
+            fingerprint)
+
+    def test_changed_topic_source(self):
+        """
+        The fingerprint changes when the file of a help topic with the same
+        name as a command changes, since the command's summary comes from
+        it.
+        """
+        path = self.directory.make_path("Say hello.\n")
+        commands, topics = make_entries()
+        topic_paths = {"hello": path}
+        fingerprint = get_registry_fingerprint(BASH, "test", commands, topics,
+                                               topic_paths)
+        self.assertNotEquals(
+            get_registry_fingerprint(BASH, "test", commands, topics),
+            fingerprint)
+        os.utime(path, (0, 0))
+        self.assertNotEquals(
+            get_registry_fingerprint(BASH, "test", commands, topics,
+                                     topic_paths),
+            fingerprint)
+
+    def test_changed_offset(self):
+        """The fingerprint changes with the command name's position."""
+        commands, topics = make_entries()
+        self.assertNotEquals(
+            get_registry_fingerprint(BASH, "test", commands, topics),
+            get_registry_fingerprint(BASH, "test", commands, topics,
+                                     offset=1))
+
+
+class GenerateScriptTest(TestCase):
+    """Tests for L{generate_script}."""
+
+    def setUp(self):
+        super(GenerateScriptTest, self).setUp()
+        self.commands, self.topics = make_entries()
+
+    def generate(self, shell, offset=0):
+        """Generate a script for C{shell} with a dummy fingerprint."""
+        return generate_script(shell, "test", self.commands, self.topics,
+                               "0123", offset)
+
+    def test_fingerprint(self):
+        """The fingerprint is recorded near the top of the script."""
+        for shell in (BASH, ZSH, FISH):
+            lines = self.generate(shell).splitlines()
+            self.assertEquals(lines[1], "# fingerprint: 0123")
+
+    def test_bash(self):
+        """
+        Bash scripts complete command names and aliases, options for each
+        command and help topics for the help command.
+        """
+        script = self.generate(BASH)
+        self.assertIn("compgen -W 'hello help hi' ", script)
+        self.assertIn("    'help'|'?'|'--help')\n", script)
+        self.assertIn("compgen -W 'hello help topics' ", script)
+        self.assertIn("        options='--loud -l'\n", script)
+        self.assertTrue(
+            script.endswith("complete -F _test -o default 'test'\n"))
+
+    def test_zsh(self):
+        """Zsh scripts describe commands and help topics."""
+        script = self.generate(ZSH)
+        self.assertIn("        'hello:Say '\\''hello'\\''.'\n", script)
+        self.assertIn("        'hi:Say '\\''hello'\\''.'\n", script)
+        self.assertIn("        'topics:List topics.'\n", script)
+        self.assertIn("        options=('--loud' '-l')\n", script)
+        self.assertTrue(script.endswith("compdef _test 'test'\n"))
+
+    def test_fish(self):
+        """
+        Fish scripts complete commands, help topics and options, marking
+        options that take a value.
+        """
+        script = self.generate(FISH)
+        self.assertIn(
+            "complete -c 'test' -n '__fish_use_subcommand' -a 'hi' "
+            "-d 'Say \\'hello\\'.'\n", script)
+        self.assertIn(
+            "complete -c 'test' -n '__fish_seen_subcommand_from help ? "
+            "--help' -a 'topics' -d 'List topics.'\n", script)
+        self.assertIn(
+            "complete -c 'test' -n '__fish_seen_subcommand_from help ? "
+            "--help' -l 'format' -r\n", script)
+        self.assertIn(
+            "complete -c 'test' -n '__fish_seen_subcommand_from hello hi' "
+            "-s 'l'\n", script)
+
+
+    def test_offset(self):
+        """
+        Scripts for programs that take arguments before the command name,
+        like C{bin/commandant}, complete the command name after them.
+        """
+        script = self.generate(BASH, offset=1)
+        self.assertIn("    if [ $COMP_CWORD -le 1 ]; then\n", script)
+        self.assertIn("    if [ $COMP_CWORD -eq 2 ]; then\n", script)
+        self.assertIn("    case \"${COMP_WORDS[2]}\" in\n", script)
+        script = self.generate(ZSH, offset=1)
+        self.assertIn("    if (( CURRENT == 3 )); then\n", script)
+        self.assertIn("    case $words[3] in\n", script)
+        script = self.generate(FISH, offset=1)
+        self.assertIn(
+            "complete -c 'test' -n 'test (count (commandline -opc)) -eq 2' "
+            "-a 'hi' -d 'Say \\'hello\\'.'\n", script)
+
+
+class GetScriptFingerprintTest(ResourcedTestCase):
+    """Tests for L{get_script_fingerprint}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_get_script_fingerprint(self):
+        """The fingerprint recorded in a generated script is returned."""
+        commands, topics = make_entries()
+        path = self.directory.make_path(
+            generate_script(BASH, "test", commands, topics, "0123"))
+        self.assertEquals(get_script_fingerprint(path), "0123")
+
+    def test_missing(self):
+        """C{None} is returned if the script doesn't exist."""
+        self.assertEquals(
+            get_script_fingerprint(self.directory.make_path()), None)
+
+    def test_without_fingerprint(self):
+        """C{None} is returned if the file doesn't contain a fingerprint."""
+        path = self.directory.make_path("complete -F _test test\n")
+        self.assertEquals(get_script_fingerprint(path), None)
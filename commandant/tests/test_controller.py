@@ -17,9 +17,14 @@
 
 """Unit tests for L{commandant.controller}."""
 
+import json
 import os
+import pstats
 import stat
+from StringIO import StringIO
 import sys
+import threading
+import time
 
 import bzrlib.ui
 from bzrlib.errors import BzrCommandError
@@ -29,6 +34,9 @@ from testresources import ResourcedTestCase
 
 from commandant import __version__
 from commandant.controller import CommandController
+from commandant.errors import AmbiguousCommandError
+from commandant.help_topics import FileHelpTopic
+from commandant.index import COMMAND, EXECUTABLE, TOPIC
 from commandant.testing.mocker import MockerResource
 from commandant.testing.resources import (
     TemporaryDirectoryResource, FakeCommand, FakeHelpTopic, StdoutResource,
@@ -108,6 +116,89 @@ class CommandControllerTest(ResourcedTestCase):
         self.assertTrue(isinstance(command, FakeCommand))
         self.assertEquals(command.controller, self.controller)
 
+    def test_get_command_with_alias(self):
+        """
+        The L{CommandController.get_command} method resolves command aliases
+        with the alias table built when commands are registered.
+        """
+
+        class AliasedCommand(FakeCommand):
+            aliases = ["fake", "f"]
+
+        self.controller.register_command("fake-command", AliasedCommand)
+        self.assertEquals(self.controller.get_aliases(),
+                          {"fake": "fake-command", "f": "fake-command"})
+        command = self.controller.get_command("f")
+        self.assertTrue(isinstance(command, AliasedCommand))
+        self.assertEquals(command.controller, self.controller)
+
+    def test_run_command_with_alias(self):
+        """Commands can be run with their aliases."""
+
+        class AliasedCommand(FakeCommand):
+            aliases = ["fake"]
+
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", AliasedCommand)
+        self.controller.run(["fake"])
+        self.assertEquals(sys.stdout.getvalue(), "((), {})")
+
+    def test_register_command_replaces_aliases(self):
+        """
+        Registering a command with the name of an existing command replaces
+        the existing command's aliases.
+        """
+
+        class AliasedCommand(FakeCommand):
+            aliases = ["fake"]
+
+        self.controller.register_command("fake-command", AliasedCommand)
+        self.controller.register_command("fake-command", FakeCommand)
+        self.assertEquals(self.controller.get_aliases(), {})
+        self.assertEquals(self.controller.alias_conflicts, [])
+
+    def test_alias_conflicts(self):
+        """
+        An alias used by several commands, or that's also a command name, is
+        recorded as an C{(alias, name, new_name)} tuple.  The most recently
+        registered command wins an alias, and a command name always wins
+        over an alias.
+        """
+
+        class FirstCommand(FakeCommand):
+            aliases = ["f", "other"]
+
+        class SecondCommand(FakeCommand):
+            aliases = ["f"]
+
+        self.controller.register_command("first", FirstCommand)
+        self.controller.register_command("second", SecondCommand)
+        self.controller.register_command("other", FakeCommand)
+        self.assertEquals(self.controller.alias_conflicts,
+                          [("f", "first", "second"),
+                           ("other", "first", "other")])
+        self.assertTrue(isinstance(self.controller.get_command("f"),
+                                   SecondCommand))
+        self.assertFalse(isinstance(self.controller.get_command("other"),
+                                    FirstCommand))
+
+    def test_register_command_keeps_taken_aliases(self):
+        """
+        Registering a command again doesn't remove an alias that another
+        command has taken from it.
+        """
+
+        class FirstCommand(FakeCommand):
+            aliases = ["f"]
+
+        class SecondCommand(FakeCommand):
+            aliases = ["f"]
+
+        self.controller.register_command("first", FirstCommand)
+        self.controller.register_command("second", SecondCommand)
+        self.controller.register_command("first", FakeCommand)
+        self.assertEquals(self.controller.get_aliases(), {"f": "second"})
+
     def test_run_unknown_command(self):
         """
         C{bzrlib.error.BzrCommandError} is raised if an unknown
@@ -146,6 +237,170 @@ class CommandControllerTest(ResourcedTestCase):
                 "((), {'test_arg': u'test-arg'})",
                 ))
 
+    def test_run_abbreviated_command(self):
+        """
+        Command names can be abbreviated to a unique prefix when
+        L{CommandController.abbreviations} is C{True}.
+        """
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.abbreviations = True
+        self.controller.run(["fake"])
+        self.assertEquals(sys.stdout.getvalue(), "((), {})")
+
+    def test_run_abbreviated_command_disabled(self):
+        """Command names can't be abbreviated by default."""
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", FakeCommand)
+        self.assertRaises(BzrCommandError, self.controller.run, ["fake"])
+
+    def test_run_with_profile_command(self):
+        """
+        The C{--profile-command=PATH} global option profiles the command's
+        C{run} method and writes the results to C{PATH} in C{pstats}
+        format.  It's removed from the arguments passed to the command.
+        """
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", FakeCommand)
+        path = os.path.join(self.directory.make_dir(), "profile")
+        self.controller.run(["--profile-command=%s" % (path,),
+                             "fake-command"])
+        self.assertEquals(sys.stdout.getvalue(), "((), {})")
+        stats = pstats.Stats(path)
+        self.assertTrue(
+            [function for function in stats.stats
+             if function[2] == "run"])
+
+    def test_run_with_profile_command_nested(self):
+        """
+        Commands run by a profiled command, with a nested call to
+        L{CommandController.run}, aren't profiled separately.
+        """
+        calls = []
+
+        class NestedCommand(Command):
+
+            def run(self):
+                calls.append(self.controller._profile_path)
+                self.controller.run(["fake-command"])
+                calls.append(self.controller._profile_path)
+
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.register_command("nested", NestedCommand)
+        path = os.path.join(self.directory.make_dir(), "profile")
+        self.controller.run(["--profile-command", path, "nested"])
+        self.assertEquals(calls, [path, path])
+        self.assertTrue(os.path.exists(path))
+        self.assertEquals(self.controller._profile_path, None)
+
+    def test_run_with_trace_allocations(self):
+        """
+        The memory allocated by the command is reported to C{stderr} when
+        L{CommandController.trace_allocations} is C{True}.
+        """
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = StringIO()
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.trace_allocations = True
+        self.controller.run(["fake-command"])
+        self.assertEquals(sys.stdout.getvalue(), "((), {})")
+        self.assertTrue(sys.stderr.getvalue().startswith(
+            "commandant: allocations for fake-command:\n"))
+
+    def test_resolve_command_name(self):
+        """
+        L{CommandController.resolve_command_name} returns the full name of
+        the command a unique prefix abbreviates.  Exact names, including
+        those of hidden commands, and unknown names are returned unchanged.
+        """
+
+        class HiddenCommand(FakeCommand):
+            hidden = True
+
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.register_command("fake", HiddenCommand)
+        self.controller.register_command("version", FakeCommand)
+        self.assertEquals(self.controller.resolve_command_name("v"),
+                          "version")
+        self.assertEquals(self.controller.resolve_command_name("fa"),
+                          "fake-command")
+        self.assertEquals(self.controller.resolve_command_name("fake"),
+                          "fake")
+        self.assertEquals(self.controller.resolve_command_name("unknown"),
+                          "unknown")
+
+    def test_resolve_ambiguous_command_name(self):
+        """
+        L{AmbiguousCommandError} is raised with the names of the matching
+        commands if a prefix isn't unique.
+        """
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.register_command("fake-other", FakeCommand)
+        error = self.assertRaises(AmbiguousCommandError,
+                                  self.controller.resolve_command_name, "fake")
+        self.assertEquals(error.candidates, ["fake-command", "fake-other"])
+        self.assertEquals(
+            str(error),
+            "fake is ambiguous and could be any of: fake-command, "
+            "fake-other.")
+
+    def test_run_misspelled_command(self):
+        """
+        An unknown command name is reported with the names of similar
+        commands.
+        """
+        self.controller.install_bzrlib_hooks()
+        self.controller.register_command("fake-command", FakeCommand)
+        error = self.assertRaises(BzrCommandError, self.controller.run,
+                                  ["fake-comand"])
+        self.assertEquals(
+            str(error),
+            'unknown command "fake-comand".  Did you mean fake-command?')
+
+    def test_get_suggestions(self):
+        """
+        L{CommandController.get_suggestions} returns the names of visible
+        commands and help topics within a few edits of a name, closest
+        first.
+        """
+
+        class HiddenCommand(FakeCommand):
+            hidden = True
+
+        self.controller.register_command("version", FakeCommand)
+        self.controller.register_command("versions", HiddenCommand)
+        self.controller.register_command("person", FakeCommand)
+        self.controller.register_help_topic("aversion", FakeHelpTopic)
+        self.assertEquals(self.controller.get_suggestions("verion"),
+                          ["version", "aversion", "person"])
+        self.assertEquals(self.controller.get_suggestions("verion", 1),
+                          ["version"])
+        self.assertEquals(self.controller.get_suggestions("xyzzy"), [])
+
+    def test_get_suggestions_cached(self):
+        """
+        The tree that suggestions are found with is cached in the completion
+        directory and used again while the names are unchanged.
+        """
+        self.controller.register_command("version", FakeCommand)
+        self.controller.load_path(self.directory.make_dir())
+        self.controller.completion_directory = self.directory.make_dir()
+        self.assertEquals(self.controller.get_suggestions("verson"),
+                          ["version"])
+        [filename] = os.listdir(self.controller.completion_directory)
+        path = os.path.join(self.controller.completion_directory, filename)
+        data = json.load(open(path))
+        data["tree"] = ["cached", {}]
+        json.dump(data, open(path, "w"))
+        controller = CommandController()
+        controller.register_command("version", FakeCommand)
+        controller.loaded_paths = self.controller.loaded_paths
+        controller.completion_directory = (
+            self.controller.completion_directory)
+        self.assertEquals(controller.get_suggestions("cashed"), ["cached"])
+
     def test_register_help_topic(self):
         """
         L{CommandController.register_help_topic} adds a L{HelpTopic} to the
@@ -405,3 +660,223 @@ class cmd_%s(Command):
         self.controller.load_module(FakeModule())
         self.assertEquals(self.controller.get_help_topic_names(),
                           set(["test-topic"]))
+
+    def test_get_help_index(self):
+        """
+        L{CommandController.get_help_index} returns a L{HelpIndex} with
+        entries for registered commands and help topics.  Help topics with
+        the same name as a command aren't listed as topics.
+        """
+
+        class HiddenCommand(FakeCommand):
+            hidden = True
+
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.register_command("hidden-command", HiddenCommand)
+        self.controller.register_help_topic("fake-command", FakeHelpTopic)
+        self.controller.register_help_topic("test-topic", FakeHelpTopic)
+        index = self.controller.get_help_index()
+        self.assertEquals(
+            [(entry.name, entry.kind, entry.hidden)
+             for entry in index.get_commands()],
+            [("fake-command", COMMAND, False),
+             ("hidden-command", COMMAND, True)])
+        self.assertEquals(
+            [(entry.name, entry.kind) for entry in index.get_topics()],
+            [("test-topic", TOPIC)])
+
+    def test_get_help_index_with_load_path(self):
+        """
+        Entries for executables and text file help topics include the path
+        they were loaded from.
+        """
+        path = os.path.join(self.directory.path, "executable")
+        self.directory.make_path(content="executable file", path=path)
+        os.chmod(path, stat.S_IEXEC)
+        topic_path = os.path.join(self.directory.path, "test-topic.txt")
+        self.directory.make_path(content="A test topic.", path=topic_path)
+        self.controller.load_path(self.directory.path)
+        index = self.controller.get_help_index()
+        entry = index.get_command("executable")
+        self.assertEquals((entry.kind, entry.path), (EXECUTABLE, path))
+        entry = index.get_topic("test-topic")
+        self.assertEquals((entry.kind, entry.path), (TOPIC, topic_path))
+
+    def test_get_source_path(self):
+        """
+        L{CommandController.get_source_path} returns the path of the file a
+        Python command was loaded from.
+        """
+        content = """\
+from bzrlib.commands import Command
+
+class cmd_test_command(Command):
+    def run(self):
+        pass
+"""
+        path = os.path.join(self.directory.path, "test_command.py")
+        self.directory.make_path(content=content, path=path)
+        self.controller.load_path(self.directory.path)
+        entry = self.controller.get_help_index().get_command("test-command")
+        self.assertEquals(entry.path, path)
+
+    def test_get_help_index_with_options(self):
+        """
+        Entries for Python commands include their options and argument
+        placeholders.  Entries for executables don't.
+        """
+
+        class ArgumentCommand(FakeCommand):
+            takes_args = ["topic?"]
+
+        self.controller.register_command("argument-command", ArgumentCommand)
+        path = os.path.join(self.directory.path, "executable")
+        self.directory.make_path(content="executable file", path=path)
+        os.chmod(path, stat.S_IEXEC)
+        self.controller.load_path(self.directory.path)
+        index = self.controller.get_help_index()
+        entry = index.get_command("argument-command")
+        self.assertTrue("--help" in entry.options)
+        self.assertEquals(entry.arguments, ["[TOPIC]"])
+        entry = index.get_command("executable")
+        self.assertEquals((entry.options, entry.arguments), ([], []))
+
+    def test_load_summaries(self):
+        """
+        L{CommandController.load_summaries} loads summaries for index entries
+        from a help topic with the same name, or from the command.
+        """
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.register_command("other-command", FakeCommand)
+        self.controller.register_help_topic("other-command", FakeHelpTopic)
+        entries = self.controller.get_help_index().get_commands()
+        self.assertEquals([entry.summary for entry in entries], [None, None])
+        self.controller.load_summaries(entries)
+        self.assertEquals([entry.summary for entry in entries],
+                          ["Summary text.", "A fake summary!"])
+
+    def test_register_updates_help_index(self):
+        """Registering a name again updates its entry in the index."""
+        self.controller.register_command("fake-command", FakeCommand)
+        entries = self.controller.get_help_index().get_commands()
+        self.controller.load_summaries(entries)
+        self.controller.register_help_topic("fake-command", FakeHelpTopic)
+        entries = self.controller.get_help_index().get_commands()
+        self.controller.load_summaries(entries)
+        self.assertEquals([entry.summary for entry in entries],
+                          ["A fake summary!"])
+
+    def register_slow_topics(self, count, delay=0.05):
+        """
+        Register C{count} text file help topics that take C{delay} seconds
+        to read, as they might on a slow network filesystem.
+
+        @return: A C{dict} with the number of files read at once in
+            C{"active"} and the most files read at once in C{"maximum"}.
+        """
+        lock = threading.Lock()
+        state = {"active": 0, "maximum": 0}
+
+        class SlowFileHelpTopic(FileHelpTopic):
+
+            def _load_summary(self):
+                lock.acquire()
+                try:
+                    state["active"] += 1
+                    state["maximum"] = max(state["maximum"], state["active"])
+                finally:
+                    lock.release()
+                time.sleep(delay)
+                try:
+                    return super(SlowFileHelpTopic, self)._load_summary()
+                finally:
+                    lock.acquire()
+                    try:
+                        state["active"] -= 1
+                    finally:
+                        lock.release()
+
+        for i in range(count):
+            name = "topic-%d" % (i,)
+            path = os.path.join(self.directory.path, "%s.txt" % (name,))
+            self.directory.make_path(content="Summary %d." % (i,), path=path)
+            self.controller.register_help_topic(
+                name, type("Topic", (SlowFileHelpTopic,), {"path": path}))
+        return state
+
+    def test_load_summaries_concurrently(self):
+        """
+        L{CommandController.load_summaries} reads summaries with up to
+        C{summary_workers} threads at once and keeps entries in order.
+        """
+        state = self.register_slow_topics(6)
+        self.controller.summary_workers = 3
+        entries = self.controller.get_help_index().get_topics()
+        self.controller.load_summaries(entries)
+        self.assertEquals([entry.summary for entry in entries],
+                          ["Summary %d." % (i,) for i in range(6)])
+        self.assertTrue(1 < state["maximum"] <= 3, state["maximum"])
+
+    def test_load_summaries_with_one_worker(self):
+        """Summaries are read one at a time with a single worker."""
+        state = self.register_slow_topics(3, delay=0)
+        self.controller.summary_workers = 1
+        entries = self.controller.get_help_index().get_topics()
+        self.controller.load_summaries(entries)
+        self.assertEquals(state["maximum"], 1)
+        self.assertEquals([entry.summary for entry in entries],
+                          ["Summary 0.", "Summary 1.", "Summary 2."])
+
+    def test_load_summaries_inline(self):
+        """
+        Summaries that aren't read from files, like those of Python commands
+        and help topics, are loaded in the calling thread.
+        """
+        threads = []
+
+        class RecordingHelpTopic(FakeHelpTopic):
+
+            def get_summary(self):
+                threads.append(threading.currentThread())
+                return "Recorded."
+
+        for i in range(4):
+            self.controller.register_help_topic("topic-%d" % (i,),
+                                                RecordingHelpTopic)
+        self.controller.summary_workers = 3
+        entries = self.controller.get_help_index().get_topics()
+        self.controller.load_summaries(entries)
+        self.assertEquals([entry.summary for entry in entries],
+                          ["Recorded."] * 4)
+        self.assertEquals(set(threads), set([threading.currentThread()]))
+
+    def test_load_summaries_with_executables(self):
+        """
+        Summaries of executables don't come from files, so they're loaded in
+        the calling thread.
+        """
+        for i in range(4):
+            path = os.path.join(self.directory.path, "command-%d" % (i,))
+            self.directory.make_path(content="#!/bin/sh\n", path=path)
+            os.chmod(path, stat.S_IEXEC)
+        self.controller.load_path(self.directory.path)
+        threads = []
+        load_summary = self.controller._load_summary
+
+        def record_thread(entry):
+            threads.append(threading.currentThread())
+            return load_summary(entry)
+
+        self.controller._load_summary = record_thread
+        self.controller.summary_workers = 3
+        entries = self.controller.get_help_index().get_commands()
+        self.controller.load_summaries(entries)
+        self.assertEquals(len(threads), 4)
+        self.assertEquals(set(threads), set([threading.currentThread()]))
+
+    def test_load_summaries_with_error(self):
+        """An error loading a summary is raised by C{load_summaries}."""
+        self.register_slow_topics(3, delay=0)
+        os.unlink(os.path.join(self.directory.path, "topic-1.txt"))
+        entries = self.controller.get_help_index().get_topics()
+        self.assertRaises(IOError, self.controller.load_summaries, entries)
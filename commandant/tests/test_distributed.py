@@ -0,0 +1,190 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.distributed}."""
+
+from cStringIO import StringIO
+import os
+import sys
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, gatherResults
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+
+from commandant.distributed import WorkerFactory, Coordinator
+from commandant.errors import WorkerError
+
+
+class FakeController(object):
+    """A controller that echoes its arguments and standard input."""
+
+    def run(self, argv):
+        if argv[0] == "cat":
+            sys.stdout.write(sys.stdin.read())
+        elif argv[0] == "sleep":
+            sys.stdout.write("Sleeping\n")
+            sys.stdout.flush()
+            time.sleep(60)
+        elif argv[0] == "fail":
+            sys.stderr.write("Failed!\n")
+            return 3
+        else:
+            sys.stdout.write(" ".join(argv))
+
+
+class TrackingWorkerFactory(WorkerFactory):
+    """A L{WorkerFactory} that tracks when its connections are lost."""
+
+    def __init__(self, controller):
+        WorkerFactory.__init__(self, controller)
+        self.lost = []
+        self.protocols = []
+
+    def buildProtocol(self, address):
+        protocol = WorkerFactory.buildProtocol(self, address)
+        self.protocols.append(protocol)
+        lost = Deferred()
+        self.lost.append(lost)
+        connectionLost = protocol.connectionLost
+
+        def connection_lost(reason):
+            connectionLost(reason)
+            lost.callback(None)
+
+        protocol.connectionLost = connection_lost
+        return protocol
+
+
+class DistributedTest(TestCase):
+    """
+    Tests for L{Coordinator} and L{WorkerProtocol} using several workers on
+    the loopback interface.
+    """
+
+    def setUp(self):
+        self.factories = []
+        self.coordinator = Coordinator()
+        deferreds = []
+        for i in range(2):
+            factory = TrackingWorkerFactory(FakeController())
+            self.factories.append(factory)
+            port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+            self.addCleanup(port.stopListening)
+            deferreds.append(
+                self.coordinator.connect("127.0.0.1", port.getHost().port))
+        return gatherResults(deferreds)
+
+    def tearDown(self):
+        self.coordinator.disconnect()
+        lost = []
+        for factory in self.factories:
+            lost.extend(factory.lost)
+        return DeferredList(lost)
+
+    def test_run(self):
+        """
+        L{Coordinator.run} runs a command on a worker, streams its output
+        back and fires with its exit status.
+        """
+        outf = StringIO()
+        deferred = self.coordinator.run([u"echo", u"Hello", u"world!"], outf)
+
+        def check(status):
+            self.assertEquals(status, 0)
+            self.assertEquals(outf.getvalue(), "echo Hello world!")
+
+        return deferred.addCallback(check)
+
+    def test_run_with_failure(self):
+        """Standard error and a non-zero exit status are passed back."""
+        outf = StringIO()
+        errf = StringIO()
+        deferred = self.coordinator.run([u"fail"], outf, errf)
+
+        def check(status):
+            self.assertEquals(status, 3)
+            self.assertEquals(outf.getvalue(), "")
+            self.assertEquals(errf.getvalue(), "Failed!\n")
+
+        return deferred.addCallback(check)
+
+    def test_run_with_stdin(self):
+        """Standard input is streamed to the command in chunks."""
+        data = "x" * 100000
+        outf = StringIO()
+        deferred = self.coordinator.run([u"cat"], outf, stdin=StringIO(data))
+
+        def check(status):
+            self.assertEquals(status, 0)
+            self.assertEquals(outf.getvalue(), data)
+
+        return deferred.addCallback(check)
+
+    def test_run_distributes_commands(self):
+        """Concurrent commands are spread across the connected workers."""
+        outfs = [StringIO() for i in range(4)]
+        deferreds = [self.coordinator.run([u"echo", unicode(i)], outf)
+                     for i, outf in enumerate(outfs)]
+        workers = self.coordinator._workers
+        self.assertEquals([worker.running for worker in workers], [2, 2])
+
+        def check(statuses):
+            self.assertEquals(statuses, [0, 0, 0, 0])
+            self.assertEquals([outf.getvalue() for outf in outfs],
+                              ["echo 0", "echo 1", "echo 2", "echo 3"])
+
+        return gatherResults(deferreds).addCallback(check)
+
+    def test_run_without_workers(self):
+        """A L{WorkerError} is raised if there aren't any workers."""
+        coordinator = Coordinator()
+        return self.assertFailure(coordinator.run([u"echo"]), WorkerError)
+
+    def test_connection_lost_kills_children(self):
+        """
+        Commands still running when the coordinator disconnects are
+        terminated and reaped.
+        """
+        started = Deferred()
+
+        class Output(object):
+
+            def write(self, data):
+                if not started.called:
+                    started.callback(None)
+
+        running = self.coordinator.run([u"sleep"], Output())
+        running.addErrback(lambda failure: None)
+
+        def disconnect(ignored):
+            pids = [child.pid for factory in self.factories
+                    for protocol in factory.protocols
+                    for child in protocol._jobs.values()]
+            self.assertEquals(len(pids), 1)
+            self.coordinator.disconnect()
+            return wait_for_exit(pids[0])
+
+        def wait_for_exit(pid):
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                return None
+            return deferLater(reactor, 0.01, wait_for_exit, pid)
+
+        return started.addCallback(disconnect)
@@ -17,18 +17,24 @@
 
 """Unit tests for L{commandant.entry_point}."""
 
+import json
 import os
+from StringIO import StringIO
 import sys
 
 from bzrlib.errors import BzrCommandError
-from bzrlib.commands import all_command_names
+from bzrlib.commands import all_command_names, Command
 
 from testresources import ResourcedTestCase
+from testtools import TestCase
 
+from commandant.completion import complete_from_cache, get_index_path
 from commandant.errors import UsageError
-from commandant.entry_point import main
+from commandant.controller import CommandController
+from commandant.entry_point import main, print_alias_conflicts, write_trace
 from commandant.testing.resources import (
     TemporaryDirectoryResource, BzrlibHooksResource, StdoutResource)
+from commandant.timing import Timer
 
 
 class MainTest(ResourcedTestCase):
@@ -101,10 +107,238 @@ class cmd_test_command(Command):
         main(["commandant", self.directory.path, "test-command"])
         self.assertEquals(open(hello_path).read(), "Hello, world!")
 
+    def test_exit_status(self):
+        """
+        The value returned by the command is returned, so it can be used as
+        the exit status of the process.  A graph with a failing node exits
+        with a non-zero status.
+        """
+        self.set_completion_directory()
+        command_path = self.directory.make_dir()
+        self.directory.make_path(
+            "from bzrlib.commands import Command\n"
+            "class cmd_fail(Command):\n"
+            "    def run(self):\n"
+            "        return 3\n",
+            os.path.join(command_path, "fail.py"))
+        graph_path = os.path.join(self.directory.make_dir(), "graph.json")
+        self.directory.make_path(
+            json.dumps([{"name": "fail", "command": ["fail"]}]), graph_path)
+        self.assertEquals(main(["commandant", command_path, "fail"]), 3)
+        self.assertEquals(
+            main(["commandant", command_path, "run-graph", graph_path]), 1)
+
     def test_install_bzr_hooks(self):
         """
         L{CommandController.install_bzrlib_hooks} is called to hook the
         controller into C{bzrlib}.
         """
         main(["commandant", self.directory.path, "version"])
-        self.assertEquals(all_command_names(), set(["help", "version"]))
+        self.assertEquals(all_command_names(),
+                          set(["complete", "completion-script", "help",
+                               "queue", "run-graph", "schedule", "search",
+                               "version", "worker"]))
+
+    def set_completion_directory(self):
+        """
+        Set C{COMMANDANT_COMPLETION_CACHE} to a temporary directory for the
+        rest of the test.
+
+        @return: The path to the directory.
+        """
+        original_directory = os.environ.get("COMMANDANT_COMPLETION_CACHE")
+
+        def restore_directory():
+            if original_directory is None:
+                os.environ.pop("COMMANDANT_COMPLETION_CACHE", None)
+            else:
+                os.environ["COMMANDANT_COMPLETION_CACHE"] = original_directory
+
+        self.addCleanup(restore_directory)
+        directory = self.directory.make_dir()
+        os.environ["COMMANDANT_COMPLETION_CACHE"] = directory
+        return directory
+
+    def test_complete(self):
+        """
+        The C{complete} command prints candidates and caches the names they
+        were drawn from.
+        """
+        completion_directory = self.set_completion_directory()
+        command_path = self.directory.make_dir()
+        main(["commandant", command_path, "complete", "--", "he"])
+        self.assertEquals(sys.stdout.getvalue(), "help\n")
+        self.assertEquals(
+            sorted(os.listdir(completion_directory)),
+            sorted(os.path.basename(path) for path in [
+                get_index_path(completion_directory, [command_path]),
+                get_index_path(completion_directory, [command_path],
+                               "trie.json")]))
+
+    def test_complete_from_cache(self):
+        """
+        Completions are answered from the cached index without loading
+        commands while the command directory is unchanged.
+        """
+        completion_directory = self.set_completion_directory()
+        command_path = self.directory.make_dir()
+        main(["commandant", command_path, "complete", "--", ""])
+        index_path = get_index_path(completion_directory, [command_path])
+        data = json.load(open(index_path))
+        data["commands"] = ["cached-command"]
+        json.dump(data, open(index_path, "w"))
+        sys.stdout.truncate(0)
+        main(["commandant", command_path, "complete", "--", "ca"])
+        self.assertEquals(sys.stdout.getvalue(), "cached-command\n")
+
+    def test_complete_with_changed_directory(self):
+        """
+        The cached index isn't used after the command directory changes.
+        """
+        completion_directory = self.set_completion_directory()
+        command_path = self.directory.make_dir()
+        main(["commandant", command_path, "complete", "--", "te"])
+        self.assertNotEquals(
+            complete_from_cache(completion_directory, [command_path], ["te"]),
+            None)
+        self.directory.make_path("A test topic.",
+                                 os.path.join(command_path, "test-topic.txt"))
+        self.assertEquals(
+            complete_from_cache(completion_directory, [command_path], ["te"]),
+            None)
+
+    def set_abbreviations(self):
+        """Set C{COMMANDANT_ABBREVIATIONS} for the rest of the test."""
+        original_value = os.environ.get("COMMANDANT_ABBREVIATIONS")
+
+        def restore_value():
+            if original_value is None:
+                os.environ.pop("COMMANDANT_ABBREVIATIONS", None)
+            else:
+                os.environ["COMMANDANT_ABBREVIATIONS"] = original_value
+
+        self.addCleanup(restore_value)
+        os.environ["COMMANDANT_ABBREVIATIONS"] = "1"
+
+    def test_abbreviated_command(self):
+        """
+        Command names can be abbreviated when C{COMMANDANT_ABBREVIATIONS} is
+        set.  The trie used to resolve them is cached for later runs.
+        """
+        completion_directory = self.set_completion_directory()
+        self.set_abbreviations()
+        command_path = self.directory.make_dir()
+        main(["commandant", command_path, "vers"])
+        self.assertIn("commandant", sys.stdout.getvalue())
+        self.assertTrue(os.path.exists(
+            get_index_path(completion_directory, [command_path],
+                           "trie.json")))
+
+
+    def set_environment_variable(self, name, value):
+        """Set an environment variable until the test finishes."""
+        original_value = os.environ.get(name)
+
+        def restore_value():
+            if original_value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = original_value
+
+        self.addCleanup(restore_value)
+        os.environ[name] = value
+
+    def test_timing(self):
+        """
+        A breakdown of the time spent in each phase of the run is written to
+        C{stderr} when C{COMMANDANT_TIMING} is set, including the time spent
+        importing each command module.
+        """
+        self.set_environment_variable("COMMANDANT_TIMING", "1")
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = StringIO()
+        self.set_completion_directory()
+        command_path = self.directory.make_dir()
+        self.directory.make_path(
+            "from bzrlib.commands import Command\n"
+            "class cmd_hello(Command):\n"
+            "    def run(self):\n"
+            "        pass\n",
+            os.path.join(command_path, "hello.py"))
+        main(["commandant", command_path, "hello"])
+        phases = [line[23:].strip()
+                  for line in sys.stderr.getvalue().splitlines()[1:]]
+        for phase in ["import bzrlib", "import Twisted", "import commandant",
+                      "load builtins", "load path", "import hello.py",
+                      "install bzrlib hooks", "dispatch and parse options",
+                      "run hello", "total"]:
+            self.assertIn(phase, phases)
+
+    def test_trace(self):
+        """
+        The phases of the run are written as a Chrome trace to the file
+        named by C{COMMANDANT_TRACE}, without a breakdown on C{stderr}.
+        """
+        trace_path = os.path.join(self.directory.make_dir(), "trace.json")
+        self.set_environment_variable("COMMANDANT_TRACE", trace_path)
+        self.addCleanup(setattr, sys, "stderr", sys.stderr)
+        sys.stderr = StringIO()
+        self.set_completion_directory()
+        main(["commandant", self.directory.make_dir(), "help"])
+        self.assertEquals(sys.stderr.getvalue(), "")
+        trace = json.load(open(trace_path))
+        names = [event["name"] for event in trace["traceEvents"]
+                 if event["ph"] == "X"]
+        for name in ["import bzrlib", "load builtins", "install bzrlib hooks",
+                     "dispatch and parse options", "run help"]:
+            self.assertIn(name, names)
+
+
+class WriteTraceTest(ResourcedTestCase):
+    """Tests for L{write_trace}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_write_trace(self):
+        """The trace is written to the file at the given path."""
+        path = os.path.join(self.directory.make_dir(), "trace.json")
+        stream = StringIO()
+        write_trace(Timer(), path, stream)
+        self.assertEquals(json.load(open(path))["displayTimeUnit"], "ms")
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_write_trace_fails(self):
+        """A warning is written if the trace file can't be written."""
+        path = os.path.join(self.directory.make_dir(), "missing", "trace")
+        stream = StringIO()
+        write_trace(Timer(), path, stream)
+        self.assertEquals(
+            stream.getvalue(),
+            "commandant: warning: can't write trace to %s: "
+            "No such file or directory\n" % (path,))
+
+
+class PrintAliasConflictsTest(TestCase):
+    """Tests for L{print_alias_conflicts}."""
+
+    def test_print_alias_conflicts(self):
+        """A warning is printed for each alias conflict."""
+
+        class FirstCommand(Command):
+            aliases = ["f", "other"]
+
+        class SecondCommand(Command):
+            aliases = ["f"]
+
+        controller = CommandController()
+        controller.register_command("first", FirstCommand)
+        controller.register_command("second", SecondCommand)
+        controller.register_command("other", Command)
+        stream = StringIO()
+        print_alias_conflicts(controller, stream)
+        self.assertEquals(
+            stream.getvalue(),
+            "commandant: warning: f is an alias of both first and second; "
+            "second is run.\n"
+            "commandant: warning: other is a command and an alias of first; "
+            "the command is run.\n")
@@ -0,0 +1,345 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.graph}."""
+
+from cStringIO import StringIO
+import json
+import os
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant.errors import GraphError
+from commandant.graph import (
+    GraphNode, CommandGraph, GraphState, GraphRunner, load_graph,
+    SUCCEEDED, FAILED, SKIPPED, CANCELLED)
+from commandant.output import OutputMultiplexer, PREFIX
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+class CommandGraphTest(TestCase):
+    """Tests for L{CommandGraph}."""
+
+    def test_get_sorted_names(self):
+        """
+        L{CommandGraph.get_sorted_names} returns node names in an order that
+        respects their requirements.
+        """
+        graph = CommandGraph()
+        graph.add_node(GraphNode("deploy", ["deploy"], ["build", "test"]))
+        graph.add_node(GraphNode("test", ["test"], ["build"]))
+        graph.add_node(GraphNode("build", ["build"]))
+        self.assertEquals(graph.get_sorted_names(),
+                          ["build", "test", "deploy"])
+
+    def test_duplicate_node(self):
+        """A L{GraphError} is raised if two nodes have the same name."""
+        graph = CommandGraph()
+        graph.add_node(GraphNode("build", ["build"]))
+        self.assertRaises(GraphError, graph.add_node,
+                          GraphNode("build", ["make"]))
+
+    def test_validate_with_unknown_requirement(self):
+        """A L{GraphError} is raised if a node requires an unknown node."""
+        graph = CommandGraph()
+        graph.add_node(GraphNode("deploy", ["deploy"], ["build"]))
+        self.assertRaises(GraphError, graph.validate)
+
+    def test_validate_with_cycle(self):
+        """A L{GraphError} is raised if the graph has a cycle."""
+        graph = CommandGraph()
+        graph.add_node(GraphNode("a", ["a"], ["b"]))
+        graph.add_node(GraphNode("b", ["b"], ["a"]))
+        self.assertRaises(GraphError, graph.validate)
+
+    def test_get_priorities(self):
+        """
+        The priority of a node is the expected duration of the longest chain
+        of nodes starting with it.
+        """
+        graph = CommandGraph()
+        graph.add_node(GraphNode("build", ["build"]))
+        graph.add_node(GraphNode("lint", ["lint"]))
+        graph.add_node(GraphNode("test", ["test"], ["build"]))
+        priorities = graph.get_priorities(
+            {"build": 2.0, "lint": 5.0, "test": 4.0})
+        self.assertEquals(priorities,
+                          {"build": 6.0, "lint": 5.0, "test": 4.0})
+
+    def test_get_priorities_without_durations(self):
+        """
+        Nodes without a recorded duration are assumed to take the average of
+        the known durations.
+        """
+        graph = CommandGraph()
+        graph.add_node(GraphNode("build", ["build"]))
+        graph.add_node(GraphNode("lint", ["lint"]))
+        graph.add_node(GraphNode("test", ["test"], ["build"]))
+        priorities = graph.get_priorities({"build": 2.0, "lint": 4.0})
+        self.assertEquals(priorities["build"], 5.0)
+
+
+class CommandGraphFingerprintTest(ResourcedTestCase):
+    """Tests for L{CommandGraph.get_fingerprint}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_without_inputs(self):
+        """Nodes without inputs don't have a fingerprint."""
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"]))
+        self.assertEquals(graph.get_fingerprint("build"), None)
+
+    def test_fingerprint_changes_with_inputs(self):
+        """The fingerprint changes when the content of an input changes."""
+        path = os.path.join(self.directory.path, "source.txt")
+        self.directory.make_path("version 1", path)
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"], inputs=["source.txt"]))
+        fingerprint = graph.get_fingerprint("build")
+        self.assertEquals(graph.get_fingerprint("build"), fingerprint)
+        self.directory.make_path("version 2", path)
+        self.assertNotEquals(graph.get_fingerprint("build"), fingerprint)
+
+    def test_unreadable_input(self):
+        """A L{GraphError} is raised if an input can't be read."""
+        source = os.path.join(self.directory.path, "src")
+        os.mkdir(source)
+        os.symlink(os.path.join(source, "missing"),
+                   os.path.join(source, "broken"))
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"], inputs=["src"]))
+        self.assertRaises(GraphError, graph.get_fingerprint, "build")
+
+
+class LoadGraphTest(ResourcedTestCase):
+    """Tests for L{load_graph}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_load_graph(self):
+        """L{load_graph} creates a L{CommandGraph} from a JSON file."""
+        path = self.directory.make_path(json.dumps([
+            {"name": "build", "command": ["build", "--fast"],
+             "inputs": ["src"]},
+            {"name": "deploy", "command": ["deploy"], "requires": ["build"]}]))
+        graph = load_graph(path)
+        self.assertEquals(graph.get_node_names(), set(["build", "deploy"]))
+        self.assertEquals(graph.get_node("build").argv, ["build", "--fast"])
+        self.assertEquals(graph.get_node("build").inputs, ["src"])
+        self.assertEquals(graph.get_node("deploy").requires, ["build"])
+        self.assertEquals(graph.base_path, self.directory.path)
+
+    def test_load_graph_with_invalid_json(self):
+        """A L{GraphError} is raised if the file can't be parsed."""
+        path = self.directory.make_path("[")
+        self.assertRaises(GraphError, load_graph, path)
+
+    def test_load_missing_graph(self):
+        """A L{GraphError} is raised if the file can't be read."""
+        path = os.path.join(self.directory.path, "missing.json")
+        self.assertRaises(GraphError, load_graph, path)
+
+    def test_load_graph_without_command(self):
+        """A L{GraphError} is raised if a node doesn't have a command."""
+        path = self.directory.make_path(json.dumps([{"name": "build"}]))
+        self.assertRaises(GraphError, load_graph, path)
+
+
+class GraphStateTest(ResourcedTestCase):
+    """Tests for L{GraphState}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_save_and_load(self):
+        """Durations and fingerprints are persisted between runs."""
+        path = self.directory.make_path()
+        state = GraphState(path)
+        state.record_success("build", 3.5, "abc")
+        state.save()
+        state = GraphState(path)
+        state.load()
+        self.assertEquals(state.get_durations(), {"build": 3.5})
+        self.assertTrue(state.is_unchanged("build", "abc"))
+        self.assertFalse(state.is_unchanged("build", "def"))
+
+    def test_record_failure(self):
+        """A failed run forgets the fingerprint of the last successful run."""
+        state = GraphState()
+        state.record_success("build", 3.5, "abc")
+        state.record_failure("build")
+        self.assertFalse(state.is_unchanged("build", "abc"))
+
+
+class FakeController(object):
+    """A controller that records the commands it runs in a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def run(self, argv):
+        file = open(self.path, "a")
+        try:
+            file.write("%s\n" % (" ".join(argv),))
+        finally:
+            file.close()
+        if argv[0] == "fail":
+            return 3
+
+
+class GraphRunnerTest(ResourcedTestCase):
+    """Tests for L{GraphRunner}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def setUp(self):
+        super(GraphRunnerTest, self).setUp()
+        self.log_path = self.directory.make_path()
+        self.controller = FakeController(self.log_path)
+
+    def get_log(self):
+        """Get the commands run by the L{FakeController}."""
+        return open(self.log_path).read().splitlines()
+
+    def test_run(self):
+        """Nodes are run in an order that respects their requirements."""
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("deploy", ["deploy"], ["test"]))
+        graph.add_node(GraphNode("test", ["test"], ["build"]))
+        graph.add_node(GraphNode("build", ["build"]))
+        runner = GraphRunner(self.controller, graph, GraphState(), jobs=4)
+        self.assertEquals(runner.run(), {"build": SUCCEEDED,
+                                         "test": SUCCEEDED,
+                                         "deploy": SUCCEEDED})
+        self.assertEquals(self.get_log(), ["build", "test", "deploy"])
+
+    def test_run_starts_critical_path_first(self):
+        """
+        When more nodes are ready than there are jobs, the node at the head
+        of the longest critical path is started first.
+        """
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("a", ["a"]))
+        graph.add_node(GraphNode("b", ["b"]))
+        graph.add_node(GraphNode("c", ["c"], ["b"]))
+        state = GraphState()
+        state.record_success("a", 5.0, None)
+        state.record_success("b", 2.0, None)
+        state.record_success("c", 4.0, None)
+        runner = GraphRunner(self.controller, graph, state, jobs=1)
+        runner.run()
+        self.assertEquals(self.get_log(), ["b", "a", "c"])
+
+    def test_run_with_failure(self):
+        """Nodes that require a failed node are cancelled."""
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["fail"]))
+        graph.add_node(GraphNode("deploy", ["deploy"], ["build"]))
+        graph.add_node(GraphNode("lint", ["lint"]))
+        runner = GraphRunner(self.controller, graph, GraphState())
+        self.assertEquals(runner.run(), {"build": FAILED,
+                                         "deploy": CANCELLED,
+                                         "lint": SUCCEEDED})
+        self.assertNotIn("deploy", self.get_log())
+
+    def test_run_skips_unchanged_nodes(self):
+        """
+        Nodes whose inputs haven't changed since their last successful run
+        are skipped.  Nodes that require a skipped node are only run if they
+        have changed, too.
+        """
+        path = os.path.join(self.directory.path, "source.txt")
+        self.directory.make_path("version 1", path)
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"], inputs=["source.txt"]))
+        graph.add_node(GraphNode("deploy", ["deploy"], ["build"],
+                                 inputs=["source.txt"]))
+        state = GraphState()
+        GraphRunner(self.controller, graph, state).run()
+        self.assertEquals(GraphRunner(self.controller, graph, state).run(),
+                          {"build": SKIPPED, "deploy": SKIPPED})
+        self.assertEquals(self.get_log(), ["build", "deploy"])
+
+    def test_run_computes_fingerprints_once(self):
+        """Each node's fingerprint is computed once per run."""
+        path = os.path.join(self.directory.path, "source.txt")
+        self.directory.make_path("version 1", path)
+        calls = []
+
+        class CountingGraph(CommandGraph):
+
+            def get_fingerprint(self, name):
+                calls.append(name)
+                return CommandGraph.get_fingerprint(self, name)
+
+        graph = CountingGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"], inputs=["source.txt"]))
+        graph.add_node(GraphNode("test", ["test"], ["build"],
+                                 inputs=["source.txt"]))
+        graph.add_node(GraphNode("lint", ["lint"], inputs=["source.txt"]))
+        GraphRunner(self.controller, graph, GraphState(), jobs=1).run()
+        self.assertEquals(sorted(calls), ["build", "lint", "test"])
+
+    def test_run_with_unreadable_input(self):
+        """
+        A node whose inputs can't be read fails, and nodes that require it
+        are cancelled.
+        """
+        source = os.path.join(self.directory.path, "src")
+        os.mkdir(source)
+        os.symlink(os.path.join(source, "missing"),
+                   os.path.join(source, "broken"))
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"], inputs=["src"]))
+        graph.add_node(GraphNode("deploy", ["deploy"], ["build"]))
+        runner = GraphRunner(self.controller, graph, GraphState())
+        self.assertEquals(runner.run(), {"build": FAILED,
+                                         "deploy": CANCELLED})
+        self.assertFalse(os.path.exists(self.log_path))
+
+    def test_run_with_force(self):
+        """Unchanged nodes are run if C{force} is C{True}."""
+        path = os.path.join(self.directory.path, "source.txt")
+        self.directory.make_path("version 1", path)
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"], inputs=["source.txt"]))
+        state = GraphState()
+        GraphRunner(self.controller, graph, state).run()
+        GraphRunner(self.controller, graph, state, force=True).run()
+        self.assertEquals(self.get_log(), ["build", "build"])
+
+    def test_run_with_multiplexer(self):
+        """Output from nodes is collected by an L{OutputMultiplexer}."""
+
+        class EchoController(object):
+
+            def run(self, argv):
+                print "Output from %s" % (argv[0],)
+
+        outf = StringIO()
+        graph = CommandGraph(self.directory.path)
+        graph.add_node(GraphNode("build", ["build"]))
+        graph.add_node(GraphNode("deploy", ["deploy"], ["build"]))
+        multiplexer = OutputMultiplexer(outf, PREFIX)
+        runner = GraphRunner(EchoController(), graph, GraphState(),
+                             multiplexer=multiplexer)
+        runner.run()
+        self.assertEquals(outf.getvalue(), """\
+build: Output from build
+deploy: Output from deploy
+""")
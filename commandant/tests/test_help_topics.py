@@ -18,6 +18,7 @@
 """Unit tests for L{commandant.help_topics}."""
 
 import doctest
+import json
 import os
 from textwrap import dedent
 
@@ -25,11 +26,15 @@ from testresources import ResourcedTestCase
 from testtools import TestCase
 from testtools.matchers import DocTestMatches
 
+from commandant.cache import LRUCache
+from commandant.controller import CommandController
 from commandant.help_topics import (
-    HelpTopic, DocstringHelpTopic, FileHelpTopic, CommandHelpTopic)
+    HelpTopic, DocstringHelpTopic, FileHelpTopic, CommandHelpTopic,
+    ListingHelpTopic, JSONL, TSV, LISTING_BATCH_SIZE)
+from commandant.index import IndexEntry, COMMAND, EXECUTABLE, TOPIC
 from commandant.testing.basic import CommandantTestCase
 from commandant.testing.resources import (
-    TemporaryDirectoryResource, CommandFactoryResource)
+    TemporaryDirectoryResource, CommandFactoryResource, FakeCommand)
 
 
 class HelpTopicTest(TestCase):
@@ -43,6 +48,77 @@ class HelpTopicTest(TestCase):
         self.assertRaises(NotImplementedError, help_topic.get_summary)
         self.assertRaises(NotImplementedError, help_topic.get_text)
 
+    def test_iter_text(self):
+        """
+        L{HelpTopic.iter_text} yields the stripped result of
+        L{HelpTopic.get_text} by default.
+        """
+
+        class TestHelpTopic(HelpTopic):
+
+            def get_text(self):
+                return "\nSome text.\n\n"
+
+        self.assertEquals(list(TestHelpTopic().iter_text()), ["Some text."])
+
+
+class ListingHelpTopicTest(TestCase):
+    """Tests for L{ListingHelpTopic}."""
+
+    def create_help_topic(self, entries, format):
+        """Create a L{ListingHelpTopic} that lists C{entries}."""
+
+        class FakeListingController(object):
+
+            def load_summaries(self, entries):
+                for entry in entries:
+                    if entry.summary is None:
+                        entry.summary = "Summary of %s." % (entry.name,)
+
+        class TestListingHelpTopic(ListingHelpTopic):
+
+            def get_entries(self):
+                return entries
+
+        help_topic = TestListingHelpTopic()
+        help_topic.controller = FakeListingController()
+        help_topic.format = format
+        return help_topic
+
+    def test_iter_text_with_jsonl_format(self):
+        """Each entry is a JSON object on its own line in C{jsonl} format."""
+        help_topic = self.create_help_topic(
+            [IndexEntry("a", COMMAND, path="/a"),
+             IndexEntry("b", EXECUTABLE, hidden=True)], JSONL)
+        lines = "".join(help_topic.iter_text()).split("\n")
+        self.assertEquals(
+            [json.loads(line) for line in lines],
+            [{"name": "a", "summary": "Summary of a.", "kind": COMMAND,
+              "hidden": False, "path": "/a"},
+             {"name": "b", "summary": "Summary of b.", "kind": EXECUTABLE,
+              "hidden": True, "path": None}])
+
+    def test_iter_text_with_tsv_format(self):
+        """
+        Each entry is a line of tab-separated fields in C{tsv} format.  Tabs
+        and newlines in fields are replaced with spaces.
+        """
+        help_topic = self.create_help_topic(
+            [IndexEntry("a", TOPIC, summary="A\tsummary\nof a.")], TSV)
+        self.assertEquals(help_topic.get_text(),
+                          "a\tA summary of a.\ttopic\tfalse\t")
+
+    def test_iter_text_loads_summaries_in_batches(self):
+        """Summaries are loaded for a batch of entries at a time."""
+        entries = [IndexEntry("entry-%03d" % (i,), COMMAND)
+                   for i in range(LISTING_BATCH_SIZE + 1)]
+        help_topic = self.create_help_topic(entries, TSV)
+        chunks = help_topic.iter_text()
+        chunks.next()
+        self.assertEquals(entries[LISTING_BATCH_SIZE - 1].summary,
+                          "Summary of entry-%03d." % (LISTING_BATCH_SIZE - 1,))
+        self.assertEquals(entries[LISTING_BATCH_SIZE].summary, None)
+
 
 class DocstringHelpTopicTest(TestCase):
 
@@ -101,6 +177,157 @@ All remaining content makes up the long descriptive text for the help topic.
             "All remaining content makes up the long descriptive text for "
             "the help topic.")
 
+    def test_get_summary_reads_first_line(self):
+        """
+        L{FileHelpTopic.get_summary} only reads the first line of the file,
+        leaving the text content to be loaded when it's needed.
+        """
+        content = "A short summary.\n\n%s" % ("Long text.\n" * 10000,)
+        help_topic_path = os.path.join(self.directory.path, "test-topic.txt")
+        self.directory.make_path(content=content, path=help_topic_path)
+        help_topic = FileHelpTopic()
+        help_topic.path = help_topic_path
+        self.assertEquals(help_topic.get_summary(), "A short summary.")
+        self.assertEquals(help_topic._text, None)
+        self.assertTrue(help_topic.get_text().startswith("Long text."))
+
+    def test_get_help_contents_without_text(self):
+        """A file with only a summary line has empty text content."""
+        help_topic_path = os.path.join(self.directory.path, "test-topic.txt")
+        self.directory.make_path(content="A short summary.",
+                                 path=help_topic_path)
+        help_topic = FileHelpTopic()
+        help_topic.path = help_topic_path
+        self.assertEquals(help_topic.get_text(), "")
+        self.assertEquals(help_topic.get_summary(), "A short summary.")
+
+    def test_iter_text(self):
+        """
+        L{FileHelpTopic.iter_text} yields the text following the summary line
+        in chunks, stripped of surrounding whitespace.
+        """
+        content = "A short summary.\n\n\nLong text.\nMore text.\n  \n\n"
+        help_topic_path = os.path.join(self.directory.path, "test-topic.txt")
+        self.directory.make_path(content=content, path=help_topic_path)
+        help_topic = FileHelpTopic()
+        help_topic.path = help_topic_path
+        chunks = list(help_topic.iter_text(chunk_size=4))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals("".join(chunks), "Long text.\nMore text.")
+        self.assertEquals(help_topic._text, None)
+
+    def test_iter_text_without_text(self):
+        """
+        L{FileHelpTopic.iter_text} doesn't yield anything if the file only
+        contains whitespace after the summary line.
+        """
+        help_topic_path = os.path.join(self.directory.path, "test-topic.txt")
+        self.directory.make_path(content="A short summary.\n\n  \n",
+                                 path=help_topic_path)
+        help_topic = FileHelpTopic()
+        help_topic.path = help_topic_path
+        self.assertEquals(list(help_topic.iter_text(chunk_size=2)), [])
+
+    def test_iter_text_with_loaded_text(self):
+        """Text that has already been loaded isn't read again."""
+        help_topic_path = os.path.join(self.directory.path, "test-topic.txt")
+        self.directory.make_path(content="A short summary.\n\nLong text.",
+                                 path=help_topic_path)
+        help_topic = FileHelpTopic()
+        help_topic.path = help_topic_path
+        help_topic.get_text()
+        os.unlink(help_topic_path)
+        self.assertEquals(list(help_topic.iter_text()), ["Long text."])
+
+
+class FakeController(object):
+    """A controller with just a help cache."""
+
+    def __init__(self, budget=1024):
+        self.help_cache = LRUCache(budget)
+
+
+class HelpCacheTest(ResourcedTestCase):
+    """Tests for help topics that use their controller's help cache."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def create_file_help_topic(self, controller, content):
+        """Create a L{FileHelpTopic} for a file containing C{content}."""
+        path = os.path.join(self.directory.path, "test-topic.txt")
+        if not os.path.exists(path):
+            self.directory.make_path(content=content, path=path)
+        help_topic = FileHelpTopic()
+        help_topic.path = path
+        help_topic.controller = controller
+        return help_topic
+
+    def test_file_help_topic_text_is_cached(self):
+        """
+        L{FileHelpTopic}s for the same file share text through the help
+        cache.
+        """
+        controller = FakeController()
+        for i in range(2):
+            help_topic = self.create_file_help_topic(
+                controller, "A summary.\n\nLong text.")
+            self.assertEquals(help_topic.get_text(), "Long text.")
+            self.assertEquals(help_topic._text, None)
+        self.assertEquals((controller.help_cache.hits,
+                           controller.help_cache.misses), (1, 1))
+
+    def test_file_help_topic_reloads_changed_file(self):
+        """A change to the file's size changes its key in the help cache."""
+        controller = FakeController()
+        help_topic = self.create_file_help_topic(
+            controller, "A summary.\n\nLong text.")
+        help_topic.get_text()
+        open(help_topic.path, "w").write("A summary.\n\nChanged text.")
+        self.assertEquals(help_topic.get_text(), "Changed text.")
+
+    def test_file_help_topic_iter_text_is_cached(self):
+        """
+        L{FileHelpTopic.iter_text} adds text that fits in the help cache to
+        it and yields cached text without reading the file.
+        """
+        controller = FakeController()
+        help_topic = self.create_file_help_topic(
+            controller, "A summary.\n\nLong text.")
+        self.assertEquals("".join(help_topic.iter_text(chunk_size=2)),
+                          "Long text.")
+        self.assertEquals(controller.help_cache.get_size(), 10)
+        self.assertEquals(list(help_topic.iter_text()), ["Long text."])
+        self.assertEquals(controller.help_cache.hits, 1)
+
+    def test_file_help_topic_iter_text_over_budget(self):
+        """Text larger than the help cache's budget isn't cached."""
+        controller = FakeController(budget=5)
+        help_topic = self.create_file_help_topic(
+            controller, "A summary.\n\nLong text.")
+        self.assertEquals("".join(help_topic.iter_text(chunk_size=2)),
+                          "Long text.")
+        self.assertEquals(len(controller.help_cache), 0)
+
+    def test_docstring_help_topic_text_is_cached(self):
+        """
+        L{DocstringHelpTopic}s of the same class share text through the help
+        cache.
+        """
+
+        class TestHelpTopic(DocstringHelpTopic):
+            """A summary.
+
+            Long text.
+            """
+
+        controller = FakeController()
+        for i in range(2):
+            help_topic = TestHelpTopic()
+            help_topic.controller = controller
+            self.assertEquals(help_topic.get_text(), "Long text.")
+        self.assertEquals((controller.help_cache.hits,
+                           controller.help_cache.misses), (1, 1))
+
 
 class CommandHelpTopicTest(CommandantTestCase):
     """Tests for L{CommandHelpTopic}."""
@@ -142,6 +369,66 @@ class CommandHelpTopicTest(CommandantTestCase):
             DocTestMatches(expected, doctest.ELLIPSIS))
 
 
+class CommandHelpTopicCacheTest(CommandantTestCase):
+    """Tests for caching in L{CommandHelpTopic}."""
+
+    resources = [("factory", CommandFactoryResource())]
+
+    def setUp(self):
+        super(CommandHelpTopicCacheTest, self).setUp()
+        CommandHelpTopic.clear_cache()
+        self.addCleanup(CommandHelpTopic.clear_cache)
+        self.factory.controller.help_cache.clear()
+
+    def test_get_summary_without_generating_help_text(self):
+        """
+        L{CommandHelpTopic.get_summary} doesn't generate the command's full
+        help text.
+        """
+        command = self.factory.create_command("fake-command")
+
+        def get_help_text():
+            raise AssertionError("Help text shouldn't be generated.")
+
+        command.get_help_text = get_help_text
+        help_topic = CommandHelpTopic(command)
+        help_topic.controller = self.factory.controller
+        self.assertEquals(help_topic.get_summary(), "Summary text.")
+
+    def test_get_text_is_cached(self):
+        """
+        Help text is generated once per command class and shared by all
+        L{CommandHelpTopic}s for the command.
+        """
+        calls = []
+
+        class cmd_cached(FakeCommand):
+            """Summary text."""
+
+            def get_help_text(self, *args, **kwargs):
+                calls.append(True)
+                return "Help text for bzr."
+
+        for i in range(2):
+            command = self.factory.create_command("cached", cmd_cached)
+            help_topic = CommandHelpTopic(command)
+            help_topic.controller = self.factory.controller
+            self.assertEquals(help_topic.get_text(),
+                              "Help text for commandant.")
+        self.assertEquals(len(calls), 1)
+
+    def test_get_text_is_cached_per_program_name(self):
+        """Help text for different program names is cached separately."""
+        command = self.factory.create_command("fake-command")
+        command.get_help_text = lambda *args, **kwargs: "Usage: bzr"
+        help_topic = CommandHelpTopic(command)
+        help_topic.controller = self.factory.controller
+        self.assertEquals(help_topic.get_text(), "Usage: commandant")
+        help_topic = CommandHelpTopic(command)
+        help_topic.controller = CommandController("test-program")
+        self.assertEquals(help_topic.get_text(), "Usage: test-program")
+
+
 class CustomCommandHelpTopicTest(CommandantTestCase):
     """Tests for L{CommandHelpTopic} with custom program details."""
 
@@ -0,0 +1,233 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.index}."""
+
+import json
+
+from testtools import TestCase
+
+from commandant.index import (
+    BKTree, HelpIndex, IndexEntry, PrefixTrie, COMMAND, TOPIC,
+    get_edit_distance)
+
+
+class HelpIndexTest(TestCase):
+    """Tests for L{HelpIndex}."""
+
+    def setUp(self):
+        super(HelpIndexTest, self).setUp()
+        self.index = HelpIndex()
+
+    def test_get_commands(self):
+        """L{HelpIndex.get_commands} returns command entries sorted by name."""
+        self.index.set_command(IndexEntry("version", COMMAND))
+        self.index.set_command(IndexEntry("help", COMMAND))
+        self.assertEquals([entry.name for entry in self.index.get_commands()],
+                          ["help", "version"])
+
+    def test_get_topics(self):
+        """L{HelpIndex.get_topics} returns topic entries sorted by name."""
+        self.index.set_topic(IndexEntry("topics", TOPIC))
+        self.index.set_topic(IndexEntry("basic", TOPIC))
+        self.assertEquals([entry.name for entry in self.index.get_topics()],
+                          ["basic", "topics"])
+
+    def test_set_command_replaces_entry(self):
+        """An entry replaces an existing entry with the same name."""
+        self.index.set_command(IndexEntry("help", COMMAND, summary="Old."))
+        self.index.get_commands()
+        self.index.set_command(IndexEntry("help", COMMAND, summary="New."))
+        self.assertEquals(
+            [entry.summary for entry in self.index.get_commands()], ["New."])
+
+    def test_remove(self):
+        """L{HelpIndex.remove} removes command and topic entries."""
+        self.index.set_command(IndexEntry("help", COMMAND))
+        self.index.set_topic(IndexEntry("basic", TOPIC))
+        self.index.remove("help")
+        self.index.remove("basic")
+        self.assertEquals(self.index.get_commands(), [])
+        self.assertEquals(self.index.get_topics(), [])
+        self.assertEquals(self.index.get_command("help"), None)
+
+    def test_get_commands_with_hidden(self):
+        """Hidden or visible commands can be selected."""
+        self.index.set_command(IndexEntry("help", COMMAND))
+        self.index.set_command(IndexEntry("secret", COMMAND, hidden=True))
+        self.assertEquals(
+            [entry.name for entry in self.index.get_commands(hidden=True)],
+            ["secret"])
+        self.assertEquals(
+            [entry.name for entry in self.index.get_commands(hidden=False)],
+            ["help"])
+
+    def test_get_commands_with_prefix(self):
+        """Only commands with names starting with a prefix can be selected."""
+        for name in ["deploy", "deploy-all", "describe", "help", "de"]:
+            self.index.set_command(IndexEntry(name, COMMAND))
+        self.assertEquals(
+            [entry.name for entry in self.index.get_commands(prefix="dep")],
+            ["deploy", "deploy-all"])
+        self.assertEquals(
+            [entry.name for entry in self.index.get_commands(prefix="x")], [])
+
+    def test_get_commands_with_offset_and_limit(self):
+        """A page of commands can be selected with an offset and limit."""
+        for name in ["a", "b", "c", "d"]:
+            self.index.set_command(IndexEntry(name, COMMAND))
+        self.assertEquals(
+            [entry.name for entry
+             in self.index.get_commands(offset=1, limit=2)], ["b", "c"])
+        self.assertEquals(
+            [entry.name for entry in self.index.get_commands(offset=3)],
+            ["d"])
+        self.assertEquals(self.index.get_commands(offset=10), [])
+
+    def test_get_topics_with_prefix_offset_and_limit(self):
+        """Filters can be combined."""
+        for name in ["basic", "bar", "baz", "commands", "topics"]:
+            self.index.set_topic(IndexEntry(name, TOPIC))
+        self.assertEquals(
+            [entry.name for entry
+             in self.index.get_topics(prefix="ba", offset=1, limit=1)],
+            ["basic"])
+        self.assertEquals(
+            [entry.name for entry
+             in self.index.get_topics(prefix="ba", offset=2, limit=5)],
+            ["baz"])
+
+    def test_get_command_trie(self):
+        """
+        L{HelpIndex.get_command_trie} returns a L{PrefixTrie} of visible
+        command names, which is rebuilt after the index changes.
+        """
+        self.index.set_command(IndexEntry("help", COMMAND))
+        self.index.set_command(IndexEntry("hidden", COMMAND, hidden=True))
+        self.index.set_topic(IndexEntry("hello", TOPIC))
+        trie = self.index.get_command_trie()
+        self.assertTrue(self.index.get_command_trie() is trie)
+        self.assertEquals(trie.resolve("h"), ["help"])
+        self.index.set_command(IndexEntry("hello", COMMAND))
+        self.assertEquals(self.index.get_command_trie().resolve("h"),
+                          ["hello", "help"])
+
+
+class PrefixTrieTest(TestCase):
+    """Tests for L{PrefixTrie}."""
+
+    def setUp(self):
+        super(PrefixTrieTest, self).setUp()
+        self.trie = PrefixTrie(["deploy-service", "deploy", "describe",
+                                "help"])
+
+    def test_resolve_unique_prefix(self):
+        """A prefix of a single name resolves to that name."""
+        self.assertEquals(self.trie.resolve("h"), ["help"])
+        self.assertEquals(self.trie.resolve("deploy-"), ["deploy-service"])
+        self.assertEquals(self.trie.resolve("desc"), ["describe"])
+
+    def test_resolve_name(self):
+        """A name resolves to itself, even if it's a prefix of others."""
+        self.assertEquals(self.trie.resolve("deploy"), ["deploy"])
+        self.assertEquals(self.trie.resolve("help"), ["help"])
+
+    def test_resolve_ambiguous_prefix(self):
+        """An ambiguous prefix resolves to every name starting with it."""
+        self.assertEquals(self.trie.resolve("de"),
+                          ["deploy", "deploy-service", "describe"])
+        self.assertEquals(self.trie.resolve("dep"),
+                          ["deploy", "deploy-service"])
+        self.assertEquals(self.trie.resolve(""),
+                          ["deploy", "deploy-service", "describe", "help"])
+
+    def test_resolve_unknown_prefix(self):
+        """A prefix that doesn't start any names resolves to nothing."""
+        self.assertEquals(self.trie.resolve("x"), [])
+        self.assertEquals(self.trie.resolve("helpful"), [])
+
+    def test_add_duplicate(self):
+        """Adding a name twice doesn't make its prefixes ambiguous."""
+        self.trie.add("help")
+        self.assertEquals(self.trie.resolve("he"), ["help"])
+
+    def test_serialize(self):
+        """A trie can be serialized as JSON and loaded again."""
+        data = json.loads(json.dumps(self.trie.to_data()))
+        trie = PrefixTrie.from_data(data)
+        self.assertEquals(trie.resolve("deploy-"), ["deploy-service"])
+        self.assertEquals(trie.resolve("de"),
+                          ["deploy", "deploy-service", "describe"])
+
+
+class GetEditDistanceTest(TestCase):
+    """Tests for L{get_edit_distance}."""
+
+    def test_get_edit_distance(self):
+        """
+        The distance is the number of insertions, deletions and
+        substitutions needed to turn one string into the other.
+        """
+        self.assertEquals(get_edit_distance("help", "help"), 0)
+        self.assertEquals(get_edit_distance("help", "hepl"), 2)
+        self.assertEquals(get_edit_distance("version", "verion"), 1)
+        self.assertEquals(get_edit_distance("verion", "version"), 1)
+        self.assertEquals(get_edit_distance("kitten", "sitting"), 3)
+        self.assertEquals(get_edit_distance("", "abc"), 3)
+
+
+class BKTreeTest(TestCase):
+    """Tests for L{BKTree}."""
+
+    def setUp(self):
+        super(BKTreeTest, self).setUp()
+        self.tree = BKTree(["version", "person", "aversion", "versioned",
+                            "help"])
+
+    def test_search(self):
+        """
+        L{BKTree.search} finds names within the maximum distance, closest
+        first and then by name.
+        """
+        self.assertEquals(self.tree.search("verion", 2),
+                          [(1, "version"), (2, "aversion"), (2, "person")])
+        self.assertEquals(self.tree.search("help", 0), [(0, "help")])
+        self.assertEquals(self.tree.search("xyzzy", 2), [])
+
+    def test_search_matches_scan(self):
+        """
+        L{BKTree.search} finds the same names as comparing every name would.
+        """
+        names = ["%s-%d" % (word, i) for word in ["deploy", "describe",
+                                                  "destroy"]
+                 for i in range(20)]
+        tree = BKTree(names)
+        for name in ["deploy-1", "destroy-15", "descrbe-3", "x"]:
+            expected = sorted((get_edit_distance(name, other), other)
+                              for other in names
+                              if get_edit_distance(name, other) <= 2)
+            self.assertEquals(tree.search(name, 2), expected)
+
+    def test_empty(self):
+        """An empty tree doesn't find any names."""
+        self.assertEquals(BKTree().search("help", 3), [])
+
+    def test_serialize(self):
+        """A tree can be serialized as JSON and loaded again."""
+        data = json.loads(json.dumps(self.tree.to_data()))
+        tree = BKTree.from_data(data)
+        self.assertEquals(tree.search("verion", 1), [(1, "version")])
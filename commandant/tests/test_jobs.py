@@ -0,0 +1,296 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.jobs}."""
+
+import os
+import socket
+import sqlite3
+import time
+
+from testresources import ResourcedTestCase
+
+from commandant.jobs import (
+    JobQueue, QueueWorker, get_default_queue_path, is_process_alive,
+    PENDING, RUNNING, SUCCEEDED, FAILED)
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+class GetDefaultQueuePathTest(ResourcedTestCase):
+    """Tests for L{get_default_queue_path}."""
+
+    def setUp(self):
+        super(GetDefaultQueuePathTest, self).setUp()
+        self.original_queue = os.environ.pop("COMMANDANT_QUEUE", None)
+
+    def tearDown(self):
+        os.environ.pop("COMMANDANT_QUEUE", None)
+        if self.original_queue is not None:
+            os.environ["COMMANDANT_QUEUE"] = self.original_queue
+        super(GetDefaultQueuePathTest, self).tearDown()
+
+    def test_default_path(self):
+        """The queue is stored in the program's dot directory by default."""
+        self.assertEquals(
+            get_default_queue_path("test-program"),
+            os.path.expanduser("~/.test-program/queue.db"))
+
+    def test_environment_variable(self):
+        """The C{COMMANDANT_QUEUE} environment variable overrides the path."""
+        os.environ["COMMANDANT_QUEUE"] = "/tmp/queue.db"
+        self.assertEquals(get_default_queue_path("test-program"),
+                          "/tmp/queue.db")
+
+
+class JobQueueTest(ResourcedTestCase):
+    """Tests for L{JobQueue}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def setUp(self):
+        super(JobQueueTest, self).setUp()
+        self.queue = JobQueue(os.path.join(self.directory.path, "queue.db"))
+
+    def tearDown(self):
+        self.queue.close()
+        super(JobQueueTest, self).tearDown()
+
+    def test_add(self):
+        """L{JobQueue.add} adds a pending job to the queue."""
+        job_id = self.queue.add(["deploy", "--fast"])
+        job = self.queue.get_job(job_id)
+        self.assertEquals(job.argv, ["deploy", "--fast"])
+        self.assertEquals(job.state, PENDING)
+        self.assertEquals(job.attempts, 0)
+        self.assertEquals(job.max_attempts, 1)
+
+    def test_get_unknown_job(self):
+        """L{JobQueue.get_job} returns C{None} if the job doesn't exist."""
+        self.assertEquals(self.queue.get_job(42), None)
+
+    def test_claim(self):
+        """
+        L{JobQueue.claim} marks the pending job with the highest priority as
+        running.  Jobs with the same priority are claimed in the order they
+        were added.
+        """
+        first_id = self.queue.add(["first"])
+        urgent_id = self.queue.add(["urgent"], priority=10)
+        second_id = self.queue.add(["second"])
+        self.assertEquals(
+            [self.queue.claim().id for i in range(3)],
+            [urgent_id, first_id, second_id])
+        self.assertEquals(self.queue.claim(), None)
+        job = self.queue.get_job(urgent_id)
+        self.assertEquals(job.state, RUNNING)
+        self.assertEquals(job.attempts, 1)
+
+    def test_claim_records_worker(self):
+        """
+        L{JobQueue.claim} records the time, host and process ID of the
+        worker that claimed the job.
+        """
+        self.queue.add(["deploy"])
+        before = time.time()
+        job = self.queue.claim()
+        self.assertTrue(before <= job.claimed <= time.time())
+        self.assertEquals(job.worker_host, socket.gethostname())
+        self.assertEquals(job.worker_pid, os.getpid())
+
+    def abandon(self, job, **values):
+        """Change the recorded claim of C{job}, as if its worker had died."""
+        for name, value in values.iteritems():
+            self.queue._connection.execute(
+                "UPDATE job SET %s = ? WHERE id = ?" % (name,),
+                (value, job.id))
+
+    def get_dead_pid(self):
+        """Get the process ID of a child that has exited."""
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def test_claim_job_with_dead_worker(self):
+        """
+        A running job whose worker on this host has exited is claimed
+        again, counting the abandoned run as an attempt.
+        """
+        job_id = self.queue.add(["deploy"], retries=1)
+        job = self.queue.claim()
+        self.abandon(job, worker_pid=self.get_dead_pid())
+        job = self.queue.claim()
+        self.assertEquals(job.id, job_id)
+        self.assertEquals(job.attempts, 2)
+        self.assertEquals(job.worker_pid, os.getpid())
+
+    def test_claim_job_with_dead_worker_without_retries(self):
+        """
+        A running job whose worker has exited is marked as failed if it has
+        used up its retry limit.
+        """
+        job_id = self.queue.add(["deploy"])
+        job = self.queue.claim()
+        self.abandon(job, worker_pid=self.get_dead_pid())
+        self.assertEquals(self.queue.claim(), None)
+        self.assertEquals(self.queue.get_job(job_id).state, FAILED)
+
+    def test_claim_job_with_live_worker(self):
+        """
+        Running jobs whose worker is alive, or runs on another host, aren't
+        claimed again.
+        """
+        self.queue.add(["deploy"], retries=1)
+        self.queue.add(["build"], retries=1)
+        self.queue.claim()
+        job = self.queue.claim()
+        self.abandon(job, worker_host="elsewhere",
+                     worker_pid=self.get_dead_pid())
+        self.assertEquals(self.queue.claim(), None)
+
+    def test_claim_job_with_expired_claim(self):
+        """
+        A running job claimed more than L{JobQueue.claim_timeout} seconds
+        ago is claimed again, even if its worker is alive.
+        """
+        job_id = self.queue.add(["deploy"], retries=1)
+        job = self.queue.claim()
+        self.queue.claim_timeout = 60
+        self.assertEquals(self.queue.claim(), None)
+        self.abandon(job, claimed=time.time() - 120)
+        self.assertEquals(self.queue.claim().id, job_id)
+
+    def test_add_claim_columns(self):
+        """
+        Columns used to record claims are added to databases created before
+        they existed.
+        """
+        path = os.path.join(self.directory.path, "old.db")
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE job (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "argv TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0, "
+            "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "max_attempts INTEGER NOT NULL DEFAULT 1, exit_status INTEGER, "
+            "output BLOB, created REAL NOT NULL, finished REAL)")
+        connection.commit()
+        connection.close()
+        queue = JobQueue(path)
+        try:
+            queue.add(["deploy"])
+            self.assertEquals(queue.claim().worker_pid, os.getpid())
+        finally:
+            queue.close()
+
+    def test_is_process_alive(self):
+        """L{is_process_alive} checks if a process exists."""
+        self.assertTrue(is_process_alive(os.getpid()))
+        self.assertFalse(is_process_alive(self.get_dead_pid()))
+
+    def test_finish(self):
+        """L{JobQueue.finish} stores the exit status and output of a job."""
+        self.queue.add(["deploy"])
+        job = self.queue.claim()
+        self.assertEquals(self.queue.finish(job, 0, "Deployed!\n"), SUCCEEDED)
+        job = self.queue.get_job(job.id)
+        self.assertEquals(job.state, SUCCEEDED)
+        self.assertEquals(job.exit_status, 0)
+        self.assertEquals(job.output, "Deployed!\n")
+
+    def test_finish_with_retries(self):
+        """Failed jobs are retried until their retry limit is reached."""
+        self.queue.add(["deploy"], retries=1)
+        job = self.queue.claim()
+        self.assertEquals(self.queue.finish(job, 1, ""), PENDING)
+        job = self.queue.claim()
+        self.assertEquals(job.attempts, 2)
+        self.assertEquals(self.queue.finish(job, 1, ""), FAILED)
+        self.assertEquals(self.queue.claim(), None)
+
+    def test_finish_after_claim_lost(self):
+        """
+        The result of a job that was claimed again after its worker was
+        presumed dead is discarded, leaving the new claim in place.
+        """
+        self.queue.add(["deploy"], retries=1)
+        job = self.queue.claim()
+        self.abandon(job, worker_pid=self.get_dead_pid())
+        new_job = self.queue.claim()
+        self.assertEquals(self.queue.finish(job, 1, "Failed!\n"), None)
+        self.assertEquals(self.queue.get_job(job.id).state, RUNNING)
+        self.assertEquals(self.queue.get_job(job.id).output, None)
+        self.assertEquals(self.queue.finish(new_job, 0, ""), SUCCEEDED)
+
+    def test_get_jobs(self):
+        """L{JobQueue.get_jobs} optionally filters jobs by their state."""
+        self.queue.add(["first"])
+        self.queue.add(["second"])
+        self.queue.claim()
+        self.assertEquals([job.argv for job in self.queue.get_jobs()],
+                          [["first"], ["second"]])
+        self.assertEquals(
+            [job.argv for job in self.queue.get_jobs(PENDING)], [["second"]])
+
+
+class FakeController(object):
+    """A controller that writes the commands it runs to C{sys.stdout}."""
+
+    def run(self, argv):
+        print "Running %s" % (" ".join(argv),)
+        if argv[0] == "fail":
+            return 2
+
+
+class QueueWorkerTest(ResourcedTestCase):
+    """Tests for L{QueueWorker}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def setUp(self):
+        super(QueueWorkerTest, self).setUp()
+        self.queue = JobQueue(os.path.join(self.directory.path, "queue.db"))
+
+    def tearDown(self):
+        self.queue.close()
+        super(QueueWorkerTest, self).tearDown()
+
+    def test_run(self):
+        """
+        L{QueueWorker.run} runs jobs in child processes until the queue is
+        empty, capturing their output.
+        """
+        first_id = self.queue.add(["first"])
+        second_id = self.queue.add(["second", "argument"])
+        worker = QueueWorker(FakeController(), self.queue, workers=2)
+        self.assertEquals(worker.run(), 2)
+        job = self.queue.get_job(first_id)
+        self.assertEquals(job.state, SUCCEEDED)
+        self.assertEquals(job.output, "Running first\n")
+        job = self.queue.get_job(second_id)
+        self.assertEquals(job.state, SUCCEEDED)
+        self.assertEquals(job.output, "Running second argument\n")
+
+    def test_run_with_failure(self):
+        """Failed jobs are retried until their retry limit is reached."""
+        job_id = self.queue.add(["fail"], retries=2)
+        worker = QueueWorker(FakeController(), self.queue)
+        self.assertEquals(worker.run(), 3)
+        job = self.queue.get_job(job_id)
+        self.assertEquals(job.state, FAILED)
+        self.assertEquals(job.exit_status, 2)
+        self.assertEquals(job.attempts, 3)
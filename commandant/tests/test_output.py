@@ -0,0 +1,214 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.output}."""
+
+from cStringIO import StringIO
+import os
+import sys
+import threading
+import time
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant.output import (
+    OutputMultiplexer, OutputPump, PREFIX, GROUP, SPILL)
+from commandant.process import fork_command
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+class PrefixOutputMultiplexerTest(TestCase):
+    """Tests for L{OutputMultiplexer} in L{PREFIX} mode."""
+
+    def setUp(self):
+        super(PrefixOutputMultiplexerTest, self).setUp()
+        self.outf = StringIO()
+        self.multiplexer = OutputMultiplexer(self.outf, PREFIX, budget=32)
+
+    def test_write(self):
+        """Complete lines are written immediately, prefixed with a name."""
+        build = self.multiplexer.open("build")
+        test = self.multiplexer.open("test")
+        build.write("Compiling\nLink")
+        test.write("Running tests\n")
+        build.write("ing\n")
+        self.assertEquals(self.outf.getvalue(), """\
+build: Compiling
+test: Running tests
+build: Linking
+""")
+        self.assertEquals(self.multiplexer.get_buffered_size(), 0)
+
+    def test_close_writes_partial_line(self):
+        """A partial line is written when its stream is closed."""
+        build = self.multiplexer.open("build")
+        build.write("Done")
+        self.assertEquals(self.outf.getvalue(), "")
+        build.close()
+        self.assertEquals(self.outf.getvalue(), "build: Done\n")
+
+    def test_partial_line_in_pieces(self):
+        """A line written in pieces is written once it's complete."""
+        build = self.multiplexer.open("build")
+        for piece in ("Com", "pil", "ing"):
+            build.write(piece)
+        self.assertEquals(self.outf.getvalue(), "")
+        self.assertEquals(self.multiplexer.get_buffered_size(), 9)
+        build.write("\nLink")
+        self.assertEquals(self.outf.getvalue(), "build: Compiling\n")
+        self.assertEquals(self.multiplexer.get_buffered_size(), 4)
+
+    def test_long_partial_line(self):
+        """A partial line is written once it exceeds the budget."""
+        build = self.multiplexer.open("build")
+        build.write("x" * 40)
+        self.assertEquals(self.outf.getvalue(), "build: %s\n" % ("x" * 40,))
+        self.assertEquals(self.multiplexer.get_buffered_size(), 0)
+
+
+class GroupOutputMultiplexerTest(TestCase):
+    """Tests for L{OutputMultiplexer} in L{GROUP} mode."""
+
+    def setUp(self):
+        super(GroupOutputMultiplexerTest, self).setUp()
+        self.outf = StringIO()
+        self.multiplexer = OutputMultiplexer(self.outf, GROUP, budget=32)
+
+    def test_write(self):
+        """
+        Output from the first stream is written immediately, while output
+        from other streams is buffered until it's their turn.
+        """
+        build = self.multiplexer.open("build")
+        test = self.multiplexer.open("test")
+        build.write("Compiling\n")
+        test.write("Running tests\n")
+        self.assertEquals(self.outf.getvalue(), "Compiling\n")
+        build.write("Linking\n")
+        build.close()
+        self.assertEquals(self.outf.getvalue(),
+                          "Compiling\nLinking\nRunning tests\n")
+        test.write("Passed\n")
+        self.assertEquals(self.outf.getvalue(),
+                          "Compiling\nLinking\nRunning tests\nPassed\n")
+
+    def test_completed_streams_are_written_in_turn(self):
+        """
+        A stream that completes while another is being written is written as
+        soon as the current stream is closed.
+        """
+        build = self.multiplexer.open("build")
+        lint = self.multiplexer.open("lint")
+        test = self.multiplexer.open("test")
+        build.write("build\n")
+        test.write("test\n")
+        lint.write("lint\n")
+        lint.close()
+        self.assertEquals(self.outf.getvalue(), "build\n")
+        build.close()
+        self.assertEquals(self.outf.getvalue(), "build\nlint\ntest\n")
+        self.assertEquals(self.multiplexer.get_buffered_size(), 0)
+
+    def test_writable(self):
+        """
+        Buffered streams stop being writable once the budget is used up, but
+        the stream being passed through is always writable.
+        """
+        build = self.multiplexer.open("build")
+        test = self.multiplexer.open("test")
+        self.assertEquals(test.get_writable_size(), 32)
+        test.write("x" * 20)
+        self.assertEquals(test.get_writable_size(), 12)
+        test.write("x" * 12)
+        self.assertFalse(test.writable())
+        self.assertEquals(test.get_writable_size(), 0)
+        self.assertTrue(build.writable())
+        self.assertEquals(build.get_writable_size(), None)
+        build.close()
+        self.assertTrue(test.writable())
+        self.assertEquals(test.get_writable_size(), None)
+
+    def test_write_stays_within_budget(self):
+        """
+        A write to a buffered stream that's larger than the rest of the
+        budget blocks, with the budget full, until the budget is freed.
+        """
+        build = self.multiplexer.open("build")
+        test = self.multiplexer.open("test")
+        thread = threading.Thread(target=test.write, args=("x" * 40,))
+        thread.start()
+        try:
+            while test.writable():
+                time.sleep(0.001)
+            self.assertEquals(self.multiplexer.get_buffered_size(), 32)
+        finally:
+            build.close()
+            thread.join()
+        self.assertEquals(self.outf.getvalue(), "x" * 40)
+
+
+class SpillOutputMultiplexerTest(ResourcedTestCase):
+    """Tests for L{OutputMultiplexer} in L{SPILL} mode."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_write(self):
+        """The output of each stream is written to its own file."""
+        outf = StringIO()
+        multiplexer = OutputMultiplexer(
+            outf, SPILL, spill_directory=self.directory.path)
+        build = multiplexer.open("build")
+        build.write("Compiling\n")
+        build.close()
+        path = os.path.join(self.directory.path, "build.log")
+        self.assertEquals(open(path).read(), "Compiling\n")
+        self.assertEquals(outf.getvalue(), "")
+
+    def test_without_spill_directory(self):
+        """A C{ValueError} is raised if a spill directory isn't provided."""
+        self.assertRaises(ValueError, OutputMultiplexer, StringIO(), SPILL)
+
+
+class FakeController(object):
+    """A controller that writes its arguments to C{sys.stdout}."""
+
+    def run(self, argv):
+        sys.stdout.write("%s\n" % (" ".join(argv),))
+
+
+class OutputPumpTest(TestCase):
+    """Tests for L{OutputPump}."""
+
+    def test_wait(self):
+        """
+        L{OutputPump.wait} copies output from child processes to their
+        streams and returns when one of them exits.
+        """
+        outf = StringIO()
+        multiplexer = OutputMultiplexer(outf, GROUP)
+        pump = OutputPump()
+        pids = []
+        for name in ("first", "second"):
+            read_fd, write_fd = os.pipe()
+            pid = fork_command(FakeController(), [name], stdout=write_fd)
+            os.close(write_fd)
+            pump.add(pid, read_fd, multiplexer.open(name))
+            pids.append(pid)
+        results = [pump.wait(), pump.wait()]
+        self.assertEquals(sorted(results), sorted([(pid, 0) for pid in pids]))
+        self.assertEquals(outf.getvalue(), "first\nsecond\n")
@@ -0,0 +1,60 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.process}."""
+
+from testtools import TestCase
+
+from commandant.process import fork_command, wait_for_child
+from commandant.timing import start_timing, stop_timing
+
+
+class FakeController(object):
+    """A controller whose commands exit with the status they're given."""
+
+    def run(self, argv):
+        return int(argv[0])
+
+
+class ForkCommandTest(TestCase):
+    """Tests for L{fork_command} and L{wait_for_child}."""
+
+    def tearDown(self):
+        stop_timing()
+        super(ForkCommandTest, self).tearDown()
+
+    def test_exit_status(self):
+        """The child's exit status is the return value of the command."""
+        pid = fork_command(FakeController(), ["3"])
+        self.assertEquals(wait_for_child(pid), (pid, 3))
+
+    def test_timed(self):
+        """
+        When timing is enabled, each child is recorded as a span on a track
+        of its own, from when it's forked until it's reaped.
+        """
+        timer = start_timing()
+        first_pid = fork_command(FakeController(), ["0"])
+        second_pid = fork_command(FakeController(), ["0"])
+        first, second = timer.phases
+        self.assertEquals(first.name, "process 0 (pid %d)" % (first_pid,))
+        self.assertNotEquals(first.track, second.track)
+        self.assertEquals(first.end, None)
+        wait_for_child(first_pid)
+        wait_for_child(second_pid)
+        self.assertNotEquals(first.end, None)
+        self.assertNotEquals(second.end, None)
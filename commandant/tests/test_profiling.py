@@ -0,0 +1,164 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.profiling}."""
+
+import os
+import pstats
+from StringIO import StringIO
+
+from twisted.internet.defer import Deferred
+
+from bzrlib.errors import BzrCommandError
+
+from testresources import ResourcedTestCase
+
+from commandant.profiling import (
+    CommandProfiler, extract_profile_path, profile_run)
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+def work():
+    """A function for the profiler to find."""
+    return sum(range(10))
+
+
+class ExtractProfilePathTest(ResourcedTestCase):
+    """Tests for L{extract_profile_path}."""
+
+    def test_without_option(self):
+        """The arguments are unchanged if the option isn't present."""
+        self.assertEquals(extract_profile_path(["command", "-v"]),
+                          (None, ["command", "-v"]))
+
+    def test_with_equals(self):
+        """The path can be given after an C{=}."""
+        self.assertEquals(
+            extract_profile_path(["--profile-command=out.prof", "command"]),
+            ("out.prof", ["command"]))
+
+    def test_with_separate_argument(self):
+        """The path can be given as a separate argument."""
+        self.assertEquals(
+            extract_profile_path(["--profile-command", "out", "command"]),
+            ("out", ["command"]))
+
+    def test_with_other_options(self):
+        """Other options before the command name are left in place."""
+        self.assertEquals(
+            extract_profile_path(["--no-plugins", "--profile-command=out",
+                                  "command", "-v"]),
+            ("out", ["--no-plugins", "command", "-v"]))
+
+    def test_after_command_name(self):
+        """
+        The option is only accepted before the command name, so arguments
+        for the command are passed through untouched.
+        """
+        argv = ["command", "--profile-command", "out"]
+        self.assertEquals(extract_profile_path(argv), (None, argv))
+
+    def test_after_double_dash(self):
+        """Arguments after C{--} are passed through untouched."""
+        argv = ["--", "--profile-command=out"]
+        self.assertEquals(extract_profile_path(argv), (None, argv))
+
+    def test_missing_path(self):
+        """An error is raised if the option is missing its path."""
+        self.assertRaises(BzrCommandError, extract_profile_path,
+                          ["--profile-command"])
+
+
+class CommandProfilerTest(ResourcedTestCase):
+    """Tests for L{CommandProfiler}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_format(self):
+        """
+        Results are written in callgrind format if the file's name starts
+        with C{callgrind.out} and in C{pstats} format otherwise.
+        """
+        self.assertEquals(CommandProfiler("out.prof").format, "pstats")
+        self.assertEquals(
+            CommandProfiler("/tmp/callgrind.out.hello").format, "callgrind")
+
+    def test_pstats(self):
+        """The profile is written to the path in C{pstats} format."""
+        path = os.path.join(self.directory.make_dir(), "out.prof")
+        profiler = CommandProfiler(path)
+        profiler.start()
+        work()
+        profiler.stop()
+        functions = [function[2] for function in pstats.Stats(path).stats]
+        self.assertIn("work", functions)
+
+    def test_stop_fails(self):
+        """A warning is written if the results can't be written."""
+        path = os.path.join(self.directory.make_dir(), "missing", "out")
+        stream = StringIO()
+        profiler = CommandProfiler(path, stream)
+        profiler.start()
+        profiler.stop()
+        self.assertEquals(
+            stream.getvalue(),
+            "commandant: warning: can't write profile to %s: "
+            "No such file or directory\n" % (path,))
+
+
+class ProfileRunTest(ResourcedTestCase):
+    """Tests for L{profile_run}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_profile_run(self):
+        """
+        The wrapped function's return value is passed through and its
+        profile is written when it returns.
+        """
+        path = os.path.join(self.directory.make_dir(), "out.prof")
+        self.assertEquals(profile_run(work, path)(), 45)
+        functions = [function[2] for function in pstats.Stats(path).stats]
+        self.assertIn("work", functions)
+
+    def test_profile_run_with_exception(self):
+        """The profile is written if the wrapped function raises."""
+        path = os.path.join(self.directory.make_dir(), "out.prof")
+
+        def fail():
+            raise RuntimeError("KABOOM!")
+
+        self.assertRaises(RuntimeError, profile_run(fail, path))
+        self.assertTrue(os.path.exists(path))
+
+    def test_profile_run_with_deferred(self):
+        """
+        If the wrapped function returns a C{Deferred}, profiling continues
+        until it fires, so the callbacks that finish the work are
+        profiled too.
+        """
+        path = os.path.join(self.directory.make_dir(), "out.prof")
+        deferred = Deferred()
+        result = profile_run(lambda: deferred, path)()
+        self.assertFalse(os.path.exists(path))
+        work()
+        results = []
+        result.addCallback(results.append)
+        deferred.callback("value")
+        self.assertEquals(results, ["value"])
+        functions = [function[2] for function in pstats.Stats(path).stats]
+        self.assertIn("work", functions)
@@ -0,0 +1,236 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.scheduler}."""
+
+from datetime import datetime
+import time
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant.errors import ScheduleError
+from commandant.scheduler import (
+    IntervalSchedule, CronSchedule, ScheduleEntry, Scheduler, parse_schedule,
+    load_schedule)
+from commandant.testing.resources import TemporaryDirectoryResource
+
+
+def get_timestamp(*args):
+    """Get the timestamp for a local date and time."""
+    return time.mktime(datetime(*args).timetuple())
+
+
+class ParseScheduleTest(TestCase):
+    """Tests for L{parse_schedule}."""
+
+    def test_interval(self):
+        """C{@every} schedules fire every interval."""
+        schedule = parse_schedule("@every 90")
+        self.assertTrue(isinstance(schedule, IntervalSchedule))
+        self.assertEquals(schedule.get_next_time(1000), 1090)
+
+    def test_interval_with_units(self):
+        """Intervals may be specified in seconds, minutes or hours."""
+        self.assertEquals(parse_schedule("@every 30s").interval, 30)
+        self.assertEquals(parse_schedule("@every 5m").interval, 300)
+        self.assertEquals(parse_schedule("@every 2h").interval, 7200)
+
+    def test_invalid_interval(self):
+        """A L{ScheduleError} is raised for an invalid interval."""
+        self.assertRaises(ScheduleError, parse_schedule, "@every soon")
+        self.assertRaises(ScheduleError, parse_schedule, "@every 0")
+
+    def test_alias(self):
+        """C{@hourly} and C{@daily} are aliases for cron expressions."""
+        self.assertEquals(parse_schedule("@hourly").expression, "0 * * * *")
+        self.assertEquals(parse_schedule("@daily").expression, "0 0 * * *")
+
+    def test_invalid_cron_expression(self):
+        """A L{ScheduleError} is raised for an invalid cron expression."""
+        self.assertRaises(ScheduleError, parse_schedule, "* * *")
+        self.assertRaises(ScheduleError, parse_schedule, "60 * * * *")
+        self.assertRaises(ScheduleError, parse_schedule, "*/0 * * * *")
+        self.assertRaises(ScheduleError, parse_schedule, "a * * * *")
+
+
+class CronScheduleTest(TestCase):
+    """Tests for L{CronSchedule}."""
+
+    def test_every_minute(self):
+        """The next time is the start of the next matching minute."""
+        schedule = CronSchedule("* * * * *")
+        self.assertEquals(
+            schedule.get_next_time(get_timestamp(2013, 5, 9, 10, 15, 30)),
+            get_timestamp(2013, 5, 9, 10, 16))
+
+    def test_step(self):
+        """Steps match every Nth value in a range."""
+        schedule = CronSchedule("*/20 * * * *")
+        self.assertEquals(
+            schedule.get_next_time(get_timestamp(2013, 5, 9, 10, 41)),
+            get_timestamp(2013, 5, 9, 11, 0))
+
+    def test_hour_and_minute(self):
+        """Schedules can fire at a specific time of day."""
+        schedule = CronSchedule("30 6 * * *")
+        self.assertEquals(
+            schedule.get_next_time(get_timestamp(2013, 5, 9, 10, 0)),
+            get_timestamp(2013, 5, 10, 6, 30))
+
+    def test_weekdays(self):
+        """Days of the week are numbered from Sunday, which is 0 or 7."""
+        # The 9th of May, 2013 is a Thursday.
+        schedule = CronSchedule("0 0 * * 1-5")
+        self.assertEquals(
+            schedule.get_next_time(get_timestamp(2013, 5, 10, 1, 0)),
+            get_timestamp(2013, 5, 13, 0, 0))
+        schedule = CronSchedule("0 0 * * 7")
+        self.assertEquals(
+            schedule.get_next_time(get_timestamp(2013, 5, 10, 1, 0)),
+            get_timestamp(2013, 5, 12, 0, 0))
+
+    def test_day_of_month_or_day_of_week(self):
+        """
+        When both the day of the month and day of the week are restricted, a
+        day matching either one matches the schedule.
+        """
+        schedule = CronSchedule("0 0 1 * 0")
+        self.assertEquals(
+            schedule.get_next_time(get_timestamp(2013, 5, 9, 1, 0)),
+            get_timestamp(2013, 5, 12, 0, 0))
+
+    def test_never_fires(self):
+        """A L{ScheduleError} is raised if a schedule can never fire."""
+        schedule = CronSchedule("0 0 30 2 *")
+        self.assertRaises(ScheduleError, schedule.get_next_time,
+                          get_timestamp(2013, 5, 9))
+
+
+class LoadScheduleTest(ResourcedTestCase):
+    """Tests for L{load_schedule}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_load_schedule(self):
+        """
+        Each line in a schedule file has a schedule followed by a command
+        line.  Blank lines and comments are ignored.
+        """
+        path = self.directory.make_path("""\
+# Refresh the cache.
+@every 90s refresh-cache --quick
+
+30 6 * * 1-5 send-report "daily report"
+@daily rotate-logs
+""")
+        entries = load_schedule(path)
+        self.assertEquals([entry.argv for entry in entries],
+                          [["refresh-cache", "--quick"],
+                           ["send-report", "daily report"],
+                           ["rotate-logs"]])
+        self.assertEquals(entries[0].schedule.interval, 90)
+        self.assertEquals(entries[1].schedule.expression, "30 6 * * 1-5")
+
+    def test_load_schedule_without_command(self):
+        """A L{ScheduleError} is raised if a line doesn't have a command."""
+        path = self.directory.make_path("@every 90s\n")
+        self.assertRaises(ScheduleError, load_schedule, path)
+
+
+class FakeScheduler(Scheduler):
+    """A L{Scheduler} that records commands instead of running them."""
+
+    def __init__(self, **kwargs):
+        self.now = 1000.0
+        super(FakeScheduler, self).__init__(None, clock=lambda: self.now,
+                                            **kwargs)
+        self.started = []
+        self.stopped = []
+        self.exit_statuses = {}
+
+    def start_entry(self, entry):
+        self.started.append((self.now, entry.argv))
+        pid = len(self.started)
+        return pid
+
+    def poll_entry(self, entry):
+        return self.exit_statuses.get(entry.pid)
+
+    def stop_entry(self, entry):
+        self.stopped.append(entry.pid)
+
+
+class SchedulerTest(TestCase):
+    """Tests for L{Scheduler}."""
+
+    def test_tick(self):
+        """
+        L{Scheduler.tick} starts commands that are due and returns the time
+        until the next one is due.
+        """
+        scheduler = FakeScheduler()
+        scheduler.add(ScheduleEntry(IntervalSchedule(10), ["fast"]))
+        scheduler.add(ScheduleEntry(IntervalSchedule(25), ["slow"]))
+        self.assertEquals(scheduler.tick(), 10)
+        scheduler.now = 1010.0
+        self.assertEquals(scheduler.tick(), 10)
+        self.assertEquals(scheduler.started, [(1010.0, ["fast"])])
+
+    def test_tick_skips_running_commands(self):
+        """A command that's still running when it's due again is skipped."""
+        scheduler = FakeScheduler()
+        scheduler.add(ScheduleEntry(IntervalSchedule(10), ["slow"]))
+        scheduler.now = 1010.0
+        scheduler.tick()
+        scheduler.now = 1020.0
+        scheduler.tick()
+        self.assertEquals(scheduler.started, [(1010.0, ["slow"])])
+        scheduler.exit_statuses[1] = 0
+        scheduler.now = 1030.0
+        scheduler.tick()
+        self.assertEquals(scheduler.started,
+                          [(1010.0, ["slow"]), (1030.0, ["slow"])])
+
+    def test_tick_with_jitter(self):
+        """Each run is delayed by up to C{jitter} seconds."""
+        scheduler = FakeScheduler(jitter=5)
+        entry = ScheduleEntry(IntervalSchedule(10), ["command"])
+        scheduler.add(entry)
+        self.assertEquals(entry.next_time, 1010.0)
+        self.assertTrue(1010.0 <= entry.due_time <= 1015.0)
+        scheduler.now = entry.due_time
+        scheduler.tick()
+        self.assertEquals(len(scheduler.started), 1)
+        self.assertEquals(entry.next_time, 1020.0)
+
+    def test_run_stops_running_commands(self):
+        """
+        Commands that are still running when L{Scheduler.run} is interrupted
+        are terminated.
+        """
+
+        def interrupt(delay):
+            raise KeyboardInterrupt()
+
+        scheduler = FakeScheduler(sleep=interrupt)
+        entry = ScheduleEntry(IntervalSchedule(10), ["slow"])
+        scheduler.add(entry)
+        scheduler.now = 1010.0
+        self.assertRaises(KeyboardInterrupt, scheduler.run)
+        self.assertEquals(scheduler.stopped, [1])
+        self.assertEquals(entry.pid, None)
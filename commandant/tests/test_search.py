@@ -0,0 +1,272 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.search}."""
+
+import os
+
+from testresources import ResourcedTestCase
+from testtools import TestCase
+
+from commandant import builtins
+from commandant.controller import CommandController
+from commandant.search import (
+    SearchIndex, get_default_search_index_path, tokenize, update_search_index)
+from commandant.testing.resources import (
+    TemporaryDirectoryResource, FakeCommand, FakeHelpTopic)
+
+
+class TokenizeTest(TestCase):
+    """Tests for L{tokenize}."""
+
+    def test_tokenize(self):
+        """L{tokenize} returns lowercase alphanumeric terms."""
+        self.assertEquals(tokenize("Run-graph: runs 2 Commands."),
+                          ["run", "graph", "runs", "2", "commands"])
+
+
+class GetDefaultSearchIndexPathTest(TestCase):
+    """Tests for L{get_default_search_index_path}."""
+
+    def setUp(self):
+        super(GetDefaultSearchIndexPathTest, self).setUp()
+        self.original_path = os.environ.pop("COMMANDANT_SEARCH_INDEX", None)
+
+    def tearDown(self):
+        os.environ.pop("COMMANDANT_SEARCH_INDEX", None)
+        if self.original_path is not None:
+            os.environ["COMMANDANT_SEARCH_INDEX"] = self.original_path
+        super(GetDefaultSearchIndexPathTest, self).tearDown()
+
+    def test_default_path(self):
+        """The index is stored in the program's directory by default."""
+        self.assertEquals(
+            get_default_search_index_path("test"),
+            os.path.join(os.path.expanduser("~"), ".test",
+                         "search-index.json"))
+
+    def test_environment_variable(self):
+        """C{COMMANDANT_SEARCH_INDEX} overrides the default path."""
+        os.environ["COMMANDANT_SEARCH_INDEX"] = "/tmp/index.json"
+        self.assertEquals(get_default_search_index_path("test"),
+                          "/tmp/index.json")
+
+
+class SearchIndexTest(ResourcedTestCase):
+    """Tests for L{SearchIndex}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def test_search(self):
+        """
+        L{SearchIndex.search} returns matching documents, most relevant
+        first.
+        """
+        index = SearchIndex()
+        index.add("deploy", "Deploy the site.  Deploy it fast.")
+        index.add("build", "Build the site before you deploy it.")
+        index.add("clean", "Remove build products.")
+        self.assertEquals([name for name, score in index.search("deploy")],
+                          ["deploy", "build"])
+
+    def test_search_ranks_rare_terms_higher(self):
+        """Terms that appear in fewer documents have more weight."""
+        index = SearchIndex()
+        index.add("one", "common rare")
+        index.add("two", "common common")
+        index.add("three", "common")
+        results = index.search("common rare")
+        self.assertEquals(results[0][0], "one")
+
+    def test_search_without_matches(self):
+        """An empty C{list} is returned when nothing matches."""
+        index = SearchIndex()
+        index.add("deploy", "Deploy the site.")
+        self.assertEquals(index.search("unknown"), [])
+
+    def test_search_with_limit(self):
+        """The number of results can be limited."""
+        index = SearchIndex()
+        index.add("a", "site")
+        index.add("b", "site")
+        index.add("c", "site")
+        self.assertEquals([name for name, score in index.search("site", 2)],
+                          ["a", "b"])
+
+    def test_add_replaces_document(self):
+        """Adding a document again replaces its terms."""
+        index = SearchIndex()
+        index.add("deploy", "Deploy the site.")
+        index.add("deploy", "Publish the site.")
+        self.assertEquals(index.search("deploy"), [])
+        self.assertEquals(len(index.search("publish")), 1)
+
+    def test_remove(self):
+        """L{SearchIndex.remove} removes a document and its terms."""
+        index = SearchIndex()
+        index.add("deploy", "Deploy the site.")
+        index.remove("deploy")
+        index.remove("unknown")
+        self.assertEquals(index.get_names(), set())
+        self.assertEquals(index.search("deploy"), [])
+
+    def test_is_unchanged(self):
+        """
+        L{SearchIndex.is_unchanged} returns C{True} if a document was indexed
+        with the same fingerprint.  Documents without a fingerprint are
+        never unchanged.
+        """
+        index = SearchIndex()
+        index.add("deploy", "Deploy the site.", "fingerprint")
+        index.add("build", "Build the site.")
+        self.assertTrue(index.is_unchanged("deploy", "fingerprint"))
+        self.assertFalse(index.is_unchanged("deploy", "other"))
+        self.assertFalse(index.is_unchanged("build", None))
+        self.assertFalse(index.is_unchanged("unknown", "fingerprint"))
+
+    def test_add_unchanged_document(self):
+        """
+        Adding a document that's already indexed with the same text and
+        fingerprint doesn't change the index, so it isn't saved again.
+        """
+        path = os.path.join(self.directory.path, "index.json")
+        index = SearchIndex(path)
+        self.assertTrue(index.add("deploy", "Deploy the site."))
+        index.save()
+        self.assertFalse(index.add("deploy", "Deploy the site."))
+        os.unlink(path)
+        index.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(index.add("deploy", "Deploy the whole site."))
+
+    def test_save_and_load(self):
+        """An index can be saved to disk and loaded again."""
+        path = os.path.join(self.directory.path, "cache", "index.json")
+        index = SearchIndex(path)
+        index.add("deploy", "Deploy the site.", "fingerprint")
+        index.save()
+        index = SearchIndex(path)
+        index.load()
+        self.assertTrue(index.is_unchanged("deploy", "fingerprint"))
+        self.assertEquals([name for name, score in index.search("site")],
+                          ["deploy"])
+
+    def test_load_corrupt_index(self):
+        """A corrupt index file is ignored."""
+        path = self.directory.make_path("not json")
+        index = SearchIndex(path)
+        index.load()
+        self.assertEquals(index.get_names(), set())
+
+
+class UpdateSearchIndexTest(ResourcedTestCase):
+    """Tests for L{update_search_index}."""
+
+    resources = [("directory", TemporaryDirectoryResource())]
+
+    def setUp(self):
+        super(UpdateSearchIndexTest, self).setUp()
+        self.controller = CommandController()
+
+    def test_update_search_index(self):
+        """
+        Commands and help topics known to the controller are added to the
+        index.
+        """
+        self.controller.register_command("fake-command", FakeCommand)
+        self.controller.register_help_topic("fake-topic", FakeHelpTopic)
+        index = SearchIndex()
+        self.assertEquals(update_search_index(self.controller, index), 2)
+        self.assertEquals([name for name, score in index.search("spans")],
+                          ["fake-command"])
+        self.assertEquals(
+            sorted(name for name, score in index.search("fake")),
+            ["fake-command", "fake-topic"])
+
+    def test_unchanged_files_are_skipped(self):
+        """
+        Documents loaded from files that haven't changed aren't indexed
+        again.
+        """
+        path = os.path.join(self.directory.path, "deploy.txt")
+        self.directory.make_path("Deploy things.\n\nTo production.", path)
+        self.controller.load_path(self.directory.path)
+        index = SearchIndex()
+        self.assertEquals(update_search_index(self.controller, index), 1)
+        self.assertEquals(update_search_index(self.controller, index), 0)
+        self.assertEquals([name for name, score in index.search("production")],
+                          ["deploy"])
+
+    def test_changed_topic_for_command(self):
+        """
+        A command's document is indexed again when the help topic with the
+        same name, whose text is indexed for it, changes.
+        """
+        self.directory.make_path(
+            "from bzrlib.commands import Command\n"
+            "class cmd_deploy(Command):\n"
+            "    def run(self):\n"
+            "        pass\n",
+            os.path.join(self.directory.path, "deploy.py"))
+        topic_path = os.path.join(self.directory.path, "deploy.txt")
+        self.directory.make_path("Deploy things.\n\nTo production.",
+                                 topic_path)
+        self.controller.load_path(self.directory.path)
+        index = SearchIndex()
+        self.assertEquals(update_search_index(self.controller, index), 1)
+        self.assertEquals(update_search_index(self.controller, index), 0)
+        self.directory.make_path("Deploy things.\n\nTo staging, quickly.",
+                                 topic_path)
+        self.assertEquals(update_search_index(self.controller, index), 1)
+        self.assertEquals([name for name, score in index.search("staging")],
+                          ["deploy"])
+
+    def test_unchanged_python_topics_are_skipped(self):
+        """
+        Help topics defined in Python are fingerprinted by the source file
+        of their module, so they aren't indexed again while it's unchanged.
+        """
+        self.controller.register_help_topic("fake-topic", FakeHelpTopic)
+        index = SearchIndex()
+        self.assertEquals(update_search_index(self.controller, index), 1)
+        self.assertEquals(update_search_index(self.controller, index), 0)
+
+    def test_listing_topics_are_skipped(self):
+        """
+        Listing topics, like C{commands}, aren't indexed, so a search for
+        a command's name doesn't match them.
+        """
+        self.controller.load_module(builtins)
+        index = SearchIndex()
+        update_search_index(self.controller, index)
+        names = index.get_names()
+        self.assertIn("basic", names)
+        self.assertNotIn("commands", names)
+        self.assertNotIn("hidden-commands", names)
+        self.assertNotIn("topics", names)
+        self.assertNotIn("commands",
+                         [name for name, score in index.search("version")])
+        index.add("commands", "A stale listing.")
+        update_search_index(self.controller, index)
+        self.assertNotIn("commands", index.get_names())
+
+    def test_unknown_names_are_removed(self):
+        """Documents for names the controller doesn't know are removed."""
+        index = SearchIndex()
+        index.add("removed", "A removed command.")
+        self.assertEquals(update_search_index(self.controller, index), 1)
+        self.assertEquals(index.get_names(), set())
@@ -0,0 +1,188 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Unit tests for L{commandant.timing}."""
+
+import json
+import os
+import threading
+from StringIO import StringIO
+
+from testtools import TestCase
+
+from commandant import timing
+from commandant.timing import (
+    Timer, get_process_start_time, get_time, get_timer, start_phase,
+    start_span, start_timing, stop_phase, stop_span, stop_timing)
+
+
+class FakeClock(object):
+    """A clock that advances by a second each time it's read."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+class TimerTest(TestCase):
+    """Tests for L{Timer}."""
+
+    def setUp(self):
+        super(TimerTest, self).setUp()
+        self.addCleanup(setattr, timing, "get_time", timing.get_time)
+        timing.get_time = FakeClock()
+
+    def test_phases(self):
+        """Phases are recorded in the order they start, with their depth."""
+        timer = Timer()
+        outer = timer.start_phase("outer")
+        inner = timer.start_phase("inner")
+        timer.stop_phase(inner)
+        timer.stop_phase(outer)
+        self.assertEquals(
+            [(phase.name, phase.start, phase.end, phase.depth)
+             for phase in timer.phases],
+            [("outer", 2, 5, 0), ("inner", 3, 4, 1)])
+
+    def test_stop_phase_stops_nested_phases(self):
+        """Stopping a phase stops the phases still running inside it."""
+        timer = Timer()
+        outer = timer.start_phase("outer")
+        inner = timer.start_phase("inner")
+        timer.stop_phase(outer)
+        self.assertEquals(inner.end, outer.end)
+        self.assertEquals(timer.start_phase("next").depth, 0)
+
+    def test_report(self):
+        """
+        The report shows each phase's total and self time, with nested
+        phases indented, and the total time of the run.
+        """
+        timer = Timer(0)
+        timer.add_phase("startup", 0, 1)
+        outer = timer.start_phase("outer")
+        inner = timer.start_phase("inner")
+        timer.stop_phase(inner)
+        timer.stop_phase(outer)
+        stream = StringIO()
+        timer.report(stream)
+        self.assertEquals(
+            stream.getvalue(),
+            "  total ms    self ms  phase\n"
+            "    1000.0     1000.0  startup\n"
+            "    3000.0     2000.0  outer\n"
+            "    1000.0     1000.0    inner\n"
+            "    5000.0             total\n")
+
+    def test_spans(self):
+        """
+        Spans go on tracks of their own, without nesting in the running
+        phase, and their tracks are reused once they stop.
+        """
+        timer = Timer()
+        phase = timer.start_phase("phase")
+        first = timer.start_span("first")
+        second = timer.start_span("second")
+        timer.stop_span(first)
+        third = timer.start_span("third")
+        self.assertEquals(
+            [(span.track, span.depth) for span in (phase, first, second)],
+            [(1, 0), (2, 0), (3, 0)])
+        self.assertEquals(third.track, first.track)
+        self.assertEquals(timer.start_phase("nested").depth, 1)
+
+    def test_threads(self):
+        """Phases started in another thread go on a track of its own."""
+        timer = Timer()
+        outer = timer.start_phase("outer")
+        phases = []
+        thread = threading.Thread(
+            target=lambda: phases.append(timer.start_phase("threaded")),
+            name="worker")
+        thread.start()
+        thread.join()
+        self.assertEquals(outer.track, 1)
+        self.assertEquals(phases[0].track, 2)
+        self.assertEquals(phases[0].depth, 0)
+
+    def test_write_trace(self):
+        """
+        The trace has a complete event for each phase, timed in
+        microseconds since the start of the run, and names its tracks.
+        """
+        timer = Timer(0)
+        timer.add_phase("startup", 0, 1)
+        phase = timer.start_phase("phase")
+        span = timer.start_span("span")
+        timer.stop_span(span)
+        timer.stop_phase(phase)
+        stream = StringIO()
+        timer.write_trace(stream)
+        trace = json.loads(stream.getvalue())
+        pid = os.getpid()
+        self.assertEquals(trace["displayTimeUnit"], "ms")
+        self.assertEquals(
+            trace["traceEvents"],
+            [{"name": "thread_name", "ph": "M", "pid": pid, "tid": 1,
+              "args": {"name": "main"}},
+             {"name": "thread_name", "ph": "M", "pid": pid, "tid": 2,
+              "args": {"name": "concurrent"}},
+             {"name": "startup", "cat": "commandant", "ph": "X", "ts": 0,
+              "dur": 1000000, "pid": pid, "tid": 1},
+             {"name": "phase", "cat": "commandant", "ph": "X",
+              "ts": 1000000, "dur": 3000000, "pid": pid, "tid": 1},
+             {"name": "span", "cat": "commandant", "ph": "X",
+              "ts": 2000000, "dur": 1000000, "pid": pid, "tid": 2}])
+
+
+class TimingTest(TestCase):
+    """Tests for the module-level timing functions."""
+
+    def tearDown(self):
+        stop_timing()
+        super(TimingTest, self).tearDown()
+
+    def test_disabled(self):
+        """Phases aren't recorded when timing isn't enabled."""
+        self.assertEquals(get_timer(), None)
+        phase = start_phase("phase")
+        self.assertEquals(phase, None)
+        stop_phase(phase)
+        span = start_span("span")
+        self.assertEquals(span, None)
+        stop_span(span)
+
+    def test_start_timing(self):
+        """
+        L{start_timing} creates the L{Timer} phases are recorded with until
+        L{stop_timing} is called.
+        """
+        timer = start_timing()
+        stop_phase(start_phase("phase"))
+        self.assertTrue(get_timer() is timer)
+        self.assertEquals(stop_timing(), timer)
+        self.assertEquals(get_timer(), None)
+        self.assertEquals([phase.name for phase in timer.phases], ["phase"])
+
+    def test_get_process_start_time(self):
+        """The process started before now, if its start time is known."""
+        start = get_process_start_time()
+        if start is not None:
+            self.assertTrue(start <= get_time())
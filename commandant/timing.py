@@ -0,0 +1,312 @@
+# Commandant is a toolkit for building command-oriented tools.
+# Copyright (C) 2009-2010 Jamshed Kakar.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Measure how long the phases of a Commandant run take.
+
+Timing is enabled by L{start_timing}, which the C{commandant} entry point
+calls when the C{COMMANDANT_TIMING} or C{COMMANDANT_TRACE} environment
+variable is set.  Code marks phases with L{start_phase} and L{stop_phase},
+and work that runs concurrently with other phases, such as child processes
+and C{Deferred}s, with L{start_span} and L{stop_span}.  These do nothing
+when timing isn't enabled.  The L{Timer} prints a breakdown of the phases
+or writes them as a Chrome trace when the run finishes.
+"""
+
+import json
+import os
+import thread
+import threading
+
+try:
+    from time import monotonic as get_time
+except ImportError:
+    # Python 2 doesn't have a monotonic clock.
+    from time import time as get_time
+
+
+_timer = None
+
+
+def start_timing(start=None):
+    """Start recording phases with a new L{Timer}.
+
+    @param start: Optionally, the time the run started, as returned by
+        L{get_time}.  Defaults to now.
+    @return: The L{Timer}.
+    """
+    global _timer
+    _timer = Timer(start)
+    return _timer
+
+
+def stop_timing():
+    """Stop recording phases.
+
+    @return: The L{Timer} phases were recorded with, or C{None} if timing
+        wasn't enabled.
+    """
+    global _timer
+    timer = _timer
+    _timer = None
+    return timer
+
+
+def get_timer():
+    """Get the L{Timer} recording phases, or C{None} if timing is disabled.
+    """
+    return _timer
+
+
+def start_phase(name):
+    """Start a phase called C{name}, if timing is enabled.
+
+    @return: The L{Phase}, to be passed to L{stop_phase}, or C{None} if
+        timing is disabled.
+    """
+    if _timer is None:
+        return None
+    return _timer.start_phase(name)
+
+
+def stop_phase(phase):
+    """Stop a phase returned by L{start_phase}, unless it's C{None}."""
+    if phase is not None and _timer is not None:
+        _timer.stop_phase(phase)
+
+
+def start_span(name):
+    """Start a span called C{name} on its own track, if timing is enabled.
+
+    @return: The L{Phase}, to be passed to L{stop_span}, or C{None} if
+        timing is disabled.
+    """
+    if _timer is None:
+        return None
+    return _timer.start_span(name)
+
+
+def stop_span(span):
+    """Stop a span returned by L{start_span}, unless it's C{None}."""
+    if span is not None and _timer is not None:
+        _timer.stop_span(span)
+
+
+def get_process_start_time():
+    """Estimate when this process started, to time interpreter startup.
+
+    @return: A time comparable to those returned by L{get_time}, or C{None}
+        if it can't be determined on this platform.
+    """
+    try:
+        uptime = float(open("/proc/uptime").read().split()[0])
+        stat = open("/proc/self/stat").read()
+        # The start time is the 22nd field, counting the process name in
+        # parentheses, which may contain spaces, as the second.
+        ticks = int(stat[stat.rindex(")") + 2:].split()[19])
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+    return get_time() - (uptime - float(ticks) / ticks_per_second)
+
+
+class Phase(object):
+    """A named span of time in a L{Timer}.
+
+    @ivar name: The name of the phase.
+    @ivar start: The time the phase started, as returned by L{get_time}.
+    @ivar end: The time the phase ended, or C{None} if it hasn't.
+    @ivar depth: The number of phases the phase is nested in on its track.
+    @ivar track: The number of the track the phase is on.
+    """
+
+    def __init__(self, name, start, depth, end=None, track=1):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.depth = depth
+        self.track = track
+
+    def get_duration(self, now):
+        """Get the phase's duration, up to C{now} if it hasn't ended."""
+        end = self.end
+        if end is None:
+            end = now
+        return end - self.start
+
+
+class Timer(object):
+    """Record the phases of a run.
+
+    Phases are recorded on tracks.  Each thread has a track of its own, and
+    phases started while another is running on the same track are nested
+    in it.  Spans of concurrent work are put on tracks of their own, which
+    are reused once the spans on them stop.  The report shows the time
+    spent in each phase outside its nested phases as well as its total
+    time.
+
+    @ivar start: The time the run started.
+    @ivar phases: The L{Phase}s recorded, in the order they started.
+    """
+
+    def __init__(self, start=None):
+        if start is None:
+            start = get_time()
+        self.start = start
+        self.phases = []
+        self._lock = threading.Lock()
+        self._running = {}
+        self._thread_tracks = {thread.get_ident(): 1}
+        self._track_names = {1: "main"}
+        self._free_tracks = []
+
+    def _get_thread_track(self):
+        """Get the track for the current thread."""
+        ident = thread.get_ident()
+        track = self._thread_tracks.get(ident)
+        if track is None:
+            track = len(self._track_names) + 1
+            self._thread_tracks[ident] = track
+            self._track_names[track] = threading.currentThread().getName()
+        return track
+
+    def _allocate_span_track(self):
+        """Get the number of a track for a span, reusing free ones."""
+        if self._free_tracks:
+            return self._free_tracks.pop(0)
+        return len(self._track_names) + 1
+
+    def add_phase(self, name, start, end):
+        """
+        Record a phase that has already finished, such as one that ran
+        before the timer was created.
+        """
+        self._lock.acquire()
+        try:
+            track = self._get_thread_track()
+            depth = len(self._running.get(track, []))
+            self.phases.append(Phase(name, start, depth, end, track))
+        finally:
+            self._lock.release()
+
+    def start_phase(self, name):
+        """Start a phase called C{name} on the current thread's track.
+
+        @return: The new L{Phase}.
+        """
+        self._lock.acquire()
+        try:
+            track = self._get_thread_track()
+            running = self._running.setdefault(track, [])
+            phase = Phase(name, get_time(), len(running), track=track)
+            self.phases.append(phase)
+            running.append(phase)
+        finally:
+            self._lock.release()
+        return phase
+
+    def stop_phase(self, phase):
+        """Stop C{phase}, and any phases nested in it that are running."""
+        self._lock.acquire()
+        try:
+            phase.end = get_time()
+            running = self._running.get(phase.track, [])
+            if phase in running:
+                index = running.index(phase)
+                for nested_phase in running[index:]:
+                    if nested_phase.end is None:
+                        nested_phase.end = phase.end
+                del running[index:]
+        finally:
+            self._lock.release()
+
+    def start_span(self, name):
+        """
+        Start a span called C{name}, for work that runs concurrently with
+        other phases, on a track of its own.
+
+        @return: The new L{Phase}.
+        """
+        self._lock.acquire()
+        try:
+            track = self._allocate_span_track()
+            self._track_names[track] = "concurrent"
+            span = Phase(name, get_time(), 0, track=track)
+            self.phases.append(span)
+        finally:
+            self._lock.release()
+        return span
+
+    def stop_span(self, span):
+        """Stop C{span} and free its track for other spans."""
+        self._lock.acquire()
+        try:
+            if span.end is None:
+                span.end = get_time()
+                self._free_tracks.append(span.track)
+                self._free_tracks.sort()
+        finally:
+            self._lock.release()
+
+    def report(self, stream):
+        """Write a breakdown of the recorded phases to C{stream}."""
+        now = get_time()
+        print >>stream, "%10s %10s  %s" % ("total ms", "self ms", "phase")
+        for i, phase in enumerate(self.phases):
+            duration = phase.get_duration(now)
+            nested = 0
+            for other in self.phases[i + 1:]:
+                if other.track != phase.track:
+                    continue
+                if other.depth <= phase.depth:
+                    break
+                if other.depth == phase.depth + 1:
+                    nested += other.get_duration(now)
+            print >>stream, "%10.1f %10.1f  %s%s" % (
+                duration * 1000, (duration - nested) * 1000,
+                "  " * phase.depth, phase.name)
+        print >>stream, "%10.1f %10s  %s" % ((now - self.start) * 1000, "",
+                                              "total")
+
+    def get_trace_events(self):
+        """Get the recorded phases as Chrome trace events.
+
+        Each phase is a complete event with its start time and duration in
+        microseconds since the start of the run, and each track is a
+        thread named with a metadata event.
+        """
+        now = get_time()
+        pid = os.getpid()
+        events = []
+        for track, name in sorted(self._track_names.iteritems()):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid,
+                           "tid": track, "args": {"name": name}})
+        for phase in self.phases:
+            events.append({
+                "name": phase.name, "cat": "commandant", "ph": "X",
+                "ts": int((phase.start - self.start) * 1000000),
+                "dur": int(phase.get_duration(now) * 1000000),
+                "pid": pid, "tid": phase.track})
+        return events
+
+    def write_trace(self, stream):
+        """Write the recorded phases to C{stream} as a Chrome trace.
+
+        The trace can be loaded into C{chrome://tracing} or any other viewer
+        that reads the trace event format.
+        """
+        json.dump({"traceEvents": self.get_trace_events(),
+                   "displayTimeUnit": "ms"}, stream)
@@ -1,26 +1,13 @@
 #!/bin/bash
 
-# Template based on bzr.simple for enabling bash completion for
-# Commandant programs.
-
-_example_commands()
-{
-     example help commands | sed -r 's/^([-[:alnum:]]*).*/\1/' | grep '^[[:alnum:]]'
-}
+# Enable bash completion for the example Commandant program.  Candidates
+# come from the builtin complete command, which answers from a cached
+# index of command and help topic names.
 
 _example()
 {
-    cur=${COMP_WORDS[COMP_CWORD]}
-    prev=${COMP_WORDS[COMP_CWORD-1]}
-    if [ $COMP_CWORD -eq 1 ]; then
-        COMPREPLY=( $( compgen -W "$(_example_commands)" $cur ) )
-    elif [ $COMP_CWORD -eq 2 ]; then
-        case "$prev" in
-        help)
-            COMPREPLY=( $( compgen -W "$(_example_commands) commands" $cur ) )
-            ;;
-        esac
-    fi
+    COMPREPLY=( $( example complete -- \
+                   "${COMP_WORDS[@]:1:COMP_CWORD}" 2>/dev/null ) )
 }
 
 complete -F _example -o default example